@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+# stdlib
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from typing import Callable, Iterator
+
+# package
+from packagerbuddy import cli, downloadutils, indexutils, installutils, settings, trashutils
+
+VERSION = "1.0.0"
+FILES_PER_DIR = 1000
+
+# name: (file count, file size), sizes are scaled with --scale
+PROFILES = {
+    "large": (4, 16 * 1024 * 1024),
+    "medium": (1000, 16 * 1024),
+    "tiny": (100000, 64),
+}
+FORMATS = {
+    "zip": ".zip",
+    "gz": ".tar.gz",
+    "bz2": ".tar.bz2",
+}
+
+
+# ==============================================================================
+# http server
+# ==============================================================================
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        return
+
+    def do_GET(self) -> None:
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start >= size:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        with open(path, "rb") as fp:
+            fp.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = fp.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+@contextlib.contextmanager
+def serve(directory: str) -> Iterator[str]:
+    handler = functools.partial(RangeRequestHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# ==============================================================================
+# archives
+# ==============================================================================
+def build_content(rng: random.Random, size: int) -> bytes:
+    # half incompressible, half repetitive, roughly what binaries and resources in a release look like
+    half = size // 2
+    noise = rng.getrandbits(half * 8).to_bytes(half, "little") if half else b""
+    text = b"packagerbuddy benchmark data\n" * (size // 29 + 1)
+    return noise + text[: size - half]
+
+
+def iter_members(profile: str, root: str, scale: float) -> Iterator[tuple[str, bytes]]:
+    count, size = PROFILES[profile]
+    size = max(1, int(size * scale))
+    rng = random.Random(profile)
+    for index in range(count):
+        name = f"{root}/data/{index // FILES_PER_DIR:03d}/file-{index}.bin"
+        yield name, build_content(rng, size)
+
+
+def write_archive(path: str, fmt: str, members: Iterator[tuple[str, bytes]]) -> int:
+    count = 0
+    if fmt == "zip":
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as fp:
+            for name, data in members:
+                fp.writestr(name, data)
+                count += 1
+        return count
+
+    with tarfile.open(path, f"w:{fmt}") as fp:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = 0
+            fp.addfile(info, io.BytesIO(data))
+            count += 1
+    return count
+
+
+def build_software(profile: str, fmt: str) -> str:
+    return f"{profile}_{fmt}"
+
+
+def generate_archives(directory: str, profiles: list[str], formats: list[str], scale: float) -> dict[str, dict]:
+    archives: dict[str, dict] = {}
+    for profile in profiles:
+        for fmt in formats:
+            software = build_software(profile, fmt)
+            root = f"{software}-{VERSION}"
+            path = os.path.join(directory, root + FORMATS[fmt])
+
+            start = time.perf_counter()
+            count = write_archive(path, fmt, iter_members(profile, root, scale))
+            print(f"generated {os.path.basename(path)} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+            archives[software] = {"path": path, "files": count, "size": os.path.getsize(path)}
+    return archives
+
+
+# ==============================================================================
+# benchmarks
+# ==============================================================================
+def timed(func: Callable, *args, **kwargs) -> tuple[float, object]:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        try:
+            result = func(*args, **kwargs)
+        except SystemExit:
+            result = None
+    return time.perf_counter() - start, result
+
+
+def reset(workspace: str) -> None:
+    for name in ("downloaded", "installed", "scripts"):
+        path = os.path.join(workspace, name)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    settings.DIR_DOWNLOAD = os.path.join(workspace, "downloaded")
+    settings.DIR_INSTALL = os.path.join(workspace, "installed")
+    settings.DIR_SCRIPTS = os.path.join(workspace, "scripts")
+
+
+def bench_install_phases(software: str, config: dict[str, str], workspace: str) -> dict[str, float]:
+    reset(workspace)
+    phases: dict[str, float] = {}
+
+    phases["download"], archive = timed(downloadutils.get_archive, software, VERSION, config)
+
+    dir_temp = installutils.build_temporary_install_path(software, VERSION)
+    os.makedirs(dir_temp)
+    root = installutils.get_archive_name(software, VERSION, config)
+    phases["unarchive"], stripped = timed(installutils.unarchive, archive, dir_temp, root)
+
+    phases["cleanup"], _ = timed(installutils.cleanup, config, software, VERSION, stripped)
+    phases["register"], _ = timed(indexutils.register_software, software, VERSION)
+
+    dir_install = installutils.build_install_path(software, VERSION)
+    phases["uninstall"], _ = timed(installutils.uninstall_software, dir_install)
+    phases["purge"], _ = timed(trashutils.purge)
+    return phases
+
+
+def bench_install(software: str, config: dict[str, str], workspace: str) -> float:
+    reset(workspace)
+    elapsed, _ = timed(cli.install_software, [software], [VERSION])
+    if not indexutils.is_software_installed(software, VERSION):
+        raise RuntimeError(f"failed to install {software}")
+    return elapsed
+
+
+def populate_install_root(entries: int) -> None:
+    # installs only need a directory to be listed, fill each with a single file
+    for index in range(entries):
+        path = os.path.join(settings.DIR_INSTALL, f"app{index}-{VERSION}")
+        os.makedirs(path)
+        with open(os.path.join(path, "app.txt"), "w") as fp:
+            fp.write("app")
+
+
+def bench_install_root(entries: int, workspace: str) -> dict[str, float]:
+    reset(workspace)
+    populate_install_root(entries)
+    results: dict[str, float] = {}
+
+    results["list_cold"], _ = timed(cli.list_installed_software)
+    results["list_warm"], _ = timed(cli.list_installed_software)
+    results["list_filtered"], _ = timed(cli.list_installed_software, "app1*")
+    results["uninstall_one"], _ = timed(cli.uninstall_software, "app0", VERSION)
+    results["uninstall_many"], _ = timed(cli.uninstall_software, "app1*")
+    results["purge"], _ = timed(trashutils.purge)
+    results["remaining"] = len(indexutils.find_installed_software())
+    return results
+
+
+def run_benchmarks(args: argparse.Namespace, workspace: str) -> dict:
+    www = os.path.join(workspace, "www")
+    os.makedirs(www)
+    archives = generate_archives(www, args.profiles, args.formats, args.scale)
+
+    # settings are read once at import, point them at the workspace
+    # and purge uninstalled software in the foreground to time it
+    settings.BACKGROUND_PURGE = False
+    settings.FILE_CONFIG = os.path.join(workspace, "config", "software.json")
+    os.makedirs(os.path.dirname(settings.FILE_CONFIG))
+
+    results: list[dict] = []
+    with serve(www) as url:
+        config = {
+            software: f"{url}/{software}-{{version}}{FORMATS[software.partition('_')[2]]}" for software in archives
+        }
+        with open(settings.FILE_CONFIG, "w") as fp:
+            json.dump(config, fp)
+
+        for software, archive in archives.items():
+            result = {"name": "install", "software": software, "files": archive["files"], "size": archive["size"]}
+            runs = [bench_install_phases(software, config, workspace) for _ in range(args.repeat)]
+            result["phases"] = {phase: min(run[phase] for run in runs) for phase in runs[0]}
+            result["total"] = min(bench_install(software, config, workspace) for _ in range(args.repeat))
+            phases = " ".join(f"{phase} {elapsed:.3f}s" for phase, elapsed in result["phases"].items())
+            print(f"{software}: {phases} total {result['total']:.3f}s", file=sys.stderr)
+            results.append(result)
+
+    runs = [bench_install_root(args.entries, workspace) for _ in range(args.repeat)]
+    result = {"name": "install_root", "entries": args.entries}
+    result.update({key: min(run[key] for run in runs) for key in runs[0]})
+    print(f"install root: {json.dumps(result)}", file=sys.stderr)
+    results.append(result)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "settings": {
+            "DOWNLOAD_SEGMENTS": settings.DOWNLOAD_SEGMENTS,
+            "EXTRACT_WORKERS": settings.EXTRACT_WORKERS,
+            "EXTERNAL_DECOMPRESSORS": settings.EXTERNAL_DECOMPRESSORS,
+            "STORE": settings.STORE,
+        },
+        "results": results,
+    }
+
+
+# ==============================================================================
+# parser
+# ==============================================================================
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks of packagerbuddy installs.")
+
+    help = "archive profiles to benchmark"
+    parser.add_argument("-p", "--profiles", help=help, nargs="+", choices=list(PROFILES), default=list(PROFILES))
+
+    help = "archive formats to benchmark"
+    parser.add_argument("-f", "--formats", help=help, nargs="+", choices=list(FORMATS), default=list(FORMATS))
+
+    help = "factor applied to the file sizes of every profile"
+    parser.add_argument("-x", "--scale", help=help, type=float, default=1.0)
+
+    help = "number of installed software in the list and uninstall benchmark"
+    parser.add_argument("-e", "--entries", help=help, type=int, default=5000)
+
+    help = "number of runs per benchmark, the fastest run is reported"
+    parser.add_argument("-r", "--repeat", help=help, type=int, default=1)
+
+    help = "json file to write the results to, defaults to stdout"
+    parser.add_argument("-o", "--output", help=help, required=False)
+
+    return parser
+
+
+def run(args: list[str] | None = None) -> None:
+    namespace = build_parser().parse_args(args)
+    with tempfile.TemporaryDirectory(prefix="packagerbuddy-bench-") as workspace:
+        report = run_benchmarks(namespace, workspace)
+
+    data = json.dumps(report, indent=2)
+    if namespace.output:
+        with open(namespace.output, "w") as fp:
+            fp.write(data + "\n")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,321 @@
+# stdlib
+import hashlib
+import json
+import os
+import shutil
+import time
+
+# package
+from packagerbuddy import configutils, fileutils, indexutils, pathutils, settings
+
+# response headers of the upstream url stored with each archive, to revalidate it later
+VALIDATORS = ("etag", "modified", "length")
+
+# parsed download index per path, reused for lookups as long as the file is not replaced
+INDEX_CACHE: dict[str, tuple[tuple[int, int, int], dict]] = {}
+
+
+def build_cache_path() -> str:
+    return os.path.join(settings.DIR_DOWNLOAD, ".cache")
+
+
+def build_blob_path(digest: str) -> str:
+    return os.path.join(build_cache_path(), "blobs", digest)
+
+
+def build_url_path(url: str) -> str:
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(build_cache_path(), "urls", key)
+
+
+def find_blob(url: str) -> str | None:
+    path = build_url_path(url)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as fp:
+        digest = fp.read().strip()
+
+    blob = build_blob_path(digest)
+    if os.path.exists(blob):
+        return blob
+    return None
+
+
+def add_blob(path: str, url: str, digest: str) -> str:
+    blob = build_blob_path(digest)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    # replacing an existing blob would unlink it from the archives sharing its inode
+    if os.path.exists(blob):
+        os.remove(path)
+    else:
+        os.replace(path, blob)
+
+    fileutils.write_atomic(build_url_path(url), digest)
+
+    return blob
+
+
+def is_verified(archive: str, digest: str | None) -> bool:
+    if digest is None:
+        return True
+
+    # blobs are named after their content digest, sharing an inode proves the archive matches
+    blob = build_blob_path(digest)
+    if os.path.exists(blob) and os.path.samefile(archive, blob):
+        return True
+
+    # copied from the blob on file systems without hardlink support
+    sha256 = hashlib.sha256()
+    fileutils.hash_file(archive, sha256)
+    return sha256.hexdigest() == digest
+
+
+def link(blob: str, archive: str) -> None:
+    if os.path.exists(archive):
+        if os.path.samefile(blob, archive):
+            return
+        os.remove(archive)
+
+    try:
+        os.link(blob, archive)
+    except OSError:
+        # file system without hardlink support
+        shutil.copyfile(blob, archive)
+
+
+def build_index_path() -> str:
+    return os.path.join(settings.DIR_DOWNLOAD, ".index.json")
+
+
+def scan_archives(config: dict | None = None) -> dict[str, dict[str, dict]]:
+    index: dict[str, dict[str, dict]] = {}
+    if not os.path.exists(settings.DIR_DOWNLOAD):
+        return index
+
+    for entry in os.scandir(settings.DIR_DOWNLOAD):
+        if entry.name.startswith(".") or not entry.is_file():
+            continue
+        name, ext = pathutils.split_ext(entry.name)
+        if not ext:
+            continue
+
+        software, version = indexutils.split_install_name(name, config)
+        url, digest = None, None
+        if config and software in config:
+            url = configutils.get_url(config, software).format(version=version)
+            # archives downloaded through the cache share their inode with the blob named after their digest
+            blob = find_blob(url)
+            if blob is not None and os.path.samefile(blob, entry.path):
+                digest = os.path.basename(blob)
+
+        stat = entry.stat()
+        index.setdefault(software, {})[version] = {
+            "archive": entry.name,
+            "url": url,
+            "sha256": digest,
+            "size": stat.st_size,
+            "used": stat.st_mtime,
+        }
+    return index
+
+
+def read_index(config: dict | None = None) -> dict[str, dict[str, dict]]:
+    path = build_index_path()
+    index = fileutils.load_json(path)
+    if index is None:
+        if config is None and os.path.exists(settings.FILE_CONFIG):
+            config = configutils.load()
+        index = scan_archives(config)
+        fileutils.dump_json(path, index)
+    return index
+
+
+def load_index() -> dict[str, dict[str, dict]]:
+    # shared between lookups, callers must not modify it
+    path = build_index_path()
+    if not os.path.exists(path):
+        read_index()
+
+    stat = os.stat(path)
+
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = INDEX_CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    index = fileutils.load_json(path, {})
+    INDEX_CACHE[path] = (key, index)
+    return index
+
+
+def reindex(config: dict | None = None) -> dict[str, dict[str, dict]]:
+    path = build_index_path()
+    with fileutils.lock(path + ".lock"):
+        index = scan_archives(config)
+        fileutils.dump_json(path, index)
+    return index
+
+
+def register_archive(
+    software: str,
+    version: str,
+    url: str,
+    archive: str,
+    digest: str | None,
+    validators: dict[str, str | int | None] | None = None,
+) -> None:
+    path = build_index_path()
+    with fileutils.lock(path + ".lock"):
+        index = read_index()
+        entry = {
+            "archive": os.path.basename(archive),
+            "url": url,
+            "sha256": digest,
+            "size": os.path.getsize(archive),
+            "used": time.time(),
+        }
+
+        # an archive linked from a cached blob still matches the validators of its previous download
+        previous = index.get(software, {}).get(version)
+        if validators is None and previous is not None and (previous["url"], previous["sha256"]) == (url, digest):
+            validators = {key: previous.get(key) for key in VALIDATORS}
+        entry.update(validators or {})
+
+        index.setdefault(software, {})[version] = entry
+        fileutils.dump_json(path, index)
+
+
+def find_entry(software: str, version: str) -> dict | None:
+    return load_index().get(software, {}).get(version)
+
+
+def build_usage_path() -> str:
+    return os.path.join(settings.DIR_DOWNLOAD, ".usage")
+
+
+def touch(software: str, version: str) -> None:
+    # appending a line is cheaper than rewriting the index on every cache hit, collect folds it in
+    line = json.dumps([software, version, time.time()]) + "\n"
+    fd = os.open(build_usage_path(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+def read_usage(path: str) -> dict[tuple[str, str], float]:
+    usage: dict[tuple[str, str], float] = {}
+    if not os.path.exists(path):
+        return usage
+
+    with open(path, "r") as fp:
+        for line in fp:
+            try:
+                software, version, used = json.loads(line)
+            except ValueError:
+                # line cut short by a crashed process
+                continue
+            usage[(software, version)] = max(used, usage.get((software, version), used))
+    return usage
+
+
+def find_pinned() -> set[tuple[str, str]]:
+    return {(entry["software"], entry["version"]) for entry in indexutils.load_index().values()}
+
+
+def remove_archive(entry: dict) -> None:
+    archive = os.path.join(settings.DIR_DOWNLOAD, entry["archive"])
+    if os.path.exists(archive):
+        os.remove(archive)
+
+    if entry.get("sha256") is not None:
+        release_blob(entry["sha256"], entry.get("url"))
+
+
+def release_blob(digest: str, url: str | None = None) -> None:
+    # the blob is only freed once no archive links to it anymore
+    blob = build_blob_path(digest)
+    if not os.path.exists(blob) or os.stat(blob).st_nlink > 1:
+        return
+    os.remove(blob)
+
+    # the url now points at a missing blob, drop it
+    if url and find_blob(url) is None and os.path.exists(build_url_path(url)):
+        os.remove(build_url_path(url))
+
+
+def collect(
+    max_size: int = 0,
+    max_age: float = 0,
+    pinned: set[tuple[str, str]] | None = None,
+    dry_run: bool = False,
+) -> list[str]:
+    path = build_index_path()
+    usage_path = build_usage_path()
+    pinned = pinned or set()
+
+    with fileutils.lock(path + ".lock"):
+        index = read_index()
+
+        # hits recorded while collecting end up in a new usage file
+        collecting = usage_path if dry_run else f"{usage_path}.collect"
+        if os.path.exists(usage_path) and not dry_run:
+            os.replace(usage_path, collecting)
+        usage = read_usage(collecting)
+
+        entries: list[tuple[float, str, str, dict]] = []
+        for software, versions in index.items():
+            for version, entry in list(versions.items()):
+                if not os.path.exists(os.path.join(settings.DIR_DOWNLOAD, entry["archive"])):
+                    del versions[version]
+                    continue
+                entry["used"] = max(entry.get("used", 0), usage.get((software, version), 0))
+                entries.append((entry["used"], software, version, entry))
+
+        # least recently used first
+        entries.sort(key=lambda item: item[0])
+        total = sum(entry.get("size", 0) for *_, entry in entries)
+        cutoff = time.time() - max_age if max_age else 0
+
+        removed: list[str] = []
+        for used, software, version, entry in entries:
+            if (software, version) in pinned:
+                continue
+            if used >= cutoff and (not max_size or total <= max_size):
+                continue
+
+            removed.append(os.path.join(settings.DIR_DOWNLOAD, entry["archive"]))
+            total -= entry.get("size", 0)
+            if dry_run:
+                continue
+            remove_archive(entry)
+            del index[software][version]
+            if not index[software]:
+                del index[software]
+
+        if not dry_run:
+            fileutils.dump_json(path, index)
+            if os.path.exists(collecting):
+                os.remove(collecting)
+
+    return removed
+
+
+def auto_collect(keep: set[tuple[str, str]] | None = None) -> list[str]:
+    if not settings.CACHE_MAX_SIZE and not settings.CACHE_MAX_AGE:
+        return []
+
+    max_size = int(settings.CACHE_MAX_SIZE * 1024 * 1024)
+    max_age = settings.CACHE_MAX_AGE * 24 * 60 * 60
+
+    # usage only ever makes archives more recent, the cached index tells when there is nothing to collect
+    entries = [entry for versions in load_index().values() for entry in versions.values()]
+    if not entries:
+        return []
+    over_size = max_size and sum(entry.get("size", 0) for entry in entries) > max_size
+    expired = max_age and min(entry.get("used", 0) for entry in entries) < time.time() - max_age
+    if not over_size and not expired:
+        return []
+
+    return collect(max_size, max_age, find_pinned() | (keep or set()))
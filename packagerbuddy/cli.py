@@ -2,16 +2,23 @@
 
 # stdlib
 import argparse
+import functools
 import os
+import sys
 
 # package
-from packagerbuddy import configutils, downloadutils, installutils, scriptutils, settings
+from packagerbuddy import settings
+
+# actions import the modules they need themselves, commands like avail and list are run from shell prompts and
+# should not pay for loading the archive, network and subprocess modules
 
 
 # ==============================================================================
 # actions
 # ==============================================================================
 def setup():
+    from packagerbuddy import configutils
+
     dirs = [
         settings.DIR_CONFIG,
         settings.DIR_DOWNLOAD,
@@ -29,47 +36,69 @@ def setup():
 
 
 def list_available_software() -> None:
+    from packagerbuddy import configutils
+
     config = configutils.load()
     available = sorted(config.keys())
     print("\n".join(available))
 
 
-def add_software(software: str, url: str) -> None:
-    if not software.strip():
-        print("no software provided")
-        exit(1)
+def add_software(software: str | None = None, url: str | None = None, file: str | None = None) -> None:
+    from packagerbuddy import configutils
 
-    if not url.strip():
-        print("no url provided")
-        exit(1)
+    entries = configutils.load_entries(file) if file else {software or "": url or ""}
 
-    config = configutils.load()
+    for name in entries:
+        if not name.strip():
+            print("no software provided")
+            exit(1)
 
-    if configutils.is_software_configured(config, software):
-        print("software already configured")
-        exit(1)
+        if not configutils.get_url(entries, name).strip():
+            print("no url provided")
+            exit(1)
 
-    if r"{version}" not in url:
-        print(r"no {version} format string found in url")
-        exit(1)
+    # checked under the config lock, concurrent adds of the same software can not overwrite each other
+    with configutils.transaction() as config:
+        for name in entries:
+            if configutils.is_software_configured(config, name):
+                print("software already configured")
+                exit(1)
 
-    configutils.add_software(config, software, url)
+            if r"{version}" not in configutils.get_url(entries, name):
+                print(r"no {version} format string found in url")
+                exit(1)
 
+        config.update(entries)
 
-def remove_software(software: str) -> None:
-    if not software.strip():
-        print("no software provided")
-        exit(1)
+
+def remove_software(software: str | None = None, file: str | None = None) -> None:
+    from packagerbuddy import configutils
+
+    names = list(configutils.load_entries(file)) if file else [software or ""]
+
+    for name in names:
+        if not name.strip():
+            print("no software provided")
+            exit(1)
 
     config = configutils.load()
-    if not configutils.is_software_configured(config, software):
-        print("software not found")
-        exit(1)
+    for name in names:
+        if not configutils.is_software_configured(config, name):
+            print("software not found")
+            exit(1)
+
+    configutils.remove_software_batch(config, names)
 
-    configutils.remove_software(config, software)
 
+def download_software(
+    software: str,
+    version: str,
+    profile: str | None = None,
+    cprofile: str | None = None,
+    refresh: bool = False,
+) -> None:
+    from packagerbuddy import cacheutils, configutils, downloadutils, progressutils, traceutils
 
-def download_software(software: str, version: str) -> None:
     if not software.strip():
         print("no software provided")
         exit(1)
@@ -79,73 +108,255 @@ def download_software(software: str, version: str) -> None:
         print("software not found")
         exit(1)
 
-    archive = downloadutils.find_archive(software, version)
-    if archive is not None:
-        print(archive)
-        return
-
-    archive = downloadutils.download(software, version, config)
+    traceutils.configure(trace=profile, cprofile=cprofile)
+    with traceutils.profile(settings.CPROFILE):
+        progress = progressutils.create_renderer()
+        archive = downloadutils.get_archive(software, version, config, progress=progress, refresh=refresh)
+    traceutils.export()
     print(archive)
 
+    cacheutils.auto_collect(keep={(software, version)})
 
-def install_software(software: str, version: str) -> None:
-    if not software.strip():
+
+def reclaim_installs() -> None:
+    from packagerbuddy import installutils, trashutils
+
+    # temporary directories of crashed installs that can not be resumed
+    if installutils.reclaim() and settings.BACKGROUND_PURGE:
+        trashutils.spawn_purge()
+
+
+def report_installs(
+    packages: list[tuple[str, str]], results: dict[tuple[str, str], str | BaseException], prefix: str = ""
+) -> bool:
+    from packagerbuddy import cacheutils
+
+    failed = False
+    for package in packages:
+        result = results[package]
+        if isinstance(result, BaseException):
+            failed = True
+            print(f"failed to install {package[0]} {package[1]}: {result}")
+        else:
+            print(f"{prefix}{result}")
+
+    # collect after installing, archives of the new installs are pinned
+    cacheutils.auto_collect()
+    return failed
+
+
+def install_software(
+    software: list[str] | None = None,
+    version: list[str] | None = None,
+    manifest: str | None = None,
+    profile: str | None = None,
+    cprofile: str | None = None,
+    refresh: bool = False,
+    stream: bool = False,
+) -> None:
+    from packagerbuddy import configutils, installutils, progressutils, traceutils
+
+    packages = list(zip(software or [], version or []))
+    if len(software or []) != len(version or []):
+        print("software and version arguments do not pair up")
+        exit(1)
+
+    if manifest:
+        packages.extend(configutils.load_manifest(manifest))
+
+    if not packages:
         print("no software provided")
         exit(1)
 
     config = configutils.load()
-    if not configutils.is_software_configured(config, software):
-        print("software not found")
+    for name, _ in packages:
+        if not name.strip():
+            print("no software provided")
+            exit(1)
+
+        if not configutils.is_software_configured(config, name):
+            print("software not found")
+            exit(1)
+
+    reclaim_installs()
+
+    if stream:
+        settings.STREAM_INSTALL = True
+
+    traceutils.configure(trace=profile, cprofile=cprofile)
+    with traceutils.profile(settings.CPROFILE):
+        progress = progressutils.create_renderer()
+        results = installutils.install_packages(packages, config, progress=progress, refresh=refresh)
+    traceutils.export()
+
+    if report_installs(list(dict.fromkeys(packages)), results):
+        exit(1)
+
+
+def sync_software(
+    manifest: str,
+    prune: bool = False,
+    workers: int | None = None,
+    dry_run: bool = False,
+) -> None:
+    from packagerbuddy import configutils, indexutils
+
+    if workers is not None and workers < 1:
+        print("workers must be at least 1")
         exit(1)
 
-    if installutils.is_software_installed(software, version):
-        dir_install = installutils.build_install_path(software, version)
-        print(dir_install)
+    # an up to date install root only costs reading the manifest and the index
+    missing, unlisted = indexutils.plan_sync(configutils.load_manifest(manifest), prune)
+    if not missing and not unlisted:
         return
 
-    archive = downloadutils.find_archive(software, version)
-    if archive is None:
-        archive = downloadutils.download(software, version, config)
+    if missing:
+        config = configutils.load()
+        for name, _ in missing:
+            if not configutils.is_software_configured(config, name):
+                print(f"software not found: {name}")
+                exit(1)
+
+    if dry_run:
+        for software, version in missing:
+            print(f"+ {os.path.join(settings.DIR_INSTALL, indexutils.build_install_name(software, version))}")
+        for installed in unlisted:
+            print(f"- {installed}")
+        return
 
-    dir_temp = installutils.build_temporary_install_path(software, version)
-    os.makedirs(dir_temp, exist_ok=True)
+    from packagerbuddy import installutils, progressutils, trashutils
 
-    installutils.unarchive(archive, dir_temp)
+    if workers is not None:
+        settings.INSTALL_WORKERS = settings.DOWNLOAD_WORKERS = workers
 
-    dir_install = installutils.build_install_path(software, version)
-    os.makedirs(dir_install, exist_ok=True)
+    reclaim_installs()
 
-    installutils.cleanup(config, software, version)
+    # install before pruning, a failing install does not leave the role without its previous version
+    failed = False
+    if missing:
+        results = installutils.install_packages(missing, config, progress=progressutils.create_renderer())
+        failed = report_installs(missing, results, prefix="+ ")
 
-    scripts = scriptutils.find_scripts(software, version)
-    for script in scripts:
-        scriptutils.run_script(script, software, version, wd=dir_install)
+    if unlisted:
+        installutils.uninstall_packages(unlisted)
+        for installed in unlisted:
+            print(f"- {installed}")
+        if settings.BACKGROUND_PURGE:
+            trashutils.spawn_purge()
 
-    print(dir_install)
+    if failed:
+        exit(1)
 
 
 def uninstall_software(software: str, version: str | None = None) -> None:
+    from packagerbuddy import indexutils, installutils, trashutils
+
     if not software.strip():
         print("no software provided")
         exit(1)
 
-    installed_dirs = installutils.find_installed_software(software=software, version=version)
+    installed_dirs = indexutils.find_installed_software(software=software, version=version)
+    installutils.uninstall_packages(installed_dirs)
     for installed in installed_dirs:
-        installutils.uninstall_software(installed)
         print(installed)
 
+    if installed_dirs and settings.BACKGROUND_PURGE:
+        trashutils.spawn_purge()
+
+
+def purge_uninstalled_software(workers: int | None = None) -> None:
+    from packagerbuddy import trashutils
+
+    if workers is not None and workers < 1:
+        print("workers must be at least 1")
+        exit(1)
+
+    trashutils.purge(workers)
+
 
 def list_installed_software(software: str | None = None, version: str | None = None) -> None:
-    installed = installutils.find_installed_software(software=software, version=version)
+    from packagerbuddy import indexutils
+
+    installed = indexutils.find_installed_software(software=software, version=version)
+    print("\n".join(installed))
+
+
+def reindex_installed_software(downloads: bool = False) -> None:
+    from packagerbuddy import cacheutils, configutils, indexutils
+
+    config = configutils.load()
+    if downloads:
+        index = cacheutils.reindex(config)
+        archives = [entry["archive"] for versions in index.values() for entry in versions.values()]
+        print("\n".join(os.path.join(settings.DIR_DOWNLOAD, archive) for archive in sorted(archives)))
+        return
+
+    indexutils.reindex(config)
+    installed = indexutils.find_installed_software()
     print("\n".join(installed))
 
 
+def collect_downloads(max_size: float | None = None, max_age: float | None = None, dry_run: bool = False) -> None:
+    from packagerbuddy import cacheutils
+
+    max_size = settings.CACHE_MAX_SIZE if max_size is None else max_size
+    max_age = settings.CACHE_MAX_AGE if max_age is None else max_age
+    if max_size < 0 or max_age < 0:
+        print("limits can not be negative")
+        exit(1)
+
+    removed = cacheutils.collect(
+        max_size=int(max_size * 1024 * 1024),
+        max_age=max_age * 24 * 60 * 60,
+        pinned=cacheutils.find_pinned(),
+        dry_run=dry_run,
+    )
+    print("\n".join(removed))
+
+
+def serve_downloads(host: str = "0.0.0.0", port: int = 8000, quiet: bool = False) -> None:
+    from packagerbuddy import serveutils
+
+    if not os.path.isdir(settings.DIR_DOWNLOAD):
+        print("download directory not found")
+        exit(1)
+
+    server = serveutils.create_server(host, port, quiet=quiet)
+    print(f"serving {settings.DIR_DOWNLOAD} on http://{host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
 # ==============================================================================
 # parser
 # ==============================================================================
+def get_terminal_width() -> int:
+    try:
+        return int(os.environ["COLUMNS"])
+    except (KeyError, ValueError):
+        pass
+
+    try:
+        return os.get_terminal_size(sys.__stdout__.fileno()).columns
+    except (AttributeError, ValueError, OSError):
+        return 80
+
+
+class HelpFormatter(argparse.HelpFormatter):
+    # argparse imports shutil to look up the terminal width every time an argument is added
+    def __init__(self, prog: str, indent_increment: int = 2, max_help_position: int = 24, width: int | None = None):
+        width = get_terminal_width() - 2 if width is None else width
+        super().__init__(prog, indent_increment, max_help_position, width)
+
+
 def build_parser():
-    parser = argparse.ArgumentParser()
-    subparsers = parser.add_subparsers()
+    parser_class = functools.partial(argparse.ArgumentParser, formatter_class=HelpFormatter)
+    parser = parser_class()
+    subparsers = parser.add_subparsers(parser_class=parser_class)
 
     # ==========================================================================
     # setup
@@ -170,6 +381,12 @@ def build_parser():
     help = "download url template"
     req_args.add_argument("-u", "--url", help=help)
 
+    # optional arguments
+    opt_args = parser_add.add_argument_group("optional arguments")
+
+    help = "json file mapping software names to config entries, added in one transaction"
+    opt_args.add_argument("-f", "--file", help=help, required=False)
+
     # ==========================================================================
     # remove
     # ==========================================================================
@@ -181,6 +398,12 @@ def build_parser():
     req_args = parser_remove.add_argument_group("required arguments")
     req_args.add_argument("-s", "--software", help="name of the software")
 
+    # optional arguments
+    opt_args = parser_remove.add_argument_group("optional arguments")
+
+    help = "json file listing software names, removed in one transaction"
+    opt_args.add_argument("-f", "--file", help=help, required=False)
+
     # ==========================================================================
     # avail
     # ==========================================================================
@@ -204,6 +427,18 @@ def build_parser():
     help = "version of the software"
     req_args.add_argument("-v", "--version", help=help)
 
+    # optional arguments
+    opt_args = parser_download.add_argument_group("optional arguments")
+
+    help = "file to write timing spans to, as chrome trace when it ends in .json, json lines otherwise"
+    opt_args.add_argument("--profile", help=help, required=False)
+
+    help = "file to dump cprofile stats to"
+    opt_args.add_argument("--cprofile", help=help, required=False)
+
+    help = "revalidate a downloaded archive with the server and download it again when it changed"
+    opt_args.add_argument("-r", "--refresh", help=help, action="store_true")
+
     # ==========================================================================
     # install
     # ==========================================================================
@@ -214,11 +449,54 @@ def build_parser():
     # required arguments
     req_args = parser_install.add_argument_group("required arguments")
 
-    help = "name of the software"
-    req_args.add_argument("-s", "--software", help=help)
+    help = "name of the software, repeat to install multiple packages"
+    req_args.add_argument("-s", "--software", help=help, action="append")
 
-    help = "version of the software"
-    req_args.add_argument("-v", "--version", help=help)
+    help = "version of the software, repeat to install multiple packages"
+    req_args.add_argument("-v", "--version", help=help, action="append")
+
+    # optional arguments
+    opt_args = parser_install.add_argument_group("optional arguments")
+
+    help = "json file mapping software names to one or more versions"
+    opt_args.add_argument("-m", "--manifest", help=help, required=False)
+
+    help = "file to write timing spans to, as chrome trace when it ends in .json, json lines otherwise"
+    opt_args.add_argument("--profile", help=help, required=False)
+
+    help = "file to dump cprofile stats to, install workers dump theirs next to it"
+    opt_args.add_argument("--cprofile", help=help, required=False)
+
+    help = "revalidate downloaded archives with the server and download them again when they changed"
+    opt_args.add_argument("-r", "--refresh", help=help, action="store_true")
+
+    help = "extract tar archives while they download instead of after"
+    opt_args.add_argument("--stream", help=help, action="store_true")
+
+    # ==========================================================================
+    # sync
+    # ==========================================================================
+    help = "install the software versions of a manifest that are not installed yet"
+    parser_sync = subparsers.add_parser("sync", help=help)
+    parser_sync.set_defaults(func=sync_software)
+
+    # required arguments
+    req_args = parser_sync.add_argument_group("required arguments")
+
+    help = "json file mapping software names to one or more versions"
+    req_args.add_argument("-m", "--manifest", help=help, required=True)
+
+    # optional arguments
+    opt_args = parser_sync.add_argument_group("optional arguments")
+
+    help = "uninstall installed software versions not listed in the manifest"
+    opt_args.add_argument("-p", "--prune", help=help, action="store_true")
+
+    help = "maximum number of parallel downloads and extractions"
+    opt_args.add_argument("-w", "--workers", help=help, type=int, required=False)
+
+    help = "print the changes without making them"
+    opt_args.add_argument("-n", "--dry-run", help=help, action="store_true")
 
     # ==========================================================================
     # uninstall
@@ -239,6 +517,19 @@ def build_parser():
     help = "version of the software"
     opt_args.add_argument("-v", "--version", help=help, required=False)
 
+    # ==========================================================================
+    # purge
+    # ==========================================================================
+    help = "delete uninstalled software left in the trash"
+    parser_purge = subparsers.add_parser("purge", help=help)
+    parser_purge.set_defaults(func=purge_uninstalled_software)
+
+    # optional arguments
+    opt_args = parser_purge.add_argument_group("optional arguments")
+
+    help = "number of parallel deletion workers, defaults to PB_PURGE_WORKERS"
+    opt_args.add_argument("-w", "--workers", help=help, type=int, required=False)
+
     # ==========================================================================
     # list
     # ==========================================================================
@@ -255,6 +546,57 @@ def build_parser():
     help = "version of the software"
     opt_args.add_argument("-v", "--version", help=help, required=False)
 
+    # ==========================================================================
+    # reindex
+    # ==========================================================================
+    help = "rebuild the index of installed software from the install directory"
+    parser_reindex = subparsers.add_parser("reindex", help=help)
+    parser_reindex.set_defaults(func=reindex_installed_software)
+
+    # optional arguments
+    opt_args = parser_reindex.add_argument_group("optional arguments")
+
+    help = "rebuild the index of downloaded archives from the download directory instead"
+    opt_args.add_argument("-d", "--downloads", help=help, action="store_true")
+
+    # ==========================================================================
+    # gc
+    # ==========================================================================
+    help = "remove least recently used archives from the download directory"
+    parser_gc = subparsers.add_parser("gc", help=help)
+    parser_gc.set_defaults(func=collect_downloads)
+
+    # optional arguments
+    opt_args = parser_gc.add_argument_group("optional arguments")
+
+    help = "maximum size of the download directory in megabytes, 0 for no limit, defaults to PB_CACHE_MAX_SIZE"
+    opt_args.add_argument("--max-size", help=help, type=float, required=False)
+
+    help = "days an archive is kept after its last use, 0 for no limit, defaults to PB_CACHE_MAX_AGE"
+    opt_args.add_argument("--max-age", help=help, type=float, required=False)
+
+    help = "print the archives that would be removed without removing them"
+    opt_args.add_argument("-n", "--dry-run", help=help, action="store_true")
+
+    # ==========================================================================
+    # serve
+    # ==========================================================================
+    help = "serve the downloaded archives over http, as mirror for other machines"
+    parser_serve = subparsers.add_parser("serve", help=help)
+    parser_serve.set_defaults(func=serve_downloads)
+
+    # optional arguments
+    opt_args = parser_serve.add_argument_group("optional arguments")
+
+    help = "address to listen on"
+    opt_args.add_argument("--host", help=help, default="0.0.0.0")
+
+    help = "port to listen on, 0 picks a free port"
+    opt_args.add_argument("-p", "--port", help=help, type=int, default=8000)
+
+    help = "do not log requests"
+    opt_args.add_argument("-q", "--quiet", help=help, action="store_true")
+
     # ==========================================================================
     # parser settings
     # ==========================================================================
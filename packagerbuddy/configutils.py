@@ -1,29 +1,201 @@
 # stdlib
+import contextlib
 import json
+from collections.abc import Iterable, Iterator, Mapping, MutableMapping
+from typing import TYPE_CHECKING
 
 # package
-from packagerbuddy import settings
+from packagerbuddy import fileutils, settings
 
+if TYPE_CHECKING:
+    import sqlite3
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+class SQLiteConfig(MutableMapping):
+    # indexed view on the software table, entries are read on demand instead of loading the whole config
+    def __init__(self, path: str, connection: "sqlite3.Connection | None" = None) -> None:
+        self.path = path
+        self.connection = connection
+
+    def __reduce__(self) -> tuple:
+        # connections do not cross process boundaries, reconnect on the other side
+        return SQLiteConfig, (self.path,)
+
+    @contextlib.contextmanager
+    def connect(self) -> "Iterator[sqlite3.Connection]":
+        if self.connection is not None:
+            yield self.connection
+            return
+
+        connection = connect_sqlite(self.path)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def __getitem__(self, software: str) -> str | dict:
+        with self.connect() as connection:
+            row = connection.execute("SELECT entry FROM software WHERE name = ?", (software,)).fetchone()
+        if row is None:
+            raise KeyError(software)
+        return json.loads(row[0])
+
+    def __setitem__(self, software: str, entry: str | dict) -> None:
+        with self.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO software VALUES (?, ?)", (software, json.dumps(entry)))
+
+    def __delitem__(self, software: str) -> None:
+        with self.connect() as connection:
+            cursor = connection.execute("DELETE FROM software WHERE name = ?", (software,))
+        if not cursor.rowcount:
+            raise KeyError(software)
+
+    def __iter__(self) -> Iterator[str]:
+        with self.connect() as connection:
+            rows = connection.execute("SELECT name FROM software ORDER BY name").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        with self.connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM software").fetchone()[0]
+
+
+def is_sqlite() -> bool:
+    return settings.FILE_CONFIG.endswith(SQLITE_EXTENSIONS)
+
+
+def connect_sqlite(path: str) -> "sqlite3.Connection":
+    # json configs never pay for loading sqlite
+    import sqlite3
+
+    # autocommit, transactions are managed explicitly
+    connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+    connection.execute("CREATE TABLE IF NOT EXISTS software (name TEXT PRIMARY KEY, entry TEXT NOT NULL)")
+    return connection
+
+
+def build_lock_path() -> str:
+    return f"{settings.FILE_CONFIG}.lock"
+
+
+def load() -> MutableMapping:
+    if is_sqlite():
+        return SQLiteConfig(settings.FILE_CONFIG)
 
-def load() -> dict[str, str]:
     with open(settings.FILE_CONFIG, "r") as fp:
         return json.load(fp)
 
 
-def dump(config: dict[str, str]) -> None:
-    with open(settings.FILE_CONFIG, "w") as fp:
-        json.dump(config, fp, indent=True, sort_keys=True)
+def dump(config: Mapping) -> None:
+    if is_sqlite():
+        with transaction() as current:
+            current.clear()
+            current.update(config)
+        return
+
+    fileutils.write_atomic(settings.FILE_CONFIG, json.dumps(dict(config), indent=True, sort_keys=True))
+
 
+@contextlib.contextmanager
+def transaction() -> Iterator[MutableMapping]:
+    # read-modify-write of the latest config, concurrent writers wait for each other
+    if is_sqlite():
+        connection = connect_sqlite(settings.FILE_CONFIG)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            yield SQLiteConfig(settings.FILE_CONFIG, connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        return
 
-def is_software_configured(config: dict, software: str) -> bool:
+    with fileutils.lock(build_lock_path()):
+        config = load()
+        yield config
+        dump(config)
+
+
+def is_software_configured(config: Mapping, software: str) -> bool:
     return software in config
 
 
-def add_software(config: dict[str, str], software: str, url: str) -> None:
-    config[software] = url
-    dump(config)
+def add_software(config: MutableMapping, software: str, url: str | dict) -> None:
+    add_software_batch(config, {software: url})
+
+
+def remove_software(config: MutableMapping, software: str) -> None:
+    remove_software_batch(config, [software])
+
+
+def add_software_batch(config: MutableMapping, entries: Mapping[str, str | dict]) -> None:
+    with transaction() as current:
+        current.update(entries)
+
+    # a sqlite config is a live view, a loaded json config needs to follow
+    if not isinstance(config, SQLiteConfig):
+        config.update(entries)
+
+
+def remove_software_batch(config: MutableMapping, names: Iterable[str]) -> None:
+    names = list(names)
+    with transaction() as current:
+        for software in names:
+            current.pop(software, None)
+
+    if not isinstance(config, SQLiteConfig):
+        for software in names:
+            config.pop(software, None)
+
+
+def load_entries(path: str) -> dict[str, str | dict]:
+    with open(path, "r") as fp:
+        entries: dict[str, str | dict] | list[str] = json.load(fp)
+
+    # removing only needs names, accept a plain list as well
+    if isinstance(entries, list):
+        return dict.fromkeys(entries, "")
+    return entries
+
+
+def load_manifest(path: str) -> list[tuple[str, str]]:
+    with open(path, "r") as fp:
+        manifest: dict[str, str | list[str]] = json.load(fp)
+
+    packages: list[tuple[str, str]] = []
+    for software, versions in manifest.items():
+        if isinstance(versions, str):
+            versions = [versions]
+        packages.extend((software, version) for version in versions)
+    return packages
+
+
+def get_url(config: Mapping, software: str) -> str:
+    entry = config[software]
+    if isinstance(entry, dict):
+        return entry["url"]
+    return entry
+
+
+def get_sha256(config: Mapping, software: str, version: str) -> str | None:
+    entry = config[software]
+    if isinstance(entry, dict):
+        return entry.get("sha256", {}).get(version)
+    return None
+
 
+def get_patterns(config: Mapping, software: str) -> tuple[list[str], list[str]]:
+    entry = config[software]
+    if not isinstance(entry, dict):
+        return [], []
 
-def remove_software(config: dict[str, str], software: str) -> None:
-    config.pop(software)
-    dump(config)
+    patterns: list[list[str]] = []
+    for key in ("include", "exclude"):
+        value = entry.get(key, [])
+        # a single pattern can be given as plain string
+        patterns.append([value] if isinstance(value, str) else list(value))
+    return patterns[0], patterns[1]
@@ -1,10 +1,28 @@
 # stdlib
-import glob
+import asyncio
+import hashlib
+import http.client
 import os
-from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable
+from urllib.error import HTTPError
+from urllib.parse import quote, urlsplit
 
 # package
-from packagerbuddy import pathutils, settings
+from packagerbuddy import (
+    cacheutils,
+    configutils,
+    fileutils,
+    httputils,
+    pathutils,
+    progressutils,
+    settings,
+    traceutils,
+)
+
+RETRIES = 3
+RETRY_ERRORS = (ConnectionError, TimeoutError, http.client.HTTPException)
+SEGMENT_SIZE = 8 * 1024 * 1024
 
 
 def build_archive_path(software: str, version: str, url: str) -> str:
@@ -14,20 +32,421 @@ def build_archive_path(software: str, version: str, url: str) -> str:
     return dir_archive
 
 
-def find_archive(software: str, version: str) -> str | None:
-    result = glob.glob(f"{software}-{version}*", root_dir=settings.DIR_DOWNLOAD)
-    if result:
-        return os.path.join(settings.DIR_DOWNLOAD, result[0])
+def build_partial_path(archive: str) -> str:
+    return archive + ".part"
+
+
+def build_validators_path(partial: str) -> str:
+    return partial + ".validators"
+
+
+def build_lock_path(software: str, version: str) -> str:
+    return os.path.join(settings.DIR_DOWNLOAD, ".locks", f"{software}-{version}.lock")
+
+
+def find_archive(software: str, version: str, url: str | None = None) -> str | None:
+    entry = cacheutils.find_entry(software, version)
+    # an archive downloaded from another url is stale once the config changed
+    if entry is None or (url is not None and entry["url"] not in (None, url)):
+        return None
+
+    archive = os.path.join(settings.DIR_DOWNLOAD, entry["archive"])
+    if not os.path.exists(archive):
+        return None
+
+    # last use orders the cache for garbage collection
+    cacheutils.touch(software, version)
+    return archive
+
+
+def read_validators(response: http.client.HTTPResponse) -> dict[str, str | None]:
+    return {"etag": response.getheader("ETag"), "modified": response.getheader("Last-Modified")}
+
+
+def build_conditional_headers(entry: dict) -> dict[str, str]:
+    headers: dict[str, str] = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("modified"):
+        headers["If-Modified-Since"] = entry["modified"]
+    return headers
+
+
+def build_if_range(partial: str) -> str | None:
+    previous = fileutils.load_json(build_validators_path(partial), {})
+    # weak etags can not be used to combine ranges
+    if previous.get("etag") and not previous["etag"].startswith("W/"):
+        return previous["etag"]
+    return previous.get("modified")
+
+
+def fetch(url: str, partial: str, report: Callable | None = None, validators: dict | None = None) -> str:
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    headers: dict[str, str] = {}
+    if offset:
+        # only the file the partial bytes came from is resumed, a changed file is sent in full,
+        # a partial file of unknown origin starts over
+        if_range = build_if_range(partial)
+        if if_range is not None:
+            headers = {"Range": f"bytes={offset}-", "If-Range": if_range}
+        else:
+            offset = 0
+
+    digest = hashlib.sha256()
+    try:
+        with httputils.open_url(url, headers) as response:
+            if response.status != 206:
+                offset = 0
+                fileutils.dump_json(build_validators_path(partial), read_validators(response))
+
+            if validators is not None:
+                validators.update(read_validators(response))
+
+            if offset:
+                fileutils.hash_file(partial, digest)
+
+            length = response.getheader("Content-Length")
+            callback = None
+            if report is not None:
+                callback = report(offset + int(length) if length is not None else None, offset)
+
+            with open(partial, "ab" if offset else "wb") as fp:
+                size = fileutils.stream(response, fp, digest=digest, callback=callback)
+    except HTTPError as e:
+        # partial file does not match the remote file anymore, start over
+        if e.code == 416 and offset:
+            os.remove(partial)
+            return fetch(url, partial, report, validators)
+        raise
+
+    if length is not None and size < int(length):
+        raise ConnectionError(f"incomplete download of {url}, received {size} of {length} bytes")
+
+    os.remove(build_validators_path(partial))
+    return digest.hexdigest()
+
+
+def probe(url: str, validators: dict | None = None) -> tuple[str, int | None]:
+    with httputils.open_url(url, {"Range": "bytes=0-0"}) as response:
+        if validators is not None:
+            validators.update(read_validators(response))
+
+        # leave a full response unread, closing the connection is cheaper than draining it
+        if response.status != 206:
+            return response.url, None
+
+        response.read()
+        _, _, total = response.getheader("Content-Range", "").rpartition("/")
+        return response.url, int(total) if total.isdigit() else None
+
+
+def fetch_range(url: str, partial: str, start: int, end: int, callback: Callable | None = None) -> None:
+    offset = start
+    with open(partial, "r+b") as fp:
+        for attempt in range(RETRIES):
+            try:
+                with httputils.open_url(url, {"Range": f"bytes={offset}-{end}"}) as response:
+                    if response.status != 206:
+                        raise ConnectionError(f"range request for {url} returned status {response.status}")
+                    fp.seek(offset)
+                    offset += fileutils.stream(response, fp, callback=callback)
+            except RETRY_ERRORS:
+                if attempt == RETRIES - 1:
+                    raise
+                continue
+
+            if offset > end:
+                return
+
+        raise ConnectionError(f"incomplete download of {url}, bytes {offset}-{end} missing")
+
+
+def fetch_segmented(url: str, partial: str, size: int, segments: int, report: Callable | None = None) -> str:
+    with open(partial, "wb") as fp:
+        fp.truncate(size)
+
+    step = -(-size // segments)
+    ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+    callback = report(size) if report is not None else None
+    with ThreadPoolExecutor(len(ranges)) as pool:
+        futures = [pool.submit(fetch_range, url, partial, start, end, callback) for start, end in ranges]
+    for future in futures:
+        future.result()
+
+    # segments arrive out of order, hash the assembled file
+    digest = hashlib.sha256()
+    fileutils.hash_file(partial, digest)
+    return digest.hexdigest()
+
+
+def transfer(url: str, partial: str, report: Callable | None = None, validators: dict | None = None) -> str:
+    # a partial file left by a sequential transfer is resumed instead
+    if settings.DOWNLOAD_SEGMENTS > 1 and not os.path.exists(partial):
+        final_url, size = probe(url, validators)
+        if size is not None and size >= 2 * SEGMENT_SIZE:
+            segments = min(settings.DOWNLOAD_SEGMENTS, size // SEGMENT_SIZE)
+            try:
+                return fetch_segmented(final_url, partial, size, segments, report)
+            except BaseException:
+                # segments leave holes, this file can not be resumed
+                os.remove(partial)
+                raise
+
+    for _ in range(RETRIES - 1):
+        try:
+            return fetch(url, partial, report, validators)
+        except HTTPError:
+            raise
+        except RETRY_ERRORS:
+            # keep the partial file, the next attempt resumes where this one stopped
+            continue
+    return fetch(url, partial, report, validators)
+
+
+def build_mirror_url(mirror: str, archive: str) -> str:
+    # mirrors serve archives under the name they have in the download directory
+    return f"{mirror.rstrip('/')}/{quote(os.path.basename(archive))}"
+
+
+def fetch_mirrors(archive: str, partial: str, expected: str | None, report: Callable | None = None) -> str | None:
+    for mirror in settings.MIRRORS:
+        try:
+            digest = transfer(build_mirror_url(mirror, archive), partial, report)
+        except (OSError, http.client.HTTPException):
+            # fall back on the next mirror or the upstream url
+            digest = None
+
+        if digest is not None and (expected is None or digest == expected):
+            return digest
+        if os.path.exists(partial):
+            os.remove(partial)
     return None
 
 
-def download(software: str, version: str, config: dict[str, str]) -> str:
-    template = config[software]
-    url = template.format(version=version)
+def build_url(software: str, version: str, config: dict[str, str]) -> str:
+    template = configutils.get_url(config, software)
+    return template.format(version=version)
+
+
+def build_report(
+    archive: str, progress: Callable[[progressutils.Progress], None] | None = None
+) -> Callable[..., Callable[[int], None]] | None:
+    if progress is None:
+        return None
+
+    name = os.path.basename(archive)
+
+    def report(total: int | None, offset: int = 0) -> Callable[[int], None]:
+        return progressutils.create_reporter(name, total, progress, offset)
+
+    return report
+
+
+def publish(software: str, version: str, url: str, archive: str, blob: str, validators: dict | None = None) -> str:
+    previous = cacheutils.find_entry(software, version)
+    cacheutils.link(blob, archive)
+    digest = os.path.basename(blob)
+    cacheutils.register_archive(software, version, url, archive, digest, validators)
+    if previous is not None and previous["sha256"] not in (None, digest):
+        cacheutils.release_blob(previous["sha256"], previous["url"])
+    return archive
+
+
+def download(
+    software: str,
+    version: str,
+    config: dict[str, str],
+    progress: Callable[[progressutils.Progress], None] | None = None,
+    refresh: bool = False,
+) -> str:
+    url = build_url(software, version, config)
+    expected = configutils.get_sha256(config, software, version)
     archive = build_archive_path(software, version, url)
 
-    result = urlopen(url)
-    with open(archive, "wb+") as fp:
-        fp.write(result.read())
+    # a refreshed url changed upstream, the blob cached for it is outdated
+    blob = None if refresh else cacheutils.find_blob(url)
+    # urls pinned to the same checksum share the content, whichever downloaded it first
+    if expected is not None and os.path.exists(cacheutils.build_blob_path(expected)):
+        blob = cacheutils.build_blob_path(expected)
+    validators = None
+    if blob is None or (expected is not None and os.path.basename(blob) != expected):
+        partial = build_partial_path(archive)
+        report = build_report(archive, progress)
+        # a refresh revalidates against the upstream url, mirrors hold no validators and may lag behind
+        digest = None if refresh else fetch_mirrors(archive, partial, expected, report)
+        if digest is None:
+            validators = {}
+            digest = transfer(url, partial, report, validators)
+            validators["length"] = os.path.getsize(partial)
+        if expected is not None and digest != expected:
+            os.remove(partial)
+            raise ValueError(f"checksum mismatch for {url}, expected sha256 {expected}, got {digest}")
 
+        blob = cacheutils.add_blob(partial, url, digest)
+
+    return publish(software, version, url, archive, blob, validators)
+
+
+def find_verified_archive(software: str, version: str, config: dict[str, str]) -> str | None:
+    archive = find_archive(software, version, build_url(software, version, config))
+    if archive is not None and not cacheutils.is_verified(archive, configutils.get_sha256(config, software, version)):
+        return None
     return archive
+
+
+def is_current(software: str, version: str, config: dict[str, str]) -> bool:
+    # a checksum pins the content of the archive, there is nothing to revalidate
+    if configutils.get_sha256(config, software, version) is not None:
+        return True
+
+    entry = cacheutils.find_entry(software, version) or {}
+    headers = build_conditional_headers(entry)
+    if not headers:
+        return False
+
+    # an unchanged archive costs a 304 response, a changed one is downloaded again
+    with httputils.open_url(build_url(software, version, config), headers) as response:
+        if response.status == 304:
+            return True
+        return entry.get("etag") is not None and response.getheader("ETag") == entry["etag"]
+
+
+def get_archive(
+    software: str,
+    version: str,
+    config: dict[str, str],
+    progress: Callable[[progressutils.Progress], None] | None = None,
+    refresh: bool = False,
+) -> str:
+    with traceutils.span("download", software=software, version=version) as trace:
+        archive = find_verified_archive(software, version, config)
+        stale = archive is not None and refresh and not is_current(software, version, config)
+        trace["cached"] = archive is not None and not stale
+        if archive is None or stale:
+            # single flight, concurrent processes wait for the download and reuse the archive
+            with fileutils.lock(build_lock_path(software, version)):
+                archive = None if stale else find_verified_archive(software, version, config)
+                archive = archive or download(software, version, config, progress, refresh=stale)
+        if settings.TRACE:
+            trace["bytes"] = os.path.getsize(archive)
+    return archive
+
+
+def can_stream(software: str, version: str, config: dict[str, str], refresh: bool = False) -> bool:
+    # mirrors fall back on the upstream url when their archive does not match, a consumed stream can not
+    if not settings.STREAM_INSTALL or settings.MIRRORS:
+        return False
+
+    # zips list their members at the end of the archive, only tarballs extract front to back
+    url = build_url(software, version, config)
+    _, ext = pathutils.split_ext(url)
+    if ext in ("", ".zip"):
+        return False
+
+    # cached archives and partial downloads are cheaper to reuse than to stream again
+    if os.path.exists(build_partial_path(build_archive_path(software, version, url))):
+        return False
+    if find_verified_archive(software, version, config) is not None:
+        return False
+    expected = configutils.get_sha256(config, software, version)
+    if expected is not None and os.path.exists(cacheutils.build_blob_path(expected)):
+        return False
+    return refresh or cacheutils.find_blob(url) is None
+
+
+def stream_archive(
+    software: str,
+    version: str,
+    config: dict[str, str],
+    consume: Callable[[str, BinaryIO], Any],
+    progress: Callable[[progressutils.Progress], None] | None = None,
+) -> tuple[str, Any]:
+    url = build_url(software, version, config)
+    expected = configutils.get_sha256(config, software, version)
+    archive = build_archive_path(software, version, url)
+
+    with traceutils.span("download", software=software, version=version, streamed=True) as trace:
+        # single flight, an archive downloaded meanwhile is consumed from disk
+        with fileutils.lock(build_lock_path(software, version)):
+            cached = find_verified_archive(software, version, config)
+            trace["cached"] = cached is not None
+            if cached is not None:
+                with open(cached, "rb") as fp:
+                    return cached, consume(cached, fp)
+
+            partial = build_partial_path(archive)
+            digest = hashlib.sha256()
+            try:
+                with httputils.open_url(url) as response, open(partial, "wb") as fp:
+                    validators: dict = read_validators(response)
+                    fileutils.dump_json(build_validators_path(partial), validators)
+                    length = response.getheader("Content-Length")
+                    report = build_report(archive, progress)
+                    callback = report(int(length) if length is not None else None) if report is not None else None
+
+                    # the consumer reads the response, every byte it reads lands in the partial file
+                    tee = fileutils.Tee(response, fp, digest, callback)
+                    result = consume(archive, tee)
+                    # the padding after the end of archive marker belongs to the cached archive
+                    size = tee.drain()
+            except RETRY_ERRORS:
+                # keep the partial file, the next download resumes where this one stopped
+                raise
+            except BaseException:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                raise
+
+            if length is not None and size < int(length):
+                raise ConnectionError(f"incomplete download of {url}, received {size} of {length} bytes")
+
+            # the archive is verified after it was consumed, callers discard what they made of it on a mismatch
+            if expected is not None and digest.hexdigest() != expected:
+                os.remove(partial)
+                raise ValueError(f"checksum mismatch for {url}, expected sha256 {expected}, got {digest.hexdigest()}")
+
+            os.remove(build_validators_path(partial))
+            validators["length"] = size
+            blob = cacheutils.add_blob(partial, url, digest.hexdigest())
+            publish(software, version, url, archive, blob, validators)
+        if settings.TRACE:
+            trace["bytes"] = size
+    return archive, result
+
+
+def build_limits() -> dict[str | None, asyncio.Semaphore]:
+    # the None key holds the global limit, hosts get their own semaphore on first use
+    return {None: asyncio.Semaphore(settings.DOWNLOAD_WORKERS)}
+
+
+def find_host_limit(limits: dict[str | None, asyncio.Semaphore], url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).hostname
+    if host not in limits:
+        limits[host] = asyncio.Semaphore(settings.DOWNLOAD_HOST_WORKERS)
+    return limits[host]
+
+
+async def get_archive_async(
+    software: str,
+    version: str,
+    config: dict[str, str],
+    progress: Callable[[progressutils.Progress], None] | None = None,
+    limits: dict[str | None, asyncio.Semaphore] | None = None,
+    refresh: bool = False,
+) -> str:
+    limits = limits if limits is not None else build_limits()
+    async with limits[None], find_host_limit(limits, build_url(software, version, config)):
+        return await asyncio.to_thread(get_archive, software, version, config, progress, refresh)
+
+
+async def stream_archive_async(
+    software: str,
+    version: str,
+    config: dict[str, str],
+    consume: Callable[[str, BinaryIO], Any],
+    progress: Callable[[progressutils.Progress], None] | None = None,
+    limits: dict[str | None, asyncio.Semaphore] | None = None,
+) -> tuple[str, Any]:
+    limits = limits if limits is not None else build_limits()
+    async with limits[None], find_host_limit(limits, build_url(software, version, config)):
+        return await asyncio.to_thread(stream_archive, software, version, config, consume, progress)
@@ -0,0 +1,289 @@
+# stdlib
+import contextlib
+import fnmatch
+import hashlib
+import os
+import shutil
+import subprocess
+import tarfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import BinaryIO, Callable, Iterator
+
+# package
+from packagerbuddy import fileutils, settings
+
+CHUNK_SIZE = 1024 * 1024
+QUEUE_SIZE = 4
+
+# multi-core decompressors, tried in order before falling back to the standard library
+DECOMPRESSORS: dict[str, list[list[str]]] = {
+    "gz": [["pigz", "-dc"]],
+    "bz2": [["pbzip2", "-dc"], ["lbzip2", "-dc"]],
+    "xz": [["xz", "-dc", "-T0"]],
+    "zst": [["zstd", "-dc", "-T0"]],
+}
+
+
+def sanitize_name(name: str) -> str:
+    parts = [part for part in name.split("/") if part not in ("", os.curdir, os.pardir)]
+    return os.path.join(*parts) if parts else ""
+
+
+def match_pattern(name: str, pattern: str) -> bool:
+    # a pattern matching a directory matches everything inside it
+    parts = name.rstrip("/").split("/")
+    return any(fnmatch.fnmatchcase("/".join(parts[:i]), pattern.rstrip("/")) for i in range(1, len(parts) + 1))
+
+
+def build_filter(include: list[str], exclude: list[str], root: str | None = None) -> Callable[[str], bool] | None:
+    if not include and not exclude:
+        return None
+
+    # patterns are relative to the software root, not to the root directory of the archive
+    prefix = f"{root}/" if root else None
+
+    def select(name: str) -> bool:
+        if prefix is not None and name.startswith(prefix):
+            name = name[len(prefix) :]
+        if not name.strip("/"):
+            return True
+        if include and not any(match_pattern(name, pattern) for pattern in include):
+            return False
+        return not any(match_pattern(name, pattern) for pattern in exclude)
+
+    return select
+
+
+def get_compression(archive: str) -> str:
+    if archive.endswith((".tgz", ".tar.gz")):
+        return "gz"
+    if archive.endswith(".tar.bz2"):
+        return "bz2"
+    if archive.endswith(".tar.xz"):
+        return "xz"
+    if archive.endswith(".tar.zst"):
+        return "zst"
+    return ""
+
+
+def find_decompressor(compression: str) -> list[str] | None:
+    if not settings.EXTERNAL_DECOMPRESSORS:
+        return None
+
+    for command in DECOMPRESSORS.get(compression, []):
+        if shutil.which(command[0]):
+            return command
+    return None
+
+
+def open_zstd(archive: str | BinaryIO):
+    try:
+        from compression import zstd
+
+        return zstd.open(archive, "rb")
+    except ImportError:
+        pass
+
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("no zstd decompressor found, install zstd or the zstandard package") from None
+
+    if isinstance(archive, str):
+        return zstandard.ZstdDecompressor().stream_reader(open(archive, "rb"), closefd=True)
+    return zstandard.ZstdDecompressor().stream_reader(archive, closefd=False)
+
+
+@contextlib.contextmanager
+def open_tar(archive: str, fp: BinaryIO | None = None) -> Iterator[tarfile.TarFile]:
+    compression = get_compression(archive)
+    # a stream is read as it arrives, external decompressors only take files
+    command = find_decompressor(compression) if fp is None else None
+
+    if command is not None:
+        process = subprocess.Popen([*command, archive], stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+                yield tar
+
+            # consume the padding after the end of archive marker so the decompressor exits cleanly
+            while process.stdout.read(CHUNK_SIZE):
+                pass
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, [*command, archive])
+    elif compression == "zst":
+        with open_zstd(archive if fp is None else fp) as src, tarfile.open(fileobj=src, mode="r|") as tar:
+            yield tar
+    elif fp is not None:
+        with tarfile.open(fileobj=fp, mode=f"r|{compression}") as tar:
+            yield tar
+    else:
+        with tarfile.open(archive, f"r|{compression}") as tar:
+            yield tar
+
+
+def extract_zip_members(
+    archive: str,
+    target: str,
+    names: list[tuple[str, str]],
+    digests: dict[str, str] | None = None,
+) -> None:
+    with zipfile.ZipFile(archive, "r") as fp:
+        for filename, name in names:
+            path = os.path.join(target, sanitize_name(name))
+            digest = hashlib.sha256() if digests is not None else None
+            with fp.open(filename) as src, open(path, "wb") as dst:
+                fileutils.stream(src, dst, CHUNK_SIZE, digest=digest)
+            if digest is not None:
+                digests[path] = digest.hexdigest()
+
+
+def extract_zip(
+    archive: str,
+    target: str,
+    strip: str = "",
+    workers: int | None = None,
+    digests: dict[str, str] | None = None,
+    select: Callable[[str], bool] | None = None,
+) -> None:
+    with zipfile.ZipFile(archive, "r") as fp:
+        members = fp.infolist()
+
+    # members are stored independently, unselected ones are never decompressed
+    if select is not None:
+        members = [member for member in members if select(member.filename)]
+
+    # create all directories up front so workers never race on them
+    files: list[zipfile.ZipInfo] = []
+    for member in members:
+        name = member.filename[len(strip) :]
+        path = os.path.join(target, sanitize_name(name))
+        if member.is_dir():
+            os.makedirs(path, exist_ok=True)
+        elif name:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            files.append(member)
+
+    # members are compressed independently, spread them over workers by size
+    files.sort(key=lambda member: member.file_size, reverse=True)
+    names = [(member.filename, member.filename[len(strip) :]) for member in files]
+    workers = max(1, min(workers or settings.EXTRACT_WORKERS, len(names)))
+    if workers == 1:
+        extract_zip_members(archive, target, names, digests)
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(extract_zip_members, archive, target, names[i::workers], digests) for i in range(workers)
+        ]
+    for future in futures:
+        future.result()
+
+
+def filter_member(member: tarfile.TarInfo, target: str) -> tarfile.TarInfo:
+    if hasattr(tarfile, "data_filter"):
+        return tarfile.data_filter(member, target)
+
+    # python without extraction filters, links leaving the target are rejected by hand, files can then not be
+    # written through them either
+    if member.issym() or member.islnk():
+        if os.path.isabs(member.linkname):
+            raise tarfile.ExtractError(f"{member.name} links to the absolute path {member.linkname}")
+
+        # symlinks are relative to their own directory, hardlinks to the root of the archive
+        base = os.path.dirname(os.path.join(target, member.name)) if member.issym() else target
+        path = os.path.normpath(os.path.join(base, member.linkname))
+        if os.path.commonpath([path, os.path.normpath(target)]) != os.path.normpath(target):
+            raise tarfile.ExtractError(f"{member.name} links outside of the target to {member.linkname}")
+    return member
+
+
+def write_member(
+    tar: tarfile.TarFile,
+    member: tarfile.TarInfo,
+    path: str,
+    data: bytes,
+    digests: dict[str, str] | None = None,
+) -> None:
+    with open(path, "wb") as fp:
+        fp.write(data)
+    if digests is not None:
+        digests[path] = hashlib.sha256(data).hexdigest()
+    tar.chown(member, path, False)
+    tar.chmod(member, path)
+    tar.utime(member, path)
+
+
+def extract_tar(
+    tar: tarfile.TarFile,
+    target: str,
+    workers: int | None = None,
+    digests: dict[str, str] | None = None,
+    select: Callable[[str], bool] | None = None,
+) -> None:
+    workers = workers or settings.EXTRACT_WORKERS
+    pending: set[Future] = set()
+    directories: list[tuple[tarfile.TarInfo, str]] = []
+
+    # decompression is sequential, file writes and metadata syscalls go to the pool
+    with ThreadPoolExecutor(workers) as pool:
+        for member in tar:
+            member.name = sanitize_name(member.name)
+            # the stream is decompressed regardless, unselected members are not written
+            if select is not None and not select(member.name):
+                continue
+            if select is not None and member.islnk() and not select(sanitize_name(member.linkname)):
+                continue
+
+            # members are written by hand, apply what extractall's data filter would: no links leaving the target,
+            # no files written through such links, no special files or setuid bits
+            member = filter_member(member, target)
+            path = os.path.join(target, member.name)
+
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+                directories.append((member, path))
+                continue
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if member.isreg() and member.size <= CHUNK_SIZE:
+                # bound the amount of file data held in memory
+                if len(pending) >= workers * QUEUE_SIZE:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+
+                data = tar.extractfile(member).read()
+                pending.add(pool.submit(write_member, tar, member, path, data, digests))
+            elif member.isreg():
+                digest = hashlib.sha256() if digests is not None else None
+                with tar.extractfile(member) as src, open(path, "wb") as dst:
+                    fileutils.stream(src, dst, CHUNK_SIZE, digest=digest)
+                if digest is not None:
+                    digests[path] = digest.hexdigest()
+                tar.chown(member, path, False)
+                tar.chmod(member, path)
+                tar.utime(member, path)
+            else:
+                # links may point at files still queued for writing
+                for future in wait(pending).done:
+                    future.result()
+                pending.clear()
+                if hasattr(tarfile, "data_filter"):
+                    tar.extract(member, target, filter="fully_trusted")
+                else:
+                    tar.extract(member, target)
+
+    for future in pending:
+        future.result()
+
+    # set directory attributes last, writing files inside them changes their mtime
+    for member, path in reversed(directories):
+        tar.chown(member, path, False)
+        tar.chmod(member, path)
+        tar.utime(member, path)
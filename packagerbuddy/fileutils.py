@@ -0,0 +1,198 @@
+# stdlib
+import contextlib
+import errno
+import fcntl
+import json
+import os
+import stat
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Iterator
+
+# package
+from packagerbuddy import settings
+
+CHUNK_SIZE = 1024 * 1024
+LOCK_POLL_INTERVAL = 0.1
+LOCK_STALE_AGE = 300.0
+LOCK_UNSUPPORTED = (errno.ENOLCK, errno.EOPNOTSUPP, errno.ENOSYS)
+
+
+def write_atomic(path: str, data: str) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # tempfile imports shutil, which the cli avoids loading for quick commands
+    tmp = os.path.join(directory, f".tmp-{os.urandom(8).hex()}")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write(data)
+            # the data has to be on disk before the rename, a crash would leave an empty file otherwise
+            fp.flush()
+            os.fsync(fp.fileno())
+        # keep the permissions of the file being replaced
+        mode = stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else 0o644
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def stream(
+    source: BinaryIO,
+    target: BinaryIO,
+    chunk_size: int = CHUNK_SIZE,
+    digest=None,
+    callback: Callable[[int], None] | None = None,
+) -> int:
+    size = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        target.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+        if callback is not None:
+            callback(len(chunk))
+        size += len(chunk)
+    return size
+
+
+class Tee:
+    # reads from the source are copied to the target, a consumer of the source fills a file as it goes
+    def __init__(self, source: BinaryIO, target: BinaryIO, digest=None, callback: Callable[[int], None] | None = None):
+        self.source = source
+        self.target = target
+        self.digest = digest
+        self.callback = callback
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        # http responses read to the end on None only
+        chunk = self.source.read(size if size >= 0 else None)
+        self.target.write(chunk)
+        if self.digest is not None:
+            self.digest.update(chunk)
+        if self.callback is not None and chunk:
+            self.callback(len(chunk))
+        self.size += len(chunk)
+        return chunk
+
+    def drain(self, chunk_size: int = CHUNK_SIZE) -> int:
+        while self.read(chunk_size):
+            pass
+        return self.size
+
+
+def hash_file(path: str, digest) -> None:
+    with open(path, "rb") as fp:
+        while chunk := fp.read(CHUNK_SIZE):
+            digest.update(chunk)
+
+
+def load_json(path: str, default: Any = None) -> Any:
+    if not os.path.exists(path):
+        return default
+
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+
+def dump_json(path: str, data: Any) -> None:
+    write_atomic(path, json.dumps(data, separators=(",", ":"), sort_keys=True))
+
+
+def build_lock_owner() -> str:
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+
+def is_stale_lock(path: str) -> bool:
+    try:
+        with open(path, "r") as fp:
+            owner = fp.read()
+        age = time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+
+    # a holder on this host is checked directly, holders on other hosts only by the age of their heartbeat
+    host, _, pid = owner.partition(":")
+    if host == os.uname().nodename and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+    return age > LOCK_STALE_AGE
+
+
+@contextlib.contextmanager
+def lock_file(path: str, blocking: bool = True) -> Iterator[None]:
+    # exclusive creation is atomic on nfs as well, unlike advisory locks without a lock daemon
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if is_stale_lock(path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            elif not blocking:
+                raise BlockingIOError(errno.EWOULDBLOCK, "lock is held", path) from None
+            else:
+                time.sleep(LOCK_POLL_INTERVAL)
+            continue
+
+        with os.fdopen(fd, "w") as fp:
+            fp.write(build_lock_owner())
+        break
+
+    stop = threading.Event()
+
+    def heartbeat() -> None:
+        while not stop.wait(LOCK_STALE_AGE / 4):
+            with contextlib.suppress(OSError):
+                os.utime(path)
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def flock(fp, blocking: bool = True) -> bool:
+    try:
+        fcntl.flock(fp, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as e:
+        if e.errno in LOCK_UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+@contextlib.contextmanager
+def lock(path: str, blocking: bool = True) -> Iterator[None]:
+    # advisory locks are released by the kernel when the holder dies
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if settings.LOCKS == "file":
+        with lock_file(f"{path}.excl", blocking):
+            yield
+        return
+
+    with open(path, "a") as fp:
+        if not flock(fp, blocking):
+            with lock_file(f"{path}.excl", blocking):
+                yield
+            return
+
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
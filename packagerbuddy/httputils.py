@@ -0,0 +1,133 @@
+# stdlib
+import contextlib
+import http.client
+import threading
+from typing import Iterator
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+MAX_REDIRECTS = 10
+TIMEOUT = 60
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+
+# idle keep-alive connections per (scheme, host, port)
+POOL: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+POOL_LOCK = threading.Lock()
+
+
+def build_pool_key(url: str) -> tuple[str, str, int]:
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return parts.scheme, parts.hostname or "", port
+
+
+def connect(key: tuple[str, str, int]) -> http.client.HTTPConnection:
+    scheme, host, port = key
+    proxy = getproxies().get(scheme)
+    if proxy and not proxy_bypass(host):
+        _, proxy_host, proxy_port = build_pool_key(proxy)
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(proxy_host, proxy_port, timeout=TIMEOUT)
+            conn.set_tunnel(host, port)
+            return conn
+        return http.client.HTTPConnection(proxy_host, proxy_port, timeout=TIMEOUT)
+
+    if scheme == "https":
+        return http.client.HTTPSConnection(host, port, timeout=TIMEOUT)
+    return http.client.HTTPConnection(host, port, timeout=TIMEOUT)
+
+
+def acquire(key: tuple[str, str, int]) -> tuple[http.client.HTTPConnection, bool]:
+    with POOL_LOCK:
+        idle = POOL.get(key)
+        if idle:
+            return idle.pop(), True
+    return connect(key), False
+
+
+def release(key: tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+    with POOL_LOCK:
+        POOL.setdefault(key, []).append(conn)
+
+
+def finish(key: tuple[str, str, int], conn: http.client.HTTPConnection, response: http.client.HTTPResponse) -> None:
+    # only a fully consumed response leaves the connection reusable
+    if response.isclosed() and not response.will_close:
+        release(key, conn)
+    else:
+        conn.close()
+
+
+def clear() -> None:
+    with POOL_LOCK:
+        for idle in POOL.values():
+            for conn in idle:
+                conn.close()
+        POOL.clear()
+
+
+def build_request_target(url: str, conn: http.client.HTTPConnection) -> str:
+    parts = urlsplit(url)
+    # plain http through a proxy sends the absolute url
+    if parts.scheme == "http" and conn.host != parts.hostname:
+        return url
+    target = parts.path or "/"
+    if parts.query:
+        target += f"?{parts.query}"
+    return target
+
+
+def request(
+    url: str, headers: dict[str, str], method: str
+) -> tuple[http.client.HTTPResponse, tuple, http.client.HTTPConnection]:
+    key = build_pool_key(url)
+    conn, reused = acquire(key)
+    try:
+        conn.request(method, build_request_target(url, conn), headers=headers)
+        return conn.getresponse(), key, conn
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        # the server closed an idle keep-alive connection, retry once on a fresh one
+        if not reused:
+            raise
+
+    conn = connect(key)
+    try:
+        conn.request(method, build_request_target(url, conn), headers=headers)
+        return conn.getresponse(), key, conn
+    except BaseException:
+        conn.close()
+        raise
+
+
+@contextlib.contextmanager
+def open_url(
+    url: str, headers: dict[str, str] | None = None, method: str = "GET"
+) -> Iterator[http.client.HTTPResponse]:
+    headers = {"User-Agent": "packagerbuddy", **(headers or {})}
+    for _ in range(MAX_REDIRECTS):
+        response, key, conn = request(url, headers, method)
+        response.url = url
+
+        if response.status in REDIRECT_CODES and response.getheader("Location"):
+            response.read()
+            finish(key, conn, response)
+            url = urljoin(url, response.getheader("Location"))
+            continue
+
+        if response.status >= 400:
+            response.read()
+            finish(key, conn, response)
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+
+        try:
+            yield response
+        except BaseException:
+            conn.close()
+            raise
+
+        finish(key, conn, response)
+        return
+
+    raise HTTPError(url, 310, "too many redirects", None, None)
@@ -0,0 +1,109 @@
+# stdlib
+import fnmatch
+import os
+
+# package
+from packagerbuddy import configutils, fileutils, settings
+
+
+def build_index_path() -> str:
+    return os.path.join(settings.DIR_INSTALL, ".index.json")
+
+
+def build_install_name(software: str, version: str) -> str:
+    return f"{software}-{version}"
+
+
+def build_state_path(name: str) -> str:
+    return os.path.join(settings.DIR_INSTALL, ".state", f"{name}.json")
+
+
+def load_index() -> dict[str, dict[str, str]]:
+    path = build_index_path()
+    index = fileutils.load_json(path)
+    if index is None:
+        config = configutils.load() if os.path.exists(settings.FILE_CONFIG) else None
+        index = scan_installed_software(config)
+        fileutils.dump_json(path, index)
+    return index
+
+
+def split_install_name(name: str, config: dict | None = None) -> tuple[str, str]:
+    # prefer the longest configured software name, software names may contain dashes
+    candidates = [software for software in (config or {}) if name.startswith(f"{software}-")]
+    if candidates:
+        software = max(candidates, key=len)
+        return software, name[len(software) + 1 :]
+
+    software, _, version = name.partition("-")
+    return software, version
+
+
+def scan_installed_software(config: dict | None = None) -> dict[str, dict[str, str]]:
+    index: dict[str, dict[str, str]] = {}
+    if not os.path.exists(settings.DIR_INSTALL):
+        return index
+
+    for entry in os.scandir(settings.DIR_INSTALL):
+        if entry.name.startswith((".", "tmp-")) or entry.is_symlink() or not entry.is_dir():
+            continue
+        # placed by an install that did not finish its post install scripts
+        if os.path.exists(build_state_path(entry.name)):
+            continue
+        software, version = split_install_name(entry.name, config)
+        index[entry.name] = {"software": software, "version": version}
+    return index
+
+
+def reindex(config: dict | None = None) -> dict[str, dict[str, str]]:
+    path = build_index_path()
+    with fileutils.lock(path + ".lock"):
+        index = scan_installed_software(config)
+        fileutils.dump_json(path, index)
+    return index
+
+
+def register_software(software: str, version: str) -> None:
+    path = build_index_path()
+    with fileutils.lock(path + ".lock"):
+        index = load_index()
+        index[build_install_name(software, version)] = {"software": software, "version": version}
+        fileutils.dump_json(path, index)
+
+
+def unregister_software(*dirs_install: str) -> None:
+    path = build_index_path()
+    with fileutils.lock(path + ".lock"):
+        index = load_index()
+        for dir_install in dirs_install:
+            index.pop(os.path.basename(dir_install), None)
+        fileutils.dump_json(path, index)
+
+
+def is_software_installed(software: str, version: str) -> bool:
+    return build_install_name(software, version) in load_index()
+
+
+def find_installed_software(software: str | None = None, version: str | None = None) -> list[str]:
+    result: list[str] = []
+    for name, entry in load_index().items():
+        if not fnmatch.fnmatchcase(entry["software"], software or "*"):
+            continue
+        if not fnmatch.fnmatchcase(entry["version"], version or "*"):
+            continue
+        result.append(os.path.join(settings.DIR_INSTALL, name))
+    result.sort()
+    return result
+
+
+def plan_sync(packages: list[tuple[str, str]], prune: bool = False) -> tuple[list[tuple[str, str]], list[str]]:
+    installed = {(entry["software"], entry["version"]): name for name, entry in load_index().items()}
+    wanted = dict.fromkeys(packages)
+
+    missing = [package for package in wanted if package not in installed]
+    unlisted: list[str] = []
+    if prune:
+        unlisted = sorted(
+            os.path.join(settings.DIR_INSTALL, name) for key, name in installed.items() if key not in wanted
+        )
+    return missing, unlisted
@@ -1,13 +1,32 @@
 # stdlib
-import glob
+import asyncio
+import contextlib
+import multiprocessing
 import os
 import shutil
-import tarfile
 import zipfile
-from typing import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, BinaryIO, Callable
 
 # package
-from packagerbuddy import pathutils, settings
+from packagerbuddy import (
+    cacheutils,
+    configutils,
+    downloadutils,
+    extractutils,
+    fileutils,
+    indexutils,
+    pathutils,
+    progressutils,
+    scriptutils,
+    settings,
+    storeutils,
+    traceutils,
+    trashutils,
+)
+
+# phases of an install in order, recorded as they complete
+PHASES = ("downloaded", "verified", "extracted", "placed", "scripts")
 
 
 def build_temporary_install_path(software: str, version: str) -> str:
@@ -22,14 +41,82 @@ def build_install_path(software: str, version: str) -> str:
     return path
 
 
-def is_software_installed(software: str, version: str) -> bool:
-    path = build_install_path(software, version)
-    exists = os.path.exists(path)
-    return exists
+def build_lock_path(software: str, version: str) -> str:
+    return os.path.join(settings.DIR_INSTALL, ".locks", f"{software}-{version}.lock")
+
+
+@contextlib.asynccontextmanager
+async def lock_async(path: str) -> AsyncIterator[None]:
+    # wait for the lock in a thread, the event loop keeps serving other packages
+    lock = fileutils.lock(path)
+    await asyncio.to_thread(lock.__enter__)
+    try:
+        yield
+    finally:
+        lock.__exit__(None, None, None)
+
+
+def load_state(software: str, version: str) -> dict:
+    return fileutils.load_json(indexutils.build_state_path(indexutils.build_install_name(software, version)), {})
+
+
+def save_state(software: str, version: str, phase: str, **data) -> dict:
+    state = {**load_state(software, version), **data, "phase": phase}
+    fileutils.dump_json(indexutils.build_state_path(indexutils.build_install_name(software, version)), state)
+    return state
+
+
+def clear_state(software: str, version: str) -> None:
+    path = indexutils.build_state_path(indexutils.build_install_name(software, version))
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def reached(state: dict, phase: str) -> bool:
+    return state.get("phase") in PHASES and PHASES.index(state["phase"]) >= PHASES.index(phase)
+
+
+def resume_state(software: str, version: str, refresh: bool = False) -> dict:
+    state = load_state(software, version)
+    if refresh:
+        return {}
+
+    # redo the phases whose output went missing
+    if reached(state, "placed"):
+        if os.path.isdir(build_install_path(software, version)):
+            return state
+        state = {**state, "phase": "verified"}
+    if state.get("phase") == "extracted" and not os.path.isdir(build_temporary_install_path(software, version)):
+        state = {**state, "phase": "verified"}
+    if reached(state, "verified") and not os.path.exists(state.get("archive", "")):
+        return {}
+    return state
+
+
+def reclaim() -> list[str]:
+    reclaimed: list[str] = []
+    if not os.path.exists(settings.DIR_INSTALL):
+        return reclaimed
+
+    for entry in os.scandir(settings.DIR_INSTALL):
+        if not entry.name.startswith("tmp-") or not entry.is_dir():
+            continue
+
+        name = entry.name[len("tmp-") :]
+        try:
+            # the lock is held while another process is still installing
+            with fileutils.lock(os.path.join(settings.DIR_INSTALL, ".locks", f"{name}.lock"), blocking=False):
+                state = fileutils.load_json(indexutils.build_state_path(name), {})
+                if state.get("phase") == "extracted":
+                    continue
+                reclaimed.append(trashutils.move_to_trash(entry.path))
+        except BlockingIOError:
+            continue
+    return reclaimed
 
 
 def get_archive_name(software: str, version: str, config: dict[str, str]) -> str:
-    template = config[software]
+    template = configutils.get_url(config, software)
     url = template.format(version=version)
     basename = os.path.basename(url)
     _, ext = pathutils.split_ext(basename)
@@ -37,23 +124,45 @@ def get_archive_name(software: str, version: str, config: dict[str, str]) -> str
     return archive_name
 
 
-def unzip(archive: str, target: str) -> None:
+def unzip(
+    archive: str,
+    target: str,
+    root: str | None = None,
+    digests: dict[str, str] | None = None,
+    select: Callable[[str], bool] | None = None,
+) -> bool:
     with zipfile.ZipFile(archive, "r") as fp:
-        fp.extractall(target)
+        names = fp.namelist()
+
+    # the central directory lists all members up front, strip the root while extracting
+    prefix = f"{root}/"
+    strip = root is not None and all(name.startswith(prefix) for name in names)
+    extractutils.extract_zip(archive, target, strip=prefix if strip else "", digests=digests, select=select)
+    return strip
 
 
-def untar(archive: str, target: str) -> None:
-    read_mode = "r"
-    if archive.endswith(".tgz") or archive.endswith(".tar.gz"):
-        read_mode += ":gz"
-    elif archive.endswith("tar.bz2"):
-        read_mode += ":bz2"
+def untar(
+    archive: str,
+    target: str,
+    root: str | None = None,
+    digests: dict[str, str] | None = None,
+    select: Callable[[str], bool] | None = None,
+    fp: BinaryIO | None = None,
+) -> bool:
+    # listing tar members requires a full decompression pass, cleanup moves the root instead
+    with extractutils.open_tar(archive, fp) as tar:
+        extractutils.extract_tar(tar, target, digests=digests, select=select)
 
-    with tarfile.open(archive, read_mode) as tar:
-        tar.extractall(path=target)
+    return False
 
 
-def unarchive(archive: str, target: str) -> None:
+def unarchive(
+    archive: str,
+    target: str,
+    root: str | None = None,
+    digests: dict[str, str] | None = None,
+    select: Callable[[str], bool] | None = None,
+) -> bool:
     _, ext = pathutils.split_ext(archive)
     map_extension_func: dict[str, Callable] = {
         ".zip": unzip,
@@ -61,29 +170,208 @@ def unarchive(archive: str, target: str) -> None:
         ".tgz": untar,
         ".tar.gz": untar,
         ".tar.bz2": untar,
+        ".tar.xz": untar,
+        ".tar.zst": untar,
     }
     func = map_extension_func[ext]
-    func(archive, target)
+    return func(archive, target, root, digests, select)
 
 
-def cleanup(config: dict[str, str], software: str, version: str) -> None:
+def cleanup(config: dict[str, str], software: str, version: str, stripped: bool = False) -> None:
     dir_temp = build_temporary_install_path(software, version)
     dir_install = build_install_path(software, version)
     archive_name = get_archive_name(software, version, config)
+
+    # leftover of an install that never made it into the index, its state file tells it apart from a directory
+    # placed by hand, which is never destroyed
+    if os.path.exists(dir_install):
+        if not os.path.exists(indexutils.build_state_path(indexutils.build_install_name(software, version))):
+            raise FileExistsError(f"{dir_install} exists but is not installed, run reindex to add it to the index")
+        trashutils.move_to_trash(dir_install)
+
+    # the store manifest follows the directory, first as move_to_trash does
+    storeutils.move_manifest(dir_temp, dir_install)
     contents = os.listdir(dir_temp)
-    if len(contents) == 1 and contents[0] == archive_name:
-        shutil.copytree(os.path.join(dir_temp, archive_name), dir_install, dirs_exist_ok=True)
-        shutil.rmtree(dir_temp)
+    if not stripped and len(contents) == 1 and contents[0] == archive_name:
+        os.rename(os.path.join(dir_temp, archive_name), dir_install)
+        os.rmdir(dir_temp)
     else:
         os.rename(dir_temp, dir_install)
 
 
-def find_installed_software(software: str | None = None, version: str | None = None) -> list[str]:
-    glob_path = build_install_path(software or "*", version or "*")
-    result = glob.glob(glob_path)
-    result.sort()
-    return result
+def uninstall_software(dir_install: str) -> str | None:
+    trashed = uninstall_packages([dir_install])
+    return trashed[0] if trashed else None
+
+
+def uninstall_packages(dirs_install: list[str]) -> list[str]:
+    # deleting a large install takes long, the trash is purged separately
+    trashed: list[str] = []
+    removed: list[str] = []
+    try:
+        for dir_install in dirs_install:
+            # removed by hand, it only has to leave the index
+            if os.path.exists(dir_install):
+                trashed.append(trashutils.move_to_trash(dir_install))
+            removed.append(dir_install)
+            shutil.rmtree(scriptutils.build_log_dir(os.path.basename(dir_install)), ignore_errors=True)
+    finally:
+        # a single index update for all of them, including the ones trashed before a failing rename
+        indexutils.unregister_software(*removed)
+    return trashed
+
+
+def unpack(archive: str, software: str, version: str, config: dict[str, str], fp: BinaryIO | None = None) -> bool:
+    # a stream is unpacked in a thread of the main process, its profiler already covers it and a second one
+    # can not be enabled on python 3.12+
+    path = traceutils.build_profile_path(f"{software}-{version}") if fp is None else ""
+    with traceutils.profile(path):
+        dir_temp = build_temporary_install_path(software, version)
+        # leftover of an install that crashed while extracting
+        if os.path.exists(dir_temp):
+            shutil.rmtree(dir_temp)
+            storeutils.release(dir_temp)
+        os.makedirs(dir_temp)
+
+        archive_name = get_archive_name(software, version, config)
+        digests: dict[str, str] | None = {} if settings.STORE else None
+        select = extractutils.build_filter(*configutils.get_patterns(config, software), root=archive_name)
+        if fp is not None:
+            # the archive is still arriving, only tarballs are streamed
+            with traceutils.span("unarchive", software=software, version=version, streamed=True):
+                stripped = untar(archive, dir_temp, root=archive_name, digests=digests, select=select, fp=fp)
+        else:
+            with traceutils.span("unarchive", software=software, version=version, bytes=os.path.getsize(archive)):
+                stripped = unarchive(archive, dir_temp, root=archive_name, digests=digests, select=select)
+
+        if digests:
+            with traceutils.span("deduplicate", software=software, version=version, files=len(digests)):
+                # named after the temporary directory until it is placed, a leftover install trashed meanwhile
+                # must not take it along
+                storeutils.deduplicate(digests, dir_temp)
+        return stripped
+
+
+def place(config: dict[str, str], software: str, version: str, stripped: bool = False) -> str:
+    with traceutils.span("cleanup", software=software, version=version):
+        cleanup(config, software, version, stripped=stripped)
+    return build_install_path(software, version)
+
+
+def extract(archive: str, software: str, version: str, config: dict[str, str]) -> str:
+    stripped = unpack(archive, software, version, config)
+    return place(config, software, version, stripped)
+
+
+def finalize(software: str, version: str, dir_install: str, state: dict | None = None) -> None:
+    # the install only counts once its scripts succeeded, a failing script is retried by the next install
+    if not reached(state or {}, "scripts"):
+        scripts = scriptutils.find_scripts(software, version)
+        if scripts:
+            scriptutils.run_scripts(scripts, software, version, wd=dir_install)
+        save_state(software, version, "scripts")
+
+    indexutils.register_software(software, version)
+    clear_state(software, version)
+
+
+async def install_packages_async(
+    packages: list[tuple[str, str]],
+    config: dict[str, str],
+    executor: Executor,
+    progress: Callable[[progressutils.Progress], None] | None = None,
+    refresh: bool = False,
+) -> dict[tuple[str, str], str | BaseException]:
+    loop = asyncio.get_running_loop()
+    limits = downloadutils.build_limits()
+    scripts = asyncio.Lock()
+
+    # extract each archive as soon as its download finishes
+    async def install(software: str, version: str) -> str:
+        with traceutils.span("install", software=software, version=version):
+            return await install_locked(software, version)
+
+    async def install_locked(software: str, version: str) -> str:
+        async with lock_async(build_lock_path(software, version)):
+            # another process installed it while waiting for the lock
+            if indexutils.is_software_installed(software, version):
+                return build_install_path(software, version)
+
+            # every phase is recorded, a rerun resumes after the last completed one
+            state = resume_state(software, version, refresh)
+            if not reached(state, "verified") and downloadutils.can_stream(software, version, config, refresh):
+                # extract while downloading, in a thread as the response can not be handed to an install worker
+                archive, stripped = await downloadutils.stream_archive_async(
+                    software,
+                    version,
+                    config,
+                    lambda archive, fp: unpack(archive, software, version, config, fp),
+                    progress,
+                    limits,
+                )
+                state = save_state(software, version, "extracted", archive=archive, stripped=stripped)
+
+            if not reached(state, "verified"):
+                archive = await downloadutils.get_archive_async(software, version, config, progress, limits, refresh)
+                save_state(software, version, "downloaded", archive=archive)
+                if not cacheutils.is_verified(archive, configutils.get_sha256(config, software, version)):
+                    raise ValueError(f"checksum mismatch for {archive}")
+                state = save_state(software, version, "verified")
+
+            if not reached(state, "extracted"):
+                stripped = await loop.run_in_executor(executor, unpack, state["archive"], software, version, config)
+                state = save_state(software, version, "extracted", stripped=stripped)
+
+            # publishing is a single rename of the extracted directory
+            dir_install = build_install_path(software, version)
+            if not reached(state, "placed"):
+                place(config, software, version, state["stripped"])
+                state = save_state(software, version, "placed")
+
+            # post install scripts of one install at a time, independent ones of that install run concurrently
+            async with scripts:
+                await asyncio.to_thread(finalize, software, version, dir_install, state)
+        return dir_install
+
+    results = await asyncio.gather(*(install(*package) for package in packages), return_exceptions=True)
+    return dict(zip(packages, results))
+
+
+def read_settings() -> dict[str, Any]:
+    return {name: value for name, value in vars(settings).items() if name.isupper()}
+
+
+def apply_settings(values: dict[str, Any]) -> None:
+    for name, value in values.items():
+        setattr(settings, name, value)
+
+
+def install_packages(
+    packages: list[tuple[str, str]],
+    config: dict[str, str],
+    progress: Callable[[progressutils.Progress], None] | None = None,
+    refresh: bool = False,
+) -> dict[tuple[str, str], str | BaseException]:
+    results: dict[tuple[str, str], str | BaseException] = {}
+    pending: list[tuple[str, str]] = []
+    for package in dict.fromkeys(packages):
+        if indexutils.is_software_installed(*package):
+            results[package] = build_install_path(*package)
+        else:
+            pending.append(package)
 
+    if not pending:
+        return results
 
-def uninstall_software(dir_install: str) -> None:
-    shutil.rmtree(dir_install)
+    # workers start lazily from inside the event loop while download threads run, forking a process with threads
+    # can deadlock, they are forked from a clean server process instead and get the settings of this one
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    with ProcessPoolExecutor(
+        min(len(pending), settings.INSTALL_WORKERS),
+        mp_context=context,
+        initializer=apply_settings,
+        initargs=(read_settings(),),
+    ) as extracts:
+        results.update(asyncio.run(install_packages_async(pending, config, extracts, progress, refresh)))
+    return results
@@ -1,6 +1,6 @@
 def split_ext(path: str) -> tuple[str, str]:
     ext: str = ""
-    supported_extensions = [".tar.gz", ".tar.bz2", ".tgz", ".tar", ".zip"]
+    supported_extensions = [".tar.gz", ".tar.bz2", ".tar.xz", ".tar.zst", ".tgz", ".tar", ".zip"]
     for supported_extension in supported_extensions:
         if path.endswith(supported_extension):
             ext = supported_extension
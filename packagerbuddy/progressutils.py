@@ -0,0 +1,117 @@
+# stdlib
+import sys
+import threading
+import time
+from typing import Callable, NamedTuple, TextIO
+
+BAR_WIDTH = 30
+REFRESH_INTERVAL = 0.1
+LOG_INTERVAL = 10.0
+
+
+class Progress(NamedTuple):
+    name: str
+    received: int
+    total: int | None
+    rate: float
+    eta: float | None
+
+
+def create_reporter(
+    name: str,
+    total: int | None,
+    callback: Callable[[Progress], None],
+    offset: int = 0,
+) -> Callable[[int], None]:
+    start = time.monotonic()
+    received = offset
+    lock = threading.Lock()
+
+    def update(size: int) -> None:
+        nonlocal received
+        with lock:
+            received += size
+            elapsed = time.monotonic() - start
+            rate = (received - offset) / elapsed if elapsed > 0 else 0.0
+            eta = (total - received) / rate if total is not None and rate > 0 else None
+            callback(Progress(name, received, total, rate, eta))
+
+    return update
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def format_progress(progress: Progress) -> str:
+    rate = f"{format_size(progress.rate)}/s"
+    eta = format_duration(progress.eta)
+    if progress.total is None:
+        return f"{progress.name} {format_size(progress.received)} {rate}"
+
+    percentage = progress.received / progress.total if progress.total else 1.0
+    return f"{progress.name} {percentage:4.0%} {format_size(progress.received)} {rate} eta {eta}"
+
+
+def is_done(progress: Progress) -> bool:
+    return progress.total is not None and progress.received >= progress.total
+
+
+def create_bar_renderer(stream: TextIO) -> Callable[[Progress], None]:
+    last = 0.0
+    lock = threading.Lock()
+
+    def render(progress: Progress) -> None:
+        nonlocal last
+        with lock:
+            now = time.monotonic()
+            done = is_done(progress)
+            if not done and now - last < REFRESH_INTERVAL:
+                return
+            last = now
+
+            filled = BAR_WIDTH
+            if progress.total:
+                filled = min(BAR_WIDTH, BAR_WIDTH * progress.received // progress.total)
+            bar = "#" * filled + " " * (BAR_WIDTH - filled)
+            stream.write(f"\r\033[K[{bar}] {format_progress(progress)}" + ("\n" if done else ""))
+            stream.flush()
+
+    return render
+
+
+def create_log_renderer(stream: TextIO, interval: float = LOG_INTERVAL) -> Callable[[Progress], None]:
+    last: dict[str, float] = {}
+    lock = threading.Lock()
+
+    def render(progress: Progress) -> None:
+        with lock:
+            now = time.monotonic()
+            done = is_done(progress)
+            previous = last.get(progress.name)
+            if not done and previous is not None and now - previous < interval:
+                return
+            last[progress.name] = now
+            stream.write(format_progress(progress) + "\n")
+            stream.flush()
+
+    return render
+
+
+def create_renderer(stream: TextIO | None = None) -> Callable[[Progress], None]:
+    stream = stream or sys.stderr
+    if stream.isatty():
+        return create_bar_renderer(stream)
+    return create_log_renderer(stream)
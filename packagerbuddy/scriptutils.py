@@ -1,10 +1,19 @@
 # stdlib
+import contextlib
 import glob
 import os
+import re
+import signal
 import subprocess
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 # package
-from packagerbuddy import settings
+from packagerbuddy import settings, traceutils
+
+# scripts declare the scripts they depend on in a comment, e.g. "# after: foo"
+DEPENDENCY_HEADER = re.compile(rb"^#\s*after:(.*)$", re.MULTILINE)
+HEADER_SIZE = 4096
+KILL_GRACE_PERIOD = 5.0
 
 
 def find_scripts(software: str, version: str) -> list[str]:
@@ -23,15 +32,128 @@ def find_scripts(software: str, version: str) -> list[str]:
     return scripts
 
 
-def run_script(script: str, software: str, version: str, wd: str | None = None) -> tuple[str, str]:
+def build_log_dir(name: str) -> str:
+    return os.path.join(settings.DIR_INSTALL, ".logs", name)
+
+
+def build_log_path(software: str, version: str, script: str) -> str:
+    return os.path.join(build_log_dir(f"{software}-{version}"), f"{os.path.basename(script)}.log")
+
+
+def read_dependencies(script: str) -> list[str]:
+    with open(script, "rb") as fp:
+        header = fp.read(HEADER_SIZE)
+
+    names: list[str] = []
+    for match in DEPENDENCY_HEADER.finditer(header):
+        names.extend(match.group(1).decode(errors="ignore").replace(",", " ").split())
+    return names
+
+
+def kill(process: subprocess.Popen) -> None:
+    # the script runs in a session of its own, signal everything it started along with it
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(KILL_GRACE_PERIOD)
+    except subprocess.TimeoutExpired:
+        pass
+
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+
+
+def run_script(
+    script: str,
+    software: str,
+    version: str,
+    wd: str | None = None,
+    log: str | None = None,
+    timeout: float | None = None,
+) -> int:
     args = [script, software, version]
     cmd = " ".join(args)
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-        cwd=wd,
-    )
-    stdout, stderr = process.communicate()
-    return stdout, stderr
+
+    with contextlib.ExitStack() as stack:
+        # output goes straight to the log file, nothing is buffered in memory
+        output = subprocess.DEVNULL
+        if log is not None:
+            os.makedirs(os.path.dirname(log), exist_ok=True)
+            output = stack.enter_context(open(log, "wb"))
+
+        process = subprocess.Popen(
+            cmd,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+            shell=True,
+            cwd=wd,
+            start_new_session=True,
+        )
+        with traceutils.span("script", software=software, version=version, script=script) as trace:
+            try:
+                process.wait(timeout or None)
+            except BaseException:
+                kill(process)
+                raise
+
+            trace["returncode"] = process.returncode
+            if log is not None:
+                trace["bytes"] = os.path.getsize(log)
+
+    return process.returncode
+
+
+def run_scripts(
+    scripts: list[str],
+    software: str,
+    version: str,
+    wd: str | None = None,
+    workers: int | None = None,
+    timeout: float | None = None,
+) -> dict[str, int]:
+    workers = workers or settings.SCRIPT_WORKERS
+    timeout = settings.SCRIPT_TIMEOUT if timeout is None else timeout
+
+    # dependencies on scripts outside this install are ignored
+    names = {os.path.basename(script): script for script in scripts}
+    dependencies = {script: {names[name] for name in read_dependencies(script) if name in names} for script in scripts}
+
+    pending = list(scripts)
+    results: dict[str, int] = {}
+    failed: set[str] = set()
+    with ThreadPoolExecutor(workers) as pool:
+        running: dict[Future, str] = {}
+        while pending or running:
+            # scripts depending on a failed script never start, nor do their own dependents
+            skipped = [script for script in pending if dependencies[script] & failed]
+            while skipped:
+                for script in skipped:
+                    pending.remove(script)
+                    failed.add(script)
+                skipped = [script for script in pending if dependencies[script] & failed]
+
+            ready = [script for script in pending if dependencies[script] <= results.keys()]
+            for script in ready[: workers - len(running)]:
+                pending.remove(script)
+                log = build_log_path(software, version, script)
+                future = pool.submit(run_script, script, software, version, wd, log, timeout)
+                running[future] = script
+
+            if not running:
+                if not pending:
+                    break
+                raise ValueError(f"circular dependencies between scripts {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                script = running.pop(future)
+                results[script] = future.result()
+                if results[script] != 0:
+                    failed.add(script)
+
+    # scripts already running finish first, the install fails on the first script that did not succeed
+    for script in scripts:
+        if results.get(script, 0) != 0:
+            raise subprocess.CalledProcessError(results[script], [script, software, version])
+    return results
@@ -0,0 +1,99 @@
+# stdlib
+import http.server
+import os
+import re
+from urllib.parse import unquote, urlsplit
+
+# package
+from packagerbuddy import pathutils, settings
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def find_archive(directory: str, path: str) -> str | None:
+    # only archives are served, not the cache, index, lock and partial files next to them
+    name = unquote(urlsplit(path).path).lstrip("/")
+    if not name or "/" in name or name.startswith("."):
+        return None
+
+    _, ext = pathutils.split_ext(name)
+    if not ext or not name.endswith(ext):
+        return None
+
+    archive = os.path.join(directory, name)
+    if not os.path.isfile(archive):
+        return None
+    return archive
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    match = RANGE_PATTERN.match(header or "")
+    if not match or not any(match.groups()):
+        return None
+
+    start, end = match.groups()
+    # suffix range, the last bytes of the file
+    if not start:
+        return max(0, size - int(end)), size - 1
+    return int(start), min(int(end or size - 1), size - 1)
+
+
+class ArchiveRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "packagerbuddy"
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def send_headers(self) -> tuple[str, int, int] | None:
+        archive = find_archive(self.server.directory, self.path)
+        if archive is None:
+            self.send_error(404)
+            return None
+
+        size = os.path.getsize(archive)
+        start, end = 0, size - 1
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is not None:
+            start, end = byte_range
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return archive, start, end - start + 1
+
+    def do_HEAD(self) -> None:
+        self.send_headers()
+
+    def do_GET(self) -> None:
+        headers = self.send_headers()
+        if headers is None:
+            return
+
+        archive, offset, count = headers
+        if not count:
+            return
+        with open(archive, "rb") as fp:
+            # sendfile copies from the page cache to the socket without passing through python
+            self.connection.sendfile(fp, offset, count)
+
+
+def create_server(
+    host: str, port: int, directory: str | None = None, quiet: bool = False
+) -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer((host, port), ArchiveRequestHandler)
+    server.directory = directory or settings.DIR_DOWNLOAD
+    server.quiet = quiet
+    return server
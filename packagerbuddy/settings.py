@@ -12,4 +12,22 @@ DIR_DOWNLOAD = normalize_path(os.getenv("PB_DOWNLOAD", os.path.join(DIR_PACKAGE,
 DIR_INSTALL = normalize_path(os.getenv("PB_INSTALL", os.path.join(DIR_PACKAGE, "installed")))
 DIR_SCRIPTS = normalize_path(os.getenv("PB_SCRIPTS", os.path.join(DIR_PACKAGE, "scripts")))
 FILE_CONFIG = normalize_path(os.getenv("PB_CONFIG", os.path.join(DIR_CONFIG, "software.json")))
-EXTENSIONS: set[str] = {".tgz", ".tar", ".tar.gz", ".tar.bz2"}
+DOWNLOAD_WORKERS = int(os.getenv("PB_DOWNLOAD_WORKERS", 4))
+DOWNLOAD_HOST_WORKERS = int(os.getenv("PB_DOWNLOAD_HOST_WORKERS", 2))
+INSTALL_WORKERS = int(os.getenv("PB_INSTALL_WORKERS", os.cpu_count() or 1))
+DOWNLOAD_SEGMENTS = int(os.getenv("PB_DOWNLOAD_SEGMENTS", 4))
+EXTRACT_WORKERS = int(os.getenv("PB_EXTRACT_WORKERS", os.cpu_count() or 1))
+EXTERNAL_DECOMPRESSORS = os.getenv("PB_EXTERNAL_DECOMPRESSORS", "1") != "0"
+STORE = os.getenv("PB_STORE", "")
+LOCKS = os.getenv("PB_LOCKS", "flock")
+SCRIPT_WORKERS = int(os.getenv("PB_SCRIPT_WORKERS", 1))
+SCRIPT_TIMEOUT = float(os.getenv("PB_SCRIPT_TIMEOUT", 0))
+CACHE_MAX_SIZE = float(os.getenv("PB_CACHE_MAX_SIZE", 0))
+CACHE_MAX_AGE = float(os.getenv("PB_CACHE_MAX_AGE", 0))
+MIRRORS = [mirror for mirror in os.getenv("PB_MIRRORS", "").split() if mirror]
+PURGE_WORKERS = int(os.getenv("PB_PURGE_WORKERS", os.cpu_count() or 1))
+BACKGROUND_PURGE = os.getenv("PB_BACKGROUND_PURGE", "1") != "0"
+STREAM_INSTALL = os.getenv("PB_STREAM_INSTALL", "0") != "0"
+TRACE = os.getenv("PB_TRACE", "")
+CPROFILE = os.getenv("PB_CPROFILE", "")
+EXTENSIONS: set[str] = {".tgz", ".tar", ".tar.gz", ".tar.bz2", ".tar.xz", ".tar.zst"}
@@ -0,0 +1,91 @@
+# stdlib
+import errno
+import fcntl
+import os
+import stat
+
+# package
+from packagerbuddy import fileutils, settings
+
+# linux ioctl cloning the extents of one file into another
+FICLONE = 0x40049409
+
+
+def build_store_path() -> str:
+    return os.path.join(settings.DIR_INSTALL, ".store")
+
+
+def build_object_path(key: str) -> str:
+    return os.path.join(build_store_path(), "objects", key[:2], key)
+
+
+def build_manifest_path(dir_install: str) -> str:
+    name = os.path.basename(dir_install)
+    return os.path.join(build_store_path(), "manifests", f"{name}.json")
+
+
+def build_object_key(path: str, digest: str) -> str:
+    # hardlinks share permissions, identical content with different modes gets its own object
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    return f"{digest}-{mode:o}"
+
+
+def reflink(source: str, target: str) -> bool:
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError as e:
+        if os.path.exists(target):
+            os.remove(target)
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF):
+            return False
+        raise
+
+    os.chmod(target, stat.S_IMODE(os.stat(source).st_mode))
+    return True
+
+
+def share(obj: str, path: str) -> None:
+    tmp = f"{path}.pbstore"
+    if not (settings.STORE == "reflink" and reflink(obj, tmp)):
+        os.link(obj, tmp)
+    os.replace(tmp, path)
+
+
+def deduplicate(digests: dict[str, str], dir_install: str) -> None:
+    keys: set[str] = set()
+    with fileutils.lock(os.path.join(build_store_path(), "lock")):
+        for path, digest in digests.items():
+            key = build_object_key(path, digest)
+            obj = build_object_path(key)
+            keys.add(key)
+
+            if os.path.exists(obj):
+                share(obj, path)
+            else:
+                # first copy of this content, the extracted file becomes the stored object
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                os.link(path, obj)
+
+        fileutils.dump_json(build_manifest_path(dir_install), sorted(keys))
+
+
+def move_manifest(dir_install: str, target: str) -> None:
+    manifest = build_manifest_path(dir_install)
+    if os.path.exists(manifest):
+        os.rename(manifest, build_manifest_path(target))
+
+
+def release(dir_install: str) -> None:
+    manifest = build_manifest_path(dir_install)
+    keys = fileutils.load_json(manifest)
+    if keys is None:
+        return
+
+    # the link count of an object is its reference count, only the store itself is left
+    with fileutils.lock(os.path.join(build_store_path(), "lock")):
+        for key in keys:
+            obj = build_object_path(key)
+            if os.path.exists(obj) and os.stat(obj).st_nlink <= 1:
+                os.remove(obj)
+        os.remove(manifest)
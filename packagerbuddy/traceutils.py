@@ -0,0 +1,106 @@
+# stdlib
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Any, Iterator
+
+# package
+from packagerbuddy import settings
+
+CHROME_EXTENSION = ".json"
+
+
+def configure(trace: str | None = None, cprofile: str | None = None) -> None:
+    # install worker processes read their settings from the environment when they are spawned
+    if trace:
+        settings.TRACE = os.environ["PB_TRACE"] = os.path.abspath(trace)
+    if cprofile:
+        settings.CPROFILE = os.environ["PB_CPROFILE"] = os.path.abspath(cprofile)
+
+
+def is_chrome() -> bool:
+    return settings.TRACE.endswith(CHROME_EXTENSION)
+
+
+def build_events_path() -> str:
+    # a chrome trace is a single json document, collect its events as json lines until the command exports it
+    if is_chrome():
+        return f"{settings.TRACE}.events"
+    return settings.TRACE
+
+
+def record(name: str, start: float, duration: float, args: dict[str, Any]) -> None:
+    event = {
+        "name": name,
+        "cat": "packagerbuddy",
+        "ph": "X",
+        "ts": int(start * 1e6),
+        "dur": int(duration * 1e6),
+        "pid": os.getpid(),
+        "tid": threading.get_native_id(),
+        "args": args,
+    }
+    # a single append keeps lines of concurrent processes intact
+    fd = os.open(build_events_path(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, (json.dumps(event, sort_keys=True) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def span(name: str, **args: Any) -> Iterator[dict[str, Any]]:
+    # callers add results like byte counts to the yielded args
+    if not settings.TRACE:
+        yield args
+        return
+
+    start = time.time()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = str(e)
+        raise
+    finally:
+        record(name, start, time.time() - start, args)
+
+
+def export() -> None:
+    if not settings.TRACE or not is_chrome():
+        return
+
+    events_path = build_events_path()
+    if not os.path.exists(events_path):
+        return
+
+    with open(events_path, "r") as fp:
+        events = [json.loads(line) for line in fp if line.strip()]
+    with open(settings.TRACE, "w") as fp:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+    os.remove(events_path)
+
+
+def build_profile_path(name: str) -> str:
+    # worker processes dump their own stats next to the main one, pstats merges them
+    if not settings.CPROFILE:
+        return ""
+    return f"{settings.CPROFILE}.{name}"
+
+
+@contextlib.contextmanager
+def profile(path: str) -> Iterator[None]:
+    if not path:
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
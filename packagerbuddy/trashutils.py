@@ -0,0 +1,75 @@
+# stdlib
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# package
+from packagerbuddy import fileutils, settings, storeutils
+
+
+def build_trash_path() -> str:
+    return os.path.join(settings.DIR_INSTALL, ".trash")
+
+
+def build_lock_path() -> str:
+    return os.path.join(settings.DIR_INSTALL, ".trash.lock")
+
+
+def move_to_trash(dir_install: str) -> str:
+    # unique names, the same version can be installed and uninstalled again before the trash is purged
+    trashed = os.path.join(build_trash_path(), f"{os.path.basename(dir_install)}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(build_trash_path(), exist_ok=True)
+
+    # the manifest goes first, a purge must not see the install without it
+    storeutils.move_manifest(dir_install, trashed)
+    os.rename(dir_install, trashed)
+    return trashed
+
+
+def remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def purge(workers: int | None = None) -> list[str]:
+    path = build_trash_path()
+    purged: list[str] = []
+
+    # a single purge at a time, installs trashed meanwhile are picked up by the next pass
+    with fileutils.lock(build_lock_path()):
+        while os.path.exists(path):
+            trashed = sorted(os.path.join(path, name) for name in os.listdir(path))
+            if not trashed:
+                break
+
+            # spread the top level entries of every install over the workers, unlinking is bound by disk latency
+            children = [os.path.join(entry, name) for entry in trashed for name in os.listdir(entry)]
+            with ThreadPoolExecutor(max(1, min(workers or settings.PURGE_WORKERS, len(children) or 1))) as pool:
+                futures = [pool.submit(remove, child) for child in children]
+            for future in futures:
+                future.result()
+
+            for entry in trashed:
+                os.rmdir(entry)
+                storeutils.release(entry)
+            purged.extend(trashed)
+    return purged
+
+
+def spawn_purge() -> subprocess.Popen:
+    # detached from the session, the purge outlives the command that trashed the installs
+    env = {**os.environ, "PB_INSTALL": settings.DIR_INSTALL}
+    command = [sys.executable, "-c", "from packagerbuddy import trashutils; trashutils.purge()"]
+    return subprocess.Popen(
+        command,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
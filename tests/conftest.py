@@ -1,13 +1,125 @@
 # stdlib
+import functools
+import hashlib
+import http.server
 import json
 import os
+import re
+import shutil
 import tempfile
+import threading
+from typing import Iterator
 
 # third party
 import pytest
 
 # package
-from packagerbuddy import settings
+from packagerbuddy import httputils, serveutils, settings
+
+
+# ==============================================================================
+# http server
+# ==============================================================================
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        return
+
+    def do_GET(self) -> None:
+        self.server.requests.append((self.path, self.headers.get("Range")))
+
+        if self.path.startswith("/redirect/"):
+            self.send_response(302)
+            self.send_header("Location", self.path[len("/redirect") :])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        with open(path, "rb") as fp:
+            data = fp.read()
+
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = 0, len(data) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        # a range of a changed file is not sent, the full file is
+        if self.headers.get("If-Range") not in (None, etag):
+            match = None
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+
+        body = data[start : end + 1]
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        # simulate a dropped connection
+        if self.server.drop_after is not None:
+            body = body[: self.server.drop_after]
+            self.server.drop_after = None
+            self.close_connection = True
+
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def fix_http_server(tmp_path) -> Iterator[http.server.ThreadingHTTPServer]:
+    directory = os.path.join(tmp_path, "www")
+    os.makedirs(directory)
+
+    handler = functools.partial(RangeRequestHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.directory = directory
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.requests = []
+    server.ranges = True
+    server.drop_after = None
+
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+
+    # close pooled keep-alive connections first, the server waits for their handlers
+    httputils.clear()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fix_mirror_server(tmp_path) -> Iterator[http.server.ThreadingHTTPServer]:
+    directory = os.path.join(tmp_path, "mirror")
+    os.makedirs(directory)
+
+    server = serveutils.create_server("127.0.0.1", 0, directory, quiet=True)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+
+    httputils.clear()
+    server.shutdown()
+    server.server_close()
 
 
 # ==============================================================================
@@ -26,20 +138,26 @@ def fix_dir_config(fix_test_data: str) -> str:
 
 
 @pytest.fixture
-def fix_file_config(fix_dir_config: str) -> str:
-    path = os.path.join(fix_dir_config, "software.json")
+def fix_file_config(fix_dir_config: str, tmp_path) -> str:
+    # config transactions take a lock next to the config file, work on a copy of the test data
+    path = os.path.join(tmp_path, "software.json")
+    shutil.copyfile(os.path.join(fix_dir_config, "software.json"), path)
     return path
 
 
 @pytest.fixture
-def fix_dir_downloaded(fix_test_data: str):
-    path = os.path.join(fix_test_data, "downloaded")
+def fix_dir_downloaded(fix_test_data: str, tmp_path) -> str:
+    # downloads take a lock inside the download directory, work on a copy of the test data
+    path = os.path.join(tmp_path, "downloaded")
+    shutil.copytree(os.path.join(fix_test_data, "downloaded"), path)
     return path
 
 
 @pytest.fixture
-def fix_dir_installed(fix_test_data: str):
-    path = os.path.join(fix_test_data, "installed")
+def fix_dir_installed(fix_test_data: str, tmp_path) -> str:
+    # installing and uninstalling updates the index, work on a copy of the test data
+    path = os.path.join(tmp_path, "installed")
+    shutil.copytree(os.path.join(fix_test_data, "installed"), path)
     return path
 
 
@@ -73,11 +191,40 @@ def mock_settings_dir_download(fix_dir_downloaded: str, monkeypatch: pytest.Monk
     monkeypatch.setattr(settings, "DIR_DOWNLOAD", fix_dir_downloaded)
 
 
+@pytest.fixture
+def mock_settings_dir_download_tmp(tmp_path, monkeypatch: pytest.MonkeyPatch) -> str:
+    # next to the directories the http servers serve from
+    path = os.path.join(tmp_path, "downloaded")
+    os.makedirs(path)
+    monkeypatch.setattr(settings, "DIR_DOWNLOAD", path)
+    return path
+
+
 @pytest.fixture
 def mock_settings_dir_install(fix_dir_installed: str, monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setattr(settings, "DIR_INSTALL", fix_dir_installed)
 
 
+@pytest.fixture
+def mock_settings_dir_install_tmp(tmp_path, monkeypatch: pytest.MonkeyPatch) -> str:
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    return str(tmp_path)
+
+
 @pytest.fixture
 def mock_settings_dir_scripts(fix_dir_scripts: str, monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setattr(settings, "DIR_SCRIPTS", fix_dir_scripts)
+
+
+# ==============================================================================
+# helpers
+# ==============================================================================
+def create_install(dir_install: str, files: dict[str, bytes]) -> dict[str, str]:
+    digests: dict[str, str] = {}
+    for name, data in files.items():
+        path = os.path.join(dir_install, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            fp.write(data)
+        digests[path] = hashlib.sha256(data).hexdigest()
+    return digests
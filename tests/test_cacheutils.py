@@ -0,0 +1,185 @@
+# stdlib
+import hashlib
+import os
+import time
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import cacheutils, settings
+
+
+def test_build_blob_path(mock_settings_dir_download_tmp: str) -> None:
+    path = cacheutils.build_blob_path("abc")
+    assert path == os.path.join(mock_settings_dir_download_tmp, ".cache", "blobs", "abc")
+
+
+def test_add_find_blob(mock_settings_dir_download_tmp: str) -> None:
+    url = "https://example.com/foo.zip"
+    assert cacheutils.find_blob(url) is None
+
+    path = os.path.join(mock_settings_dir_download_tmp, "foo.zip.part")
+    with open(path, "wb") as fp:
+        fp.write(b"foo")
+
+    blob = cacheutils.add_blob(path, url, "abc")
+    assert blob == cacheutils.build_blob_path("abc")
+    assert not os.path.exists(path)
+    assert cacheutils.find_blob(url) == blob
+
+
+def test_add_blob_existing(mock_settings_dir_download_tmp: str) -> None:
+    path = os.path.join(mock_settings_dir_download_tmp, "foo.zip.part")
+    with open(path, "wb") as fp:
+        fp.write(b"foo")
+    blob = cacheutils.add_blob(path, "https://example.com/foo.zip", "abc")
+    archive = os.path.join(mock_settings_dir_download_tmp, "foo-0.1.0.zip")
+    cacheutils.link(blob, archive)
+
+    # the same content from another url keeps the blob archives link to
+    with open(path, "wb") as fp:
+        fp.write(b"foo")
+    assert cacheutils.add_blob(path, "https://example.com/bar.zip", "abc") == blob
+    assert not os.path.exists(path)
+    assert cacheutils.is_verified(archive, "abc")
+    assert cacheutils.find_blob("https://example.com/bar.zip") == blob
+
+
+def test_link_verified(mock_settings_dir_download_tmp: str) -> None:
+    blob = cacheutils.build_blob_path("abc")
+    os.makedirs(os.path.dirname(blob))
+    with open(blob, "wb") as fp:
+        fp.write(b"foo")
+
+    archive = os.path.join(mock_settings_dir_download_tmp, "foo-0.1.0.zip")
+    with open(archive, "wb") as fp:
+        fp.write(b"corrupt")
+
+    assert cacheutils.is_verified(archive, None)
+    assert not cacheutils.is_verified(archive, "abc")
+
+    cacheutils.link(blob, archive)
+    assert os.path.samefile(blob, archive)
+    assert cacheutils.is_verified(archive, "abc")
+
+
+def test_link_copied(mock_settings_dir_download_tmp: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    digest = hashlib.sha256(b"foo").hexdigest()
+    blob = cacheutils.build_blob_path(digest)
+    os.makedirs(os.path.dirname(blob))
+    with open(blob, "wb") as fp:
+        fp.write(b"foo")
+
+    # file system without hardlink support
+    def mock_link(src: str, dst: str) -> None:
+        raise OSError("hardlinks not supported")
+
+    monkeypatch.setattr(os, "link", mock_link)
+    archive = os.path.join(mock_settings_dir_download_tmp, "foo-0.1.0.zip")
+    cacheutils.link(blob, archive)
+    assert not os.path.samefile(blob, archive)
+    assert cacheutils.is_verified(archive, digest)
+
+    with open(archive, "wb") as fp:
+        fp.write(b"corrupt")
+    assert not cacheutils.is_verified(archive, digest)
+
+
+def write(path: str, data: bytes = b"foo") -> str:
+    with open(path, "wb") as fp:
+        fp.write(data)
+    return path
+
+
+def test_index(mock_settings_dir_download_tmp: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "FILE_CONFIG", os.path.join(mock_settings_dir_download_tmp, "missing.json"))
+    for name in ("foo-1.2.zip", "foo-1.21.zip", "foo-1.3.zip.part", "notes.txt"):
+        write(os.path.join(mock_settings_dir_download_tmp, name))
+
+    # built from the download directory on first use
+    index = cacheutils.load_index()
+    assert sorted(index["foo"]) == ["1.2", "1.21"]
+    assert cacheutils.find_entry("foo", "1.2")["archive"] == "foo-1.2.zip"
+    assert cacheutils.find_entry("foo", "1.3") is None
+    assert cacheutils.load_index() is index
+
+    archive = write(os.path.join(mock_settings_dir_download_tmp, "foo-1.3.zip"))
+    cacheutils.register_archive("foo", "1.3", "https://example.com/foo-1.3.zip", archive, "abc")
+    entry = cacheutils.find_entry("foo", "1.3")
+    assert entry["archive"] == "foo-1.3.zip"
+    assert entry["url"] == "https://example.com/foo-1.3.zip"
+    assert entry["sha256"] == "abc"
+    assert entry["size"] == 3
+
+
+def test_reindex(mock_settings_dir_download_tmp: str) -> None:
+    url = "https://example.com/foo-bar-1.2.zip"
+    blob = cacheutils.add_blob(write(os.path.join(mock_settings_dir_download_tmp, "blob.part")), url, "abc")
+    archive = os.path.join(mock_settings_dir_download_tmp, "foo-bar-1.2.zip")
+    cacheutils.link(blob, archive)
+
+    config = {"foo-bar": "https://example.com/foo-bar-{version}.zip"}
+    index = cacheutils.reindex(config)
+    entry = index["foo-bar"]["1.2"]
+    assert (entry["archive"], entry["url"], entry["sha256"], entry["size"]) == ("foo-bar-1.2.zip", url, "abc", 3)
+    assert cacheutils.find_entry("foo-bar", "1.2")["sha256"] == "abc"
+
+
+def test_collect(
+    mock_settings_dir_download_tmp: str,
+    mock_settings_dir_install: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    blobs = {}
+    for version in ("0.1.0", "0.2.0", "0.3.0", "0.4.0"):
+        url = f"https://example.com/foo-{version}.zip"
+        blobs[version] = cacheutils.add_blob(
+            write(os.path.join(mock_settings_dir_download_tmp, "blob.part"), version.encode() * 256), url, version
+        )
+        archive = os.path.join(mock_settings_dir_download_tmp, f"foo-{version}.zip")
+        cacheutils.link(blobs[version], archive)
+        cacheutils.register_archive("foo", version, url, archive, version)
+
+    # 0.1.0 is the oldest download but was used last
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 10)
+    cacheutils.touch("foo", "0.1.0")
+
+    pinned = {("foo", "0.2.0")}
+    assert cacheutils.collect(max_size=2 * 1280, pinned=pinned, dry_run=True) == [
+        os.path.join(mock_settings_dir_download_tmp, "foo-0.3.0.zip"),
+        os.path.join(mock_settings_dir_download_tmp, "foo-0.4.0.zip"),
+    ]
+    assert len(cacheutils.load_index()["foo"]) == 4
+
+    removed = cacheutils.collect(max_size=3 * 1280, pinned=pinned)
+    assert removed == [os.path.join(mock_settings_dir_download_tmp, "foo-0.3.0.zip")]
+    assert not os.path.exists(removed[0])
+    assert not os.path.exists(blobs["0.3.0"])
+    assert cacheutils.find_blob("https://example.com/foo-0.3.0.zip") is None
+    assert sorted(cacheutils.load_index()["foo"]) == ["0.1.0", "0.2.0", "0.4.0"]
+    assert cacheutils.load_index()["foo"]["0.1.0"]["used"] == now + 10
+    assert not os.path.exists(cacheutils.build_usage_path())
+
+    # pinned archives survive any age
+    monkeypatch.setattr(time, "time", lambda: now + 3600)
+    assert len(cacheutils.collect(max_age=60, pinned=pinned)) == 2
+    assert list(cacheutils.load_index()["foo"]) == ["0.2.0"]
+
+
+def test_auto_collect(
+    mock_settings_dir_download_tmp: str,
+    mock_settings_dir_install: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    for version in ("0.1.0", "0.2.0"):
+        archive = write(os.path.join(mock_settings_dir_download_tmp, f"foo-{version}.zip"), b"x" * 1024 * 1024)
+        cacheutils.register_archive("foo", version, f"https://example.com/foo-{version}.zip", archive, None)
+    assert cacheutils.auto_collect() == []
+
+    # foo 0.1.0 is installed
+    monkeypatch.setattr(settings, "CACHE_MAX_SIZE", 0.5)
+    assert cacheutils.auto_collect(keep={("foo", "0.2.0")}) == []
+    assert cacheutils.auto_collect() == [archive]
+    assert list(cacheutils.load_index()["foo"]) == ["0.1.0"]
@@ -1,12 +1,16 @@
 # stdlib
+import json
 import os
 import shutil
+import subprocess
+import sys
+import threading
 
 # third party
 import pytest
 
 # package
-from packagerbuddy import cli, configutils, downloadutils
+from packagerbuddy import cli, configutils, downloadutils, indexutils, installutils, settings, trashutils
 
 
 def test_run():
@@ -25,13 +29,15 @@ def test_run_no_action(args: list[str]):
 
 
 @pytest.mark.parametrize("exists", [(True), (False)])
-def test_setup(exists: bool, monkeypatch: pytest.MonkeyPatch):
+def test_setup(exists: bool, tmp_path, monkeypatch: pytest.MonkeyPatch):
     def mock_os_path_exists(p: str) -> bool:
         return exists
 
-    def mock_os_makedirs(p: str):
+    def mock_os_makedirs(p: str, **kwargs):
         return
 
+    # the config file is written for real, keep it out of the home directory
+    monkeypatch.setattr(settings, "FILE_CONFIG", os.path.join(tmp_path, "software.json"))
     monkeypatch.setattr(os, "makedirs", mock_os_makedirs)
     monkeypatch.setattr(os.path, "exists", mock_os_path_exists)
 
@@ -88,6 +94,101 @@ def test_add_software(
         assert out == error + "\n"
 
 
+def test_add_software_concurrent(fix_file_config_tmp: str) -> None:
+    def add(index: int) -> None:
+        try:
+            cli.run(["add", "-s", "xyz", "-u", f"https://example.com/{index}/{{version}}/xyz.zip"])
+        except SystemExit as e:
+            codes[index] = e.code
+
+    # the same software added by concurrent automation, one wins and the others fail instead of overwriting it
+    codes: dict[int, int] = {}
+    threads = [threading.Thread(target=add, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [index for index, code in codes.items() if code == 0]
+    assert len(winners) == 1
+    assert configutils.get_url(configutils.load(), "xyz") == f"https://example.com/{winners[0]}/{{version}}/xyz.zip"
+
+
+@pytest.mark.parametrize(
+    ["entries", "exit_code", "error"],
+    [
+        (
+            {"xyz": "https://example.com/{version}/xyz.zip", "foo": "https://example.com/{version}/foo.zip"},
+            1,
+            "software already configured",
+        ),
+        ({"xyz": "https://example.com/{version}/xyz.zip", "abc": {"url": ""}}, 1, "no url provided"),
+        (
+            {"xyz": "https://example.com/{version}/xyz.zip", "abc": {"url": "https://example.com/{version}/abc.zip"}},
+            0,
+            "",
+        ),
+    ],
+)
+def test_add_software_file(
+    entries: dict,
+    exit_code: int,
+    error: str,
+    capsys,
+    tmp_path,
+    mock_settings_file_config: None,
+):
+    path = tmp_path / "entries.json"
+    path.write_text(json.dumps(entries))
+
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["add", "-f", str(path)])
+
+    assert exc.value.code == exit_code
+    out, _err = capsys.readouterr()
+
+    # all or nothing
+    config = configutils.load()
+    if exit_code != 0:
+        assert out == error + "\n"
+        assert "xyz" not in config
+    else:
+        assert configutils.get_url(config, "abc") == "https://example.com/{version}/abc.zip"
+        assert "xyz" in config
+
+
+@pytest.mark.parametrize(
+    ["names", "exit_code", "error"],
+    [
+        (["foo", "xyz"], 1, "software not found"),
+        (["foo", "bar"], 0, ""),
+    ],
+)
+def test_remove_software_file(
+    names: list[str],
+    exit_code: int,
+    error: str,
+    capsys,
+    tmp_path,
+    mock_settings_file_config: None,
+):
+    path = tmp_path / "names.json"
+    path.write_text(json.dumps(names))
+
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["remove", "-f", str(path)])
+
+    assert exc.value.code == exit_code
+    out, _err = capsys.readouterr()
+
+    config = configutils.load()
+    if exit_code != 0:
+        assert out == error + "\n"
+        assert "foo" in config
+    else:
+        assert config == {}
+
+
 @pytest.mark.parametrize(
     ["software", "exit_code", "error"],
     [
@@ -139,7 +240,9 @@ def test_download_software(
     mock_settings_dir_download: None,
     monkeypatch: pytest.MonkeyPatch,
 ):
-    def mock_downloadutils_download(software: str, version: str, config: dict | None = None) -> str:
+    def mock_downloadutils_download(
+        software: str, version: str, config: dict | None = None, progress=None, refresh: bool = False
+    ) -> str:
         path = os.path.join(fix_dir_downloaded, f"{software}-{version}.zip")
         return path
 
@@ -218,3 +321,322 @@ def test_list_installed_software(
     out, _err = capsys.readouterr()
 
     assert len(out.rstrip("\n").split("\n")) == count
+
+
+def test_install_software_multiple(
+    capsys,
+    tmp_path,
+    mock_settings_file_config: None,
+    mock_settings_dir_download: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"bar": ["0.1.0", "0.2.0"]}))
+
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["install", "-s", "foo", "-v", "0.1.0", "-m", str(manifest)])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    assert out.splitlines() == [
+        os.path.join(tmp_path, "foo-0.1.0"),
+        os.path.join(tmp_path, "bar-0.1.0"),
+        os.path.join(tmp_path, "bar-0.2.0"),
+    ]
+
+
+def test_install_software_stream(
+    tmp_path,
+    mock_settings_file_config: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    streamed: list[bool] = []
+
+    def mock_install_packages(packages: list, config: dict, progress=None, refresh: bool = False) -> dict:
+        streamed.append(settings.STREAM_INSTALL)
+        return {package: os.path.join(tmp_path, "-".join(package)) for package in packages}
+
+    monkeypatch.setattr(installutils, "install_packages", mock_install_packages)
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    monkeypatch.setattr(settings, "STREAM_INSTALL", False)
+
+    with pytest.raises(SystemExit):
+        cli.run(["install", "-s", "bar", "-v", "0.1.0", "--stream"])
+    assert streamed == [True]
+
+
+def test_install_software_partial_failure(
+    capsys,
+    tmp_path,
+    mock_settings_file_config: None,
+    mock_settings_dir_download: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    def mock_downloadutils_download(
+        software: str, version: str, config: dict, progress=None, refresh: bool = False
+    ) -> str:
+        raise ConnectionError("connection refused")
+
+    monkeypatch.setattr(downloadutils, "download", mock_downloadutils_download)
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["install", "-s", "foo", "-v", "0.3.0", "-s", "bar", "-v", "0.2.0"])
+
+    assert exc.value.code == 1
+    out, _err = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[0] == "failed to install foo 0.3.0: connection refused"
+    assert lines[1] == os.path.join(tmp_path, "bar-0.2.0")
+
+
+def test_install_software_profile(
+    capsys,
+    tmp_path,
+    mock_settings_file_config: None,
+    mock_settings_dir_download: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    monkeypatch.setattr(settings, "TRACE", "")
+    monkeypatch.setattr(settings, "CPROFILE", "")
+    # workers are told through the environment, let the monkeypatch restore it
+    monkeypatch.setenv("PB_TRACE", "")
+    monkeypatch.setenv("PB_CPROFILE", "")
+
+    trace = os.path.join(tmp_path, "trace.json")
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["install", "-s", "foo", "-v", "0.1.0", "--profile", trace])
+    assert exc.value.code == 0
+
+    with open(trace, "r") as fp:
+        events = json.load(fp)["traceEvents"]
+    names = {event["name"] for event in events}
+    assert {"install", "download", "unarchive", "cleanup"} <= names
+
+    download = next(event for event in events if event["name"] == "download")
+    assert download["args"]["cached"] is True
+    assert download["args"]["bytes"] > 0
+
+
+def test_install_software_scripts(
+    capsys,
+    tmp_path,
+    mock_settings_file_config: None,
+    mock_settings_dir_download: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    dir_scripts = os.path.join(tmp_path, "scripts")
+    os.makedirs(dir_scripts)
+    script = os.path.join(dir_scripts, "foo")
+    with open(script, "w") as fp:
+        fp.write("#!/bin/sh\necho installed $1 $2\nsleep 30\n")
+    os.chmod(script, 0o755)
+
+    monkeypatch.setattr(settings, "DIR_INSTALL", os.path.join(tmp_path, "installed"))
+    monkeypatch.setattr(settings, "DIR_SCRIPTS", dir_scripts)
+    monkeypatch.setattr(settings, "SCRIPT_TIMEOUT", 0.5)
+
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["install", "-s", "foo", "-v", "0.1.0"])
+
+    assert exc.value.code == 1
+    out, _err = capsys.readouterr()
+    assert out.startswith("failed to install foo 0.1.0:")
+    assert "timed out" in out
+
+    log = os.path.join(settings.DIR_INSTALL, ".logs", "foo-0.1.0", "foo.log")
+    with open(log, "r") as fp:
+        assert fp.read() == "installed foo 0.1.0\n"
+
+
+def test_install_software_unpaired(capsys, mock_settings_file_config: None):
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["install", "-s", "foo", "-v", "0.1.0", "-s", "bar"])
+
+    assert exc.value.code == 1
+    out, _err = capsys.readouterr()
+    assert out == "software and version arguments do not pair up\n"
+
+
+def test_reindex_installed_software(
+    capsys,
+    fix_dir_installed: str,
+    mock_settings_file_config: None,
+    mock_settings_dir_install: None,
+):
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["reindex"])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    assert out.splitlines() == [
+        os.path.join(fix_dir_installed, "bar-0.1.0"),
+        os.path.join(fix_dir_installed, "foo-0.1.0"),
+    ]
+
+
+def test_reindex_downloads(
+    capsys,
+    fix_dir_downloaded: str,
+    mock_settings_file_config: None,
+    mock_settings_dir_download: None,
+):
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["reindex", "--downloads"])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    assert out.splitlines() == [
+        os.path.join(fix_dir_downloaded, name)
+        for name in ("bar-0.1.0.tar.gz", "bar-0.2.0.tar.gz", "foo-0.1.0.zip", "foo-0.2.0.zip")
+    ]
+
+
+def test_collect_downloads(
+    capsys,
+    fix_dir_downloaded: str,
+    mock_settings_file_config: None,
+    mock_settings_dir_download: None,
+    mock_settings_dir_install: None,
+):
+    for name in os.listdir(fix_dir_downloaded):
+        os.utime(os.path.join(fix_dir_downloaded, name), (0, 0))
+
+    # archives of the installed foo 0.1.0 and bar 0.1.0 are pinned
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["gc", "--max-age", "1"])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    removed = [os.path.join(fix_dir_downloaded, name) for name in ("bar-0.2.0.tar.gz", "foo-0.2.0.zip")]
+    assert sorted(out.splitlines()) == removed
+    assert not any(os.path.exists(path) for path in removed)
+    assert os.path.exists(os.path.join(fix_dir_downloaded, "foo-0.1.0.zip"))
+
+
+def test_uninstall_software(
+    capsys,
+    fix_dir_installed: str,
+    mock_settings_dir_install: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "BACKGROUND_PURGE", False)
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["uninstall", "-s", "foo"])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    assert out == os.path.join(fix_dir_installed, "foo-0.1.0") + "\n"
+    assert not os.path.exists(os.path.join(fix_dir_installed, "foo-0.1.0"))
+    assert indexutils.find_installed_software() == [os.path.join(fix_dir_installed, "bar-0.1.0")]
+
+    # left in the trash until purged
+    assert len(os.listdir(trashutils.build_trash_path())) == 1
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["purge", "--workers", "2"])
+
+    assert exc.value.code == 0
+    assert os.listdir(trashutils.build_trash_path()) == []
+
+
+def test_sync_software(
+    capsys,
+    tmp_path,
+    fix_dir_installed: str,
+    mock_settings_file_config: None,
+    mock_settings_dir_download: None,
+    mock_settings_dir_install: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "BACKGROUND_PURGE", False)
+    # restored after the test, sync overrides them with --workers
+    monkeypatch.setattr(settings, "INSTALL_WORKERS", settings.INSTALL_WORKERS)
+    monkeypatch.setattr(settings, "DOWNLOAD_WORKERS", settings.DOWNLOAD_WORKERS)
+    manifest = os.path.join(tmp_path, "manifest.json")
+    with open(manifest, "w") as fp:
+        json.dump({"foo": ["0.1.0", "0.2.0"]}, fp)
+
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["sync", "-m", manifest, "--prune", "--dry-run"])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    assert out.splitlines() == [
+        "+ " + os.path.join(fix_dir_installed, "foo-0.2.0"),
+        "- " + os.path.join(fix_dir_installed, "bar-0.1.0"),
+    ]
+    assert len(indexutils.find_installed_software()) == 2
+
+    # leftover of a crashed install, reclaimed before installing
+    crashed = os.path.join(fix_dir_installed, "tmp-bar-0.3.0")
+    os.makedirs(crashed)
+
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["sync", "-m", manifest, "--prune", "--workers", "2"])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    assert out.splitlines()[-2:] == [
+        "+ " + os.path.join(fix_dir_installed, "foo-0.2.0"),
+        "- " + os.path.join(fix_dir_installed, "bar-0.1.0"),
+    ]
+    assert indexutils.find_installed_software() == [
+        os.path.join(fix_dir_installed, "foo-0.1.0"),
+        os.path.join(fix_dir_installed, "foo-0.2.0"),
+    ]
+    assert not os.path.exists(crashed)
+
+    # nothing left to do
+    with pytest.raises(SystemExit) as exc:
+        cli.run(["sync", "-m", manifest, "--prune"])
+
+    assert exc.value.code == 0
+    out, _err = capsys.readouterr()
+    assert out == ""
+
+
+# modules only install and download need, commands run from shell prompts must not load them
+STARTUP_EXCLUDED_MODULES = {"tarfile", "zipfile", "urllib.request", "subprocess", "shutil"}
+# generous, the budget catches heavy modules creeping in, not regressions of a few milliseconds
+STARTUP_IMPORT_BUDGET = 0.5
+
+
+def read_import_times(stderr: str) -> dict[str, int]:
+    # import time: self [us] | cumulative | imported package
+    imports: dict[str, int] = {}
+    for line in stderr.splitlines()[1:]:
+        if line.startswith("import time:"):
+            self_time, _, name = line.removeprefix("import time:").split("|")
+            imports[name.strip()] = int(self_time)
+    return imports
+
+
+@pytest.mark.parametrize("args", [["avail"], ["list"], ["sync", "-m", "{manifest}"]])
+def test_startup_budget(args: list[str], fix_file_config: str, fix_dir_installed: str, tmp_path):
+    # an up to date sync runs on every config management pass
+    manifest = os.path.join(tmp_path, "manifest.json")
+    with open(manifest, "w") as fp:
+        json.dump({"foo": "0.1.0", "bar": "0.1.0"}, fp)
+
+    env = {
+        **os.environ,
+        "PB_CONFIG": fix_file_config,
+        "PB_INSTALL": fix_dir_installed,
+        "PYTHONPATH": os.path.dirname(os.path.dirname(cli.__file__)),
+    }
+    code = f"from packagerbuddy import cli; cli.run({[arg.format(manifest=manifest) for arg in args]!r})"
+
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    imports = read_import_times(process.stderr)
+
+    assert "packagerbuddy.cli" in imports
+    assert not STARTUP_EXCLUDED_MODULES & set(imports)
+
+    # the interpreter imports its own startup modules regardless of the command
+    bootstrap = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True)
+    own = {name: us for name, us in imports.items() if name not in read_import_times(bootstrap.stderr)}
+    assert sum(own.values()) / 1e6 < STARTUP_IMPORT_BUDGET
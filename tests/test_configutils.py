@@ -1,11 +1,14 @@
 # stdlib
 import json
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 # third party
 import pytest
 
 # package
-from packagerbuddy import configutils
+from packagerbuddy import configutils, settings
 
 
 def test_load(mock_settings_file_config: None) -> None:
@@ -53,3 +56,124 @@ def test_remove(fix_file_config_tmp: str) -> None:
     assert "bar" in config
     configutils.remove_software(config, "bar")
     assert "bar" not in config
+
+
+def test_dump_atomic(fix_file_config_tmp: str) -> None:
+    os.chmod(fix_file_config_tmp, 0o644)
+    configutils.dump({"foo": "https://example.com/{version}/foo.zip"})
+
+    assert os.stat(fix_file_config_tmp).st_mode & 0o777 == 0o644
+    assert os.listdir(os.path.dirname(fix_file_config_tmp)).count(os.path.basename(fix_file_config_tmp)) == 1
+    assert not [name for name in os.listdir(os.path.dirname(fix_file_config_tmp)) if name.startswith(".tmp-")]
+
+
+def test_transaction_rollback(fix_file_config_tmp: str) -> None:
+    with pytest.raises(RuntimeError):
+        with configutils.transaction() as config:
+            config["foo"] = "https://example.com/{version}/foo.zip"
+            raise RuntimeError()
+
+    assert configutils.load() == {}
+
+
+def test_add_concurrent(fix_file_config_tmp: str) -> None:
+    # every writer works on its own stale copy, the transaction must not lose updates
+    def add(index: int) -> None:
+        configutils.add_software({}, f"foo{index}", "https://example.com/{version}/foo.zip")
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(add, range(50)))
+
+    assert len(configutils.load()) == 50
+
+
+def test_add_remove_batch(fix_file_config_tmp: str) -> None:
+    config = configutils.load()
+    entries = {
+        "foo": "https://example.com/{version}/foo.zip",
+        "bar": {"url": "https://example.com/{version}/bar.zip", "sha256": {"0.1.0": "abc"}},
+    }
+    configutils.add_software_batch(config, entries)
+    assert config == entries
+    assert configutils.load() == entries
+
+    configutils.remove_software_batch(config, ["foo", "bar"])
+    assert config == {}
+    assert configutils.load() == {}
+
+
+def test_load_entries(tmp_path) -> None:
+    path = tmp_path / "entries.json"
+    path.write_text(json.dumps(["foo", "bar"]))
+    assert list(configutils.load_entries(str(path))) == ["foo", "bar"]
+
+    path.write_text(json.dumps({"foo": "https://example.com/{version}/foo.zip"}))
+    assert configutils.load_entries(str(path)) == {"foo": "https://example.com/{version}/foo.zip"}
+
+
+def test_sqlite(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "FILE_CONFIG", str(tmp_path / "software.db"))
+    configutils.dump({"foo": "https://example.com/{version}/foo.zip"})
+
+    config = configutils.load()
+    assert isinstance(config, configutils.SQLiteConfig)
+    assert configutils.is_software_configured(config, "foo")
+    assert not configutils.is_software_configured(config, "bar")
+
+    entry = {"url": "https://example.com/{version}/bar.zip", "sha256": {"0.1.0": "abc"}}
+    configutils.add_software(config, "bar", entry)
+    assert sorted(config.keys()) == ["bar", "foo"]
+    assert configutils.get_sha256(config, "bar", "0.1.0") == "abc"
+
+    # shipped to install worker processes
+    assert dict(pickle.loads(pickle.dumps(config))) == dict(config)
+
+    configutils.remove_software_batch(config, ["foo", "bar"])
+    assert len(config) == 0
+
+    with pytest.raises(RuntimeError):
+        with configutils.transaction() as current:
+            current["foo"] = "https://example.com/{version}/foo.zip"
+            raise RuntimeError()
+    assert "foo" not in config
+
+
+def test_load_manifest(tmp_path) -> None:
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"foo": "0.1.0", "bar": ["0.1.0", "0.2.0"]}))
+    packages = configutils.load_manifest(str(manifest))
+    assert packages == [("foo", "0.1.0"), ("bar", "0.1.0"), ("bar", "0.2.0")]
+
+
+@pytest.mark.parametrize(
+    ["entry", "url", "sha256"],
+    [
+        ("https://example.com/{version}/foo.zip", "https://example.com/{version}/foo.zip", None),
+        ({"url": "https://example.com/{version}/foo.zip"}, "https://example.com/{version}/foo.zip", None),
+        (
+            {"url": "https://example.com/{version}/foo.zip", "sha256": {"0.1.0": "abc"}},
+            "https://example.com/{version}/foo.zip",
+            "abc",
+        ),
+    ],
+)
+def test_get_url_sha256(entry: str | dict, url: str, sha256: str | None) -> None:
+    config = {"foo": entry}
+    assert configutils.get_url(config, "foo") == url
+    assert configutils.get_sha256(config, "foo", "0.1.0") == sha256
+
+
+@pytest.mark.parametrize(
+    ["entry", "include", "exclude"],
+    [
+        ("https://example.com/{version}/foo.zip", [], []),
+        ({"url": "https://example.com/{version}/foo.zip", "include": "bin"}, ["bin"], []),
+        (
+            {"url": "https://example.com/{version}/foo.zip", "include": ["bin", "lib"], "exclude": ["*.md"]},
+            ["bin", "lib"],
+            ["*.md"],
+        ),
+    ],
+)
+def test_get_patterns(entry: str | dict, include: list[str], exclude: list[str]) -> None:
+    assert configutils.get_patterns({"foo": entry}, "foo") == (include, exclude)
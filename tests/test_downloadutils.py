@@ -1,11 +1,19 @@
 # stdlib
+import asyncio
+import hashlib
+import http.server
+import json
 import os
+import shutil
+import threading
+import time
+from urllib.error import HTTPError
 
 # third party
 import pytest
 
 # package
-from packagerbuddy import downloadutils
+from packagerbuddy import cacheutils, downloadutils, progressutils, settings
 
 
 def test_build_archive_path(fix_dir_downloaded: str, mock_settings_dir_download: None) -> None:
@@ -23,3 +31,414 @@ def test_build_archive_path(fix_dir_downloaded: str, mock_settings_dir_download:
 def test_find_archive(software: str, version: str, found: bool, mock_settings_dir_download: None):
     archive = downloadutils.find_archive(software, version)
     assert bool(archive) is found
+
+
+def serve(server: http.server.ThreadingHTTPServer, data: bytes) -> dict[str, str]:
+    with open(os.path.join(server.directory, "foo-0.1.0.zip"), "wb") as fp:
+        fp.write(data)
+    return {"foo": server.url + "/foo-{version}.zip"}
+
+
+def write_partial(directory: str, partial: bytes, origin: bytes | None) -> None:
+    path = os.path.join(directory, "foo-0.1.0.zip.part")
+    with open(path, "wb") as fp:
+        fp.write(partial)
+    if origin is not None:
+        etag = f'"{hashlib.md5(origin).hexdigest()}"'
+        with open(downloadutils.build_validators_path(path), "w") as fp:
+            json.dump({"etag": etag, "modified": None}, fp)
+
+
+@pytest.mark.parametrize(
+    ["partial", "ranges"],
+    [
+        (None, True),
+        (b"01234", True),
+        (b"01234", False),
+        (b"0123456789012", True),
+    ],
+)
+def test_download(
+    partial: bytes | None,
+    ranges: bool,
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    data = b"0123456789"
+    fix_http_server.ranges = ranges
+    config = serve(fix_http_server, data)
+
+    if partial is not None:
+        write_partial(mock_settings_dir_download_tmp, partial, data)
+
+    archive = downloadutils.download("foo", "0.1.0", config)
+    assert archive == os.path.join(mock_settings_dir_download_tmp, "foo-0.1.0.zip")
+    assert not os.path.exists(archive + ".part")
+    with open(archive, "rb") as fp:
+        assert fp.read() == data
+
+    if partial is not None:
+        assert fix_http_server.requests[0][1] == f"bytes={len(partial)}-"
+
+
+@pytest.mark.parametrize("origin", [b"abcdefghij", None])
+def test_download_resume_changed(
+    origin: bytes | None,
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    data = b"0123456789"
+    config = serve(fix_http_server, data)
+
+    # the partial bytes came from another file, or from a file nobody knows
+    write_partial(mock_settings_dir_download_tmp, b"abcde", origin)
+    archive = downloadutils.download("foo", "0.1.0", config)
+    with open(archive, "rb") as fp:
+        assert fp.read() == data
+    assert not os.path.exists(downloadutils.build_validators_path(archive + ".part"))
+
+
+def test_download_resume_after_disconnect(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # a single stream, probing for segments would add a request
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 1)
+    data = b"0123456789"
+    config = serve(fix_http_server, data)
+    fix_http_server.drop_after = 4
+
+    archive = downloadutils.download("foo", "0.1.0", config)
+    with open(archive, "rb") as fp:
+        assert fp.read() == data
+    assert [r[1] for r in fix_http_server.requests] == [None, "bytes=4-"]
+
+
+def test_download_segmented(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(downloadutils, "SEGMENT_SIZE", 10)
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 4)
+
+    data = bytes(range(256)) * 4
+    config = serve(fix_http_server, data)
+    config["foo"] = config["foo"].replace(fix_http_server.url, fix_http_server.url + "/redirect")
+
+    archive = downloadutils.download("foo", "0.1.0", config)
+    with open(archive, "rb") as fp:
+        assert fp.read() == data
+
+    # probe follows the redirect once, segments go straight to the final url
+    paths = [r[0] for r in fix_http_server.requests]
+    assert paths.count("/redirect/foo-0.1.0.zip") == 1
+    assert sorted(r[1] for r in fix_http_server.requests[2:]) == sorted(
+        ["bytes=0-255", "bytes=256-511", "bytes=512-767", "bytes=768-1023"]
+    )
+
+
+def test_download_not_found(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    config = {"foo": fix_http_server.url + "/{version}/foo.zip"}
+    with pytest.raises(HTTPError) as exc:
+        downloadutils.download("foo", "0.1.0", config)
+    assert exc.value.code == 404
+
+
+def test_find_archive_ignores_partial(mock_settings_dir_download_tmp: str) -> None:
+    with open(os.path.join(mock_settings_dir_download_tmp, "foo-0.1.0.zip.part"), "wb") as fp:
+        fp.write(b"")
+    assert downloadutils.find_archive("foo", "0.1.0") is None
+
+
+def test_find_archive_exact(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    config = serve(fix_http_server, b"0123456789")
+    archive = downloadutils.download("foo", "0.1.0", config)
+    with open(os.path.join(mock_settings_dir_download_tmp, "foo-0.1.0.1.zip"), "wb") as fp:
+        fp.write(b"")
+
+    assert downloadutils.find_archive("foo", "0.1.0") == archive
+    assert downloadutils.find_archive("foo", "0.1") is None
+    assert downloadutils.find_archive("foo", "0.1.0", config["foo"].format(version="0.1.0")) == archive
+    # the config points at another url
+    assert downloadutils.find_archive("foo", "0.1.0", "https://example.com/foo-0.1.0.zip") is None
+
+    os.remove(archive)
+    assert downloadutils.find_archive("foo", "0.1.0") is None
+
+
+def test_download_mirror(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    fix_mirror_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 1)
+    data = b"0123456789"
+    config = serve(fix_http_server, data)
+    missing = fix_http_server.url + "/missing"
+    monkeypatch.setattr(settings, "MIRRORS", [missing, fix_mirror_server.url + "/"])
+
+    # the mirror does not have the archive yet
+    archive = downloadutils.download("foo", "0.1.0", config)
+    assert [path for path, _ in fix_http_server.requests] == ["/missing/foo-0.1.0.zip", "/foo-0.1.0.zip"]
+
+    shutil.copyfile(archive, os.path.join(fix_mirror_server.directory, "foo-0.1.0.zip"))
+    os.remove(archive)
+    shutil.rmtree(cacheutils.build_cache_path())
+    fix_http_server.requests.clear()
+
+    archive = downloadutils.download("foo", "0.1.0", config)
+    assert [path for path, _ in fix_http_server.requests] == ["/missing/foo-0.1.0.zip"]
+    with open(archive, "rb") as fp:
+        assert fp.read() == data
+
+    # a mirror serving other content than the configured checksum is skipped
+    with open(os.path.join(fix_mirror_server.directory, "foo-0.1.0.zip"), "wb") as fp:
+        fp.write(b"corrupt")
+    config["foo"] = {"url": config["foo"], "sha256": {"0.1.0": hashlib.sha256(data).hexdigest()}}
+    os.remove(archive)
+    shutil.rmtree(cacheutils.build_cache_path())
+    fix_http_server.requests.clear()
+
+    archive = downloadutils.download("foo", "0.1.0", config)
+    assert [path for path, _ in fix_http_server.requests] == ["/missing/foo-0.1.0.zip", "/foo-0.1.0.zip"]
+    with open(archive, "rb") as fp:
+        assert fp.read() == data
+
+
+def test_get_archive_refresh(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    config = serve(fix_http_server, b"0123456789")
+    archive = downloadutils.get_archive("foo", "0.1.0", config)
+    entry = cacheutils.find_entry("foo", "0.1.0")
+    assert entry["etag"] == f'"{hashlib.md5(b"0123456789").hexdigest()}"'
+    assert entry["length"] == 10
+
+    # unchanged upstream, revalidated without a body
+    fix_http_server.requests.clear()
+    assert downloadutils.get_archive("foo", "0.1.0", config, refresh=True) == archive
+    assert len(fix_http_server.requests) == 1
+    assert downloadutils.get_archive("foo", "0.1.0", config) == archive
+    assert len(fix_http_server.requests) == 1
+
+    # a moving target changed upstream
+    blob = cacheutils.build_blob_path(entry["sha256"])
+    serve(fix_http_server, b"abcdefghijklmnop")
+    assert downloadutils.get_archive("foo", "0.1.0", config, refresh=True) == archive
+    with open(archive, "rb") as fp:
+        assert fp.read() == b"abcdefghijklmnop"
+    assert cacheutils.find_entry("foo", "0.1.0")["length"] == 16
+    assert not os.path.exists(blob)
+
+
+def test_get_archive_refresh_mirror(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    fix_mirror_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    config = serve(fix_http_server, b"abcdefghijklmnop")
+    with open(os.path.join(fix_mirror_server.directory, "foo-0.1.0.zip"), "wb") as fp:
+        fp.write(b"0123456789")
+    monkeypatch.setattr(settings, "MIRRORS", [fix_mirror_server.url])
+
+    archive = downloadutils.get_archive("foo", "0.1.0", config)
+    assert fix_http_server.requests == []
+
+    # the mirror lags behind upstream, a refresh goes to the upstream url and keeps its validators
+    assert downloadutils.get_archive("foo", "0.1.0", config, refresh=True) == archive
+    with open(archive, "rb") as fp:
+        assert fp.read() == b"abcdefghijklmnop"
+    assert cacheutils.find_entry("foo", "0.1.0")["etag"] is not None
+
+    fix_http_server.requests.clear()
+    assert downloadutils.get_archive("foo", "0.1.0", config, refresh=True) == archive
+    assert len(fix_http_server.requests) == 1
+
+
+def test_download_shared_blob(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 1)
+    data = b"0123456789"
+    url = serve(fix_http_server, data)["foo"]
+    config = {"foo": url, "bar": {"url": url, "sha256": {"0.1.0": hashlib.sha256(data).hexdigest()}}}
+
+    foo = downloadutils.download("foo", "0.1.0", config)
+    bar = downloadutils.download("bar", "0.1.0", config)
+    assert len(fix_http_server.requests) == 1
+    assert os.path.samefile(foo, bar)
+    assert downloadutils.get_archive("bar", "0.1.0", config) == bar
+
+
+def test_download_shared_checksum(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 1)
+    data = b"0123456789"
+    url = serve(fix_http_server, data)["foo"]
+    digest = hashlib.sha256(data).hexdigest()
+    config = {
+        "alpha": {"url": url, "sha256": {"0.1.0": digest}},
+        "beta": {"url": url.replace("foo-", "beta/foo-"), "sha256": {"0.1.0": digest}},
+    }
+
+    # aliases pinned to the same content download it once and share it
+    downloadutils.download("alpha", "0.1.0", config)
+    downloadutils.download("beta", "0.1.0", config)
+    assert len(fix_http_server.requests) == 1
+    assert downloadutils.find_verified_archive("alpha", "0.1.0", config) is not None
+    assert downloadutils.find_verified_archive("beta", "0.1.0", config) is not None
+
+
+def test_download_checksum_mismatch(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    url = serve(fix_http_server, b"corrupt")["foo"]
+    config = {"foo": {"url": url, "sha256": {"0.1.0": "abc"}}}
+    with pytest.raises(ValueError):
+        downloadutils.download("foo", "0.1.0", config)
+
+    assert os.listdir(mock_settings_dir_download_tmp) == []
+
+
+def test_download_progress(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    config = serve(fix_http_server, b"0123456789")
+    events: list[progressutils.Progress] = []
+    downloadutils.get_archive("foo", "0.1.0", config, progress=events.append)
+
+    assert events[-1].name == "foo-0.1.0.zip"
+    assert events[-1].received == events[-1].total == 10
+
+
+def test_get_archive_single_flight(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 1)
+    config = serve(fix_http_server, b"0123456789")
+    threads = [threading.Thread(target=downloadutils.get_archive, args=("foo", "0.1.0", config)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fix_http_server.requests) == 1
+    assert downloadutils.find_archive("foo", "0.1.0") is not None
+
+
+def test_can_stream(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    config = {"foo": fix_http_server.url + "/foo-{version}.tar.gz", "bar": fix_http_server.url + "/bar-{version}.zip"}
+    assert not downloadutils.can_stream("foo", "0.1.0", config)
+
+    monkeypatch.setattr(settings, "STREAM_INSTALL", True)
+    assert downloadutils.can_stream("foo", "0.1.0", config)
+    assert not downloadutils.can_stream("bar", "0.1.0", config)
+
+    # partial downloads are resumed instead
+    archive = downloadutils.build_archive_path("foo", "0.1.0", config["foo"])
+    open(downloadutils.build_partial_path(archive), "w").close()
+    assert not downloadutils.can_stream("foo", "0.1.0", config)
+    os.remove(downloadutils.build_partial_path(archive))
+
+    monkeypatch.setattr(settings, "MIRRORS", [fix_http_server.url])
+    assert not downloadutils.can_stream("foo", "0.1.0", config)
+
+
+def test_stream_archive(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    data = b"0123456789" * 1000
+    config = serve(fix_http_server, data)
+
+    def consume(archive: str, fp) -> bytes:
+        return fp.read(5)
+
+    # the consumer reads the head of the stream, the archive is cached in full
+    archive, head = downloadutils.stream_archive("foo", "0.1.0", config, consume)
+    assert head == b"01234"
+    with open(archive, "rb") as fp:
+        assert fp.read() == data
+    assert downloadutils.find_archive("foo", "0.1.0") == archive
+    assert cacheutils.find_entry("foo", "0.1.0")["length"] == len(data)
+
+    # an archive downloaded meanwhile is consumed from disk
+    fix_http_server.requests.clear()
+    assert downloadutils.stream_archive("foo", "0.1.0", config, consume) == (archive, b"01234")
+    assert fix_http_server.requests == []
+
+
+def test_stream_archive_checksum_mismatch(
+    fix_http_server: http.server.ThreadingHTTPServer,
+    mock_settings_dir_download_tmp: str,
+) -> None:
+    url = serve(fix_http_server, b"corrupt")["foo"]
+    config = {"foo": {"url": url, "sha256": {"0.1.0": "abc"}}}
+    with pytest.raises(ValueError):
+        downloadutils.stream_archive("foo", "0.1.0", config, lambda archive, fp: fp.read())
+
+    assert downloadutils.find_archive("foo", "0.1.0") is None
+    assert not os.path.exists(
+        downloadutils.build_partial_path(os.path.join(mock_settings_dir_download_tmp, "foo-0.1.0.zip"))
+    )
+
+
+def test_get_archive_async_limits(mock_settings_dir_download_tmp: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "DOWNLOAD_WORKERS", 3)
+    monkeypatch.setattr(settings, "DOWNLOAD_HOST_WORKERS", 1)
+
+    lock = threading.Lock()
+    active: dict[str, int] = {}
+    peak: dict[str, int] = {}
+
+    def mock_get_archive(software: str, version: str, config: dict, progress=None, refresh: bool = False) -> str:
+        if version == "0.0.0":
+            raise ConnectionError("connection refused")
+        with lock:
+            active[software] = active.get(software, 0) + 1
+            peak[software] = max(peak.get(software, 0), active[software])
+        time.sleep(0.01)
+        with lock:
+            active[software] -= 1
+        return f"{software}-{version}"
+
+    monkeypatch.setattr(downloadutils, "get_archive", mock_get_archive)
+
+    config = {"foo": "https://foo.example.com/{version}.zip", "bar": "https://bar.example.com/{version}.zip"}
+    packages = [(software, str(i)) for software in config for i in range(3)] + [("foo", "0.0.0")]
+
+    async def gather() -> list[str | BaseException]:
+        limits = downloadutils.build_limits()
+        tasks = [
+            downloadutils.get_archive_async(software, version, config, limits=limits) for software, version in packages
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = dict(zip(packages, asyncio.run(gather())))
+    assert results[("foo", "1")] == "foo-1"
+    assert isinstance(results[("foo", "0.0.0")], ConnectionError)
+    assert peak == {"foo": 1, "bar": 1}
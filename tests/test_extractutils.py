@@ -0,0 +1,224 @@
+# stdlib
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import zipfile
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import extractutils, settings
+
+FILES = {f"root/dir{i % 3}/file{i}.txt": f"content {i}".encode() * (i + 1) for i in range(20)}
+
+
+@pytest.mark.parametrize(
+    ["name", "expected"],
+    [
+        ("foo/bar.txt", os.path.join("foo", "bar.txt")),
+        ("/foo/../bar.txt", os.path.join("foo", "bar.txt")),
+        ("./foo/", "foo"),
+        ("", ""),
+    ],
+)
+def test_sanitize_name(name: str, expected: str) -> None:
+    assert extractutils.sanitize_name(name) == expected
+
+
+@pytest.mark.parametrize(["strip", "prefix"], [("", "root"), ("root/", "")])
+def test_extract_zip(strip: str, prefix: str, tmp_path) -> None:
+    archive = os.path.join(tmp_path, "archive.zip")
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fp:
+        fp.writestr("root/", "")
+        for name, data in FILES.items():
+            fp.writestr(name, data)
+
+    target = os.path.join(tmp_path, "target")
+    extractutils.extract_zip(archive, target, strip=strip, workers=4)
+
+    for name, data in FILES.items():
+        with open(os.path.join(target, prefix, name[len("root/") :]), "rb") as fp:
+            assert fp.read() == data
+
+
+def test_extract_tar(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # force the larger files through the inline path
+    monkeypatch.setattr(extractutils, "CHUNK_SIZE", 64)
+
+    archive = os.path.join(tmp_path, "archive.tar.gz")
+    with tarfile.open(archive, "w:gz") as tar:
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o755
+            tar.addfile(info, io.BytesIO(data))
+
+        link = tarfile.TarInfo("root/link.txt")
+        link.type = tarfile.LNKTYPE
+        link.linkname = "root/dir0/file0.txt"
+        link.mode = 0o755
+        tar.addfile(link)
+
+        symlink = tarfile.TarInfo("root/symlink.txt")
+        symlink.type = tarfile.SYMTYPE
+        symlink.linkname = "dir1/file1.txt"
+        tar.addfile(symlink)
+
+    target = os.path.join(tmp_path, "target")
+    with tarfile.open(archive, "r|gz") as tar:
+        extractutils.extract_tar(tar, target, workers=4)
+
+    for name, data in FILES.items():
+        path = os.path.join(target, name)
+        with open(path, "rb") as fp:
+            assert fp.read() == data
+        assert os.stat(path).st_mode & 0o777 == 0o755
+
+    assert os.path.samefile(os.path.join(target, "root", "link.txt"), os.path.join(target, "root", "dir0", "file0.txt"))
+    assert os.readlink(os.path.join(target, "root", "symlink.txt")) == "dir1/file1.txt"
+
+
+@pytest.mark.parametrize("filters", [True, False])
+@pytest.mark.parametrize("linkname", ["{outside}", "../../outside", "../lib/../../outside"])
+def test_extract_tar_outside(linkname: str, filters: bool, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # python versions without extraction filters
+    if not filters:
+        monkeypatch.delattr(tarfile, "data_filter")
+    outside = os.path.join(tmp_path, "outside")
+    os.makedirs(outside)
+
+    archive = os.path.join(tmp_path, "archive.tar")
+    with tarfile.open(archive, "w") as tar:
+        symlink = tarfile.TarInfo("root/lib")
+        symlink.type = tarfile.SYMTYPE
+        symlink.linkname = linkname.format(outside=outside)
+        tar.addfile(symlink)
+
+        info = tarfile.TarInfo("root/lib/evil")
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b"evil"))
+
+    # a link leaving the target is refused before anything is written through it
+    target = os.path.join(tmp_path, "target")
+    with pytest.raises(tarfile.TarError), tarfile.open(archive, "r|") as tar:
+        extractutils.extract_tar(tar, target)
+    assert os.listdir(outside) == []
+
+
+@pytest.mark.parametrize(
+    ["include", "exclude", "name", "selected"],
+    [
+        ([], ["docs"], "root/docs/index.html", False),
+        ([], ["docs"], "root/bin/docs", True),
+        ([], ["docs"], "root/bin/tool", True),
+        (["bin", "lib/"], [], "root/bin/tool", True),
+        (["bin", "lib/"], [], "root/lib/", True),
+        (["bin", "lib/"], [], "root/share/man/tool.1", False),
+        (["bin"], ["*.pdb"], "root/bin/tool.pdb", False),
+        (["bin/*.sh"], [], "root/bin/tool.sh", True),
+        (["bin"], [], "root/", True),
+        (["bin"], [], "other/bin/tool", False),
+    ],
+)
+def test_build_filter(include: list[str], exclude: list[str], name: str, selected: bool) -> None:
+    assert extractutils.build_filter([], [], root="root") is None
+    select = extractutils.build_filter(include, exclude, root="root")
+    assert select(name) is selected
+
+
+def test_extract_zip_select(tmp_path) -> None:
+    archive = os.path.join(tmp_path, "archive.zip")
+    with zipfile.ZipFile(archive, "w") as fp:
+        for name, data in FILES.items():
+            fp.writestr(name, data)
+
+    target = os.path.join(tmp_path, "target")
+    select = extractutils.build_filter(["dir0", "dir1"], ["*/file1.txt"], root="root")
+    extractutils.extract_zip(archive, target, strip="root/", select=select)
+
+    assert sorted(os.listdir(target)) == ["dir0", "dir1"]
+    assert "file1.txt" not in os.listdir(os.path.join(target, "dir1"))
+    assert "file4.txt" in os.listdir(os.path.join(target, "dir1"))
+
+
+def test_extract_tar_select(tmp_path) -> None:
+    archive = os.path.join(tmp_path, "archive.tar")
+    with tarfile.open(archive, "w") as tar:
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        # a hardlink to an excluded file can not be extracted
+        link = tarfile.TarInfo("root/dir0/link.txt")
+        link.type = tarfile.LNKTYPE
+        link.linkname = "root/dir2/file2.txt"
+        tar.addfile(link)
+
+    target = os.path.join(tmp_path, "target")
+    with tarfile.open(archive, "r|") as tar:
+        extractutils.extract_tar(tar, target, select=extractutils.build_filter(["dir0"], [], root="root"))
+
+    assert os.listdir(os.path.join(target, "root")) == ["dir0"]
+    assert sorted(os.listdir(os.path.join(target, "root", "dir0"))) == sorted(
+        name.rpartition("/")[2] for name in FILES if name.startswith("root/dir0/")
+    )
+
+
+@pytest.mark.parametrize(
+    ["archive", "compression"],
+    [
+        ("foo.tar", ""),
+        ("foo.tgz", "gz"),
+        ("foo.tar.gz", "gz"),
+        ("foo.tar.bz2", "bz2"),
+        ("foo.tar.xz", "xz"),
+        ("foo.tar.zst", "zst"),
+    ],
+)
+def test_get_compression(archive: str, compression: str) -> None:
+    assert extractutils.get_compression(archive) == compression
+
+
+def test_find_decompressor(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(shutil, "which", lambda command: f"/usr/bin/{command}")
+    assert extractutils.find_decompressor("xz") == ["xz", "-dc", "-T0"]
+    assert extractutils.find_decompressor("") is None
+
+    monkeypatch.setattr(settings, "EXTERNAL_DECOMPRESSORS", False)
+    assert extractutils.find_decompressor("xz") is None
+
+
+@pytest.mark.parametrize("stream", [True, False])
+@pytest.mark.parametrize("external", [True, False])
+@pytest.mark.parametrize("compression", ["", "gz", "bz2", "xz"])
+def test_open_tar(compression: str, external: bool, stream: bool, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "EXTERNAL_DECOMPRESSORS", external)
+
+    archive = os.path.join(tmp_path, "archive.tar" + (f".{compression}" if compression else ""))
+    with tarfile.open(archive, f"w:{compression}") as tar:
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    # a stream is only read forward, as a response body would be
+    with open(archive, "rb") as fp, extractutils.open_tar(archive, fp if stream else None) as tar:
+        assert [member.name for member in tar] == list(FILES)
+
+
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd not found")
+def test_open_tar_zst(tmp_path) -> None:
+    archive = os.path.join(tmp_path, "archive.tar")
+    with tarfile.open(archive, "w") as tar:
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    subprocess.check_call(["zstd", "-q", "--rm", archive])
+
+    with extractutils.open_tar(archive + ".zst") as tar:
+        assert [member.name for member in tar] == list(FILES)
@@ -0,0 +1,153 @@
+# stdlib
+import errno
+import fcntl
+import hashlib
+import io
+import os
+import subprocess
+import threading
+import time
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import fileutils, settings
+
+
+def test_write_atomic(tmp_path) -> None:
+    path = os.path.join(tmp_path, "sub", "file.txt")
+    fileutils.write_atomic(path, "foo")
+    fileutils.write_atomic(path, "bar")
+
+    with open(path, "r") as fp:
+        assert fp.read() == "bar"
+    assert os.listdir(os.path.dirname(path)) == ["file.txt"]
+
+
+def test_stream() -> None:
+    source = io.BytesIO(b"x" * 10)
+    target = io.BytesIO()
+    digest = hashlib.sha256()
+    size = fileutils.stream(source, target, chunk_size=3, digest=digest)
+    assert size == 10
+    assert target.getvalue() == b"x" * 10
+    assert digest.hexdigest() == hashlib.sha256(b"x" * 10).hexdigest()
+
+
+def test_tee() -> None:
+    source = io.BytesIO(b"x" * 10)
+    target = io.BytesIO()
+    digest = hashlib.sha256()
+    received: list[int] = []
+    tee = fileutils.Tee(source, target, digest, received.append)
+    assert tee.read(4) == b"x" * 4
+    assert target.getvalue() == b"x" * 4
+
+    # the rest the consumer did not read still ends up in the target
+    assert tee.drain(chunk_size=3) == 10
+    assert target.getvalue() == b"x" * 10
+    assert digest.hexdigest() == hashlib.sha256(b"x" * 10).hexdigest()
+    assert received == [4, 3, 3]
+
+
+def test_load_dump_json(tmp_path) -> None:
+    path = os.path.join(tmp_path, "file.json")
+    assert fileutils.load_json(path) is None
+    assert fileutils.load_json(path, {}) == {}
+
+    fileutils.dump_json(path, {"foo": "bar"})
+    assert fileutils.load_json(path) == {"foo": "bar"}
+
+
+def test_lock(tmp_path) -> None:
+    path = os.path.join(tmp_path, "locks", "file.lock")
+    with fileutils.lock(path):
+        assert os.path.exists(path)
+
+
+@pytest.mark.parametrize("locks", ["flock", "file"])
+def test_lock_exclusive(locks: str, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LOCKS", locks)
+    path = os.path.join(tmp_path, "file.lock")
+    events: list[str] = []
+
+    def hold() -> None:
+        with fileutils.lock(path):
+            events.append("enter")
+            time.sleep(0.2)
+            events.append("exit")
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert events == ["enter", "exit", "enter", "exit"]
+    assert not os.path.exists(f"{path}.excl")
+
+
+@pytest.mark.parametrize("locks", ["flock", "file"])
+def test_lock_non_blocking(locks: str, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LOCKS", locks)
+    path = os.path.join(tmp_path, "file.lock")
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def hold() -> None:
+        with fileutils.lock(path):
+            acquired.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    acquired.wait()
+    try:
+        with pytest.raises(BlockingIOError):
+            with fileutils.lock(path, blocking=False):
+                pass
+    finally:
+        release.set()
+        thread.join()
+
+    with fileutils.lock(path, blocking=False):
+        pass
+
+
+def test_lock_unsupported(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def mock_flock(fp, operation: int) -> None:
+        raise OSError(errno.ENOLCK, "no locks available")
+
+    monkeypatch.setattr(fcntl, "flock", mock_flock)
+    path = os.path.join(tmp_path, "file.lock")
+    with fileutils.lock(path):
+        assert os.path.exists(f"{path}.excl")
+    assert not os.path.exists(f"{path}.excl")
+
+
+def test_is_stale_lock(tmp_path) -> None:
+    path = os.path.join(tmp_path, "file.lock.excl")
+    assert not fileutils.is_stale_lock(path)
+
+    # a crashed holder on this host
+    process = subprocess.Popen(["true"])
+    process.wait()
+    with open(path, "w") as fp:
+        fp.write(f"{os.uname().nodename}:{process.pid}")
+    assert fileutils.is_stale_lock(path)
+
+    with open(path, "w") as fp:
+        fp.write(fileutils.build_lock_owner())
+    assert not fileutils.is_stale_lock(path)
+
+    # holders on other hosts stop refreshing the lock
+    with open(path, "w") as fp:
+        fp.write("otherhost:1")
+    assert not fileutils.is_stale_lock(path)
+    stale = time.time() - fileutils.LOCK_STALE_AGE - 1
+    os.utime(path, (stale, stale))
+    assert fileutils.is_stale_lock(path)
+
+    with fileutils.lock_file(path):
+        assert open(path).read() == fileutils.build_lock_owner()
@@ -0,0 +1,48 @@
+# stdlib
+import http.server
+import os
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import httputils
+
+
+@pytest.mark.parametrize(
+    ["url", "expected"],
+    [
+        ("http://example.com/foo", ("http", "example.com", 80)),
+        ("https://example.com/foo", ("https", "example.com", 443)),
+        ("https://example.com:8443/foo", ("https", "example.com", 8443)),
+    ],
+)
+def test_build_pool_key(url: str, expected: tuple[str, str, int]) -> None:
+    assert httputils.build_pool_key(url) == expected
+
+
+def test_open_url_reuses_connection(fix_http_server: http.server.ThreadingHTTPServer) -> None:
+    with open(os.path.join(fix_http_server.directory, "foo.txt"), "wb") as fp:
+        fp.write(b"foo")
+
+    key = httputils.build_pool_key(fix_http_server.url)
+    connections = set()
+    for _ in range(3):
+        with httputils.open_url(fix_http_server.url + "/redirect/foo.txt") as response:
+            assert response.read() == b"foo"
+            assert response.url == fix_http_server.url + "/foo.txt"
+        connections.update(id(conn) for conn in httputils.POOL[key])
+
+    assert len(connections) == 1
+    assert len(fix_http_server.requests) == 6
+
+
+def test_open_url_unread_response(fix_http_server: http.server.ThreadingHTTPServer) -> None:
+    with open(os.path.join(fix_http_server.directory, "foo.txt"), "wb") as fp:
+        fp.write(b"foo")
+
+    with httputils.open_url(fix_http_server.url + "/foo.txt"):
+        pass
+
+    # a partially read response can not be reused
+    assert not httputils.POOL.get(httputils.build_pool_key(fix_http_server.url))
@@ -0,0 +1,81 @@
+# stdlib
+import os
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import indexutils, installutils
+
+
+@pytest.mark.parametrize(
+    ["software", "version", "expected"],
+    [
+        (None, None, 2),
+        ("foo", None, 1),
+        ("bar", None, 1),
+        ("bar", "0.1.0", 1),
+        ("foo", "0.1.0", 1),
+        ("foo", "0.3.0", 0),
+    ],
+)
+def test_find_installed_software(
+    software: str | None,
+    version: str | None,
+    expected: int,
+    mock_settings_dir_install: None,
+):
+    result = indexutils.find_installed_software(software, version)
+    assert len(result) == expected
+
+
+@pytest.mark.parametrize(
+    ["name", "config", "expected"],
+    [
+        ("foo-0.1.0", None, ("foo", "0.1.0")),
+        ("foo-bar-0.1.0", None, ("foo", "bar-0.1.0")),
+        ("foo-bar-0.1.0", {"foo": "", "foo-bar": ""}, ("foo-bar", "0.1.0")),
+    ],
+)
+def test_split_install_name(name: str, config: dict | None, expected: tuple[str, str]):
+    assert indexutils.split_install_name(name, config) == expected
+
+
+def test_index(fix_dir_installed: str, mock_settings_dir_install: None):
+    assert not os.path.exists(indexutils.build_index_path())
+    assert indexutils.is_software_installed("foo", "0.1.0")
+    assert os.path.exists(indexutils.build_index_path())
+
+    # the index is the source of truth, not the file system
+    os.makedirs(os.path.join(fix_dir_installed, "foo-0.2.0"))
+    assert not indexutils.is_software_installed("foo", "0.2.0")
+
+    indexutils.register_software("foo", "0.2.0")
+    assert indexutils.is_software_installed("foo", "0.2.0")
+
+    installutils.uninstall_software(installutils.build_install_path("foo", "0.1.0"))
+    assert not indexutils.is_software_installed("foo", "0.1.0")
+    assert indexutils.find_installed_software() == [
+        os.path.join(fix_dir_installed, "bar-0.1.0"),
+        os.path.join(fix_dir_installed, "foo-0.2.0"),
+    ]
+
+
+def test_reindex(fix_dir_installed: str, mock_settings_dir_install: None):
+    indexutils.load_index()
+    os.makedirs(os.path.join(fix_dir_installed, "foo-0.2.0"))
+    os.makedirs(os.path.join(fix_dir_installed, "tmp-foo-0.3.0"))
+
+    index = indexutils.reindex()
+    assert sorted(index) == ["bar-0.1.0", "foo-0.1.0", "foo-0.2.0"]
+    assert index["foo-0.2.0"] == {"software": "foo", "version": "0.2.0"}
+
+
+def test_plan_sync(fix_dir_installed: str, mock_settings_dir_install: None) -> None:
+    packages = [("foo", "0.1.0"), ("foo", "0.2.0"), ("foo", "0.2.0")]
+    assert indexutils.plan_sync(packages) == ([("foo", "0.2.0")], [])
+    assert indexutils.plan_sync(packages, prune=True) == (
+        [("foo", "0.2.0")],
+        [os.path.join(fix_dir_installed, "bar-0.1.0")],
+    )
+    assert indexutils.plan_sync([("bar", "0.1.0"), ("foo", "0.1.0")], prune=True) == ([], [])
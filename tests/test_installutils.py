@@ -1,11 +1,15 @@
 # stdlib
+import http.server
 import os
+import shutil
+import subprocess
+import threading
 
 # third party
 import pytest
 
 # package
-from packagerbuddy import installutils
+from packagerbuddy import fileutils, indexutils, installutils, settings, storeutils, traceutils, trashutils
 
 
 def test_build_temporary_install_path(fix_dir_installed: str, mock_settings_dir_install: None):
@@ -29,21 +33,330 @@ def test_get_archive_name():
 
 
 @pytest.mark.parametrize(
-    ["software", "version", "expected"],
+    ["archive", "root", "stripped", "expected"],
     [
-        (None, None, 2),
-        ("foo", None, 1),
-        ("bar", None, 1),
-        ("bar", "0.1.0", 1),
-        ("foo", "0.1.0", 1),
-        ("foo", "0.3.0", 0),
+        ("foo-0.2.0.zip", "foo-0.2.0", True, "foo.txt"),
+        ("foo-0.2.0.zip", "other", False, "foo-0.2.0/foo.txt"),
+        ("bar-0.2.0.tar.gz", "bar-0.2.0", False, "bar-0.2.0/bar.txt"),
     ],
 )
-def test_find_installed_software(
-    software: str | None,
-    version: str | None,
-    expected: int,
+def test_unarchive(archive: str, root: str, stripped: bool, expected: str, fix_dir_downloaded: str, tmp_path):
+    result = installutils.unarchive(os.path.join(fix_dir_downloaded, archive), str(tmp_path), root=root)
+    assert result is stripped
+    assert os.path.isfile(os.path.join(tmp_path, expected))
+
+
+@pytest.mark.parametrize(["software", "ext"], [("foo", ".zip"), ("bar", ".tar.gz")])
+def test_extract(
+    software: str,
+    ext: str,
+    fix_dir_downloaded: str,
+    fix_dir_installed: str,
+    mock_settings_dir_install: None,
+):
+    config = {software: f"https://example.com/{{version}}/{software}-{{version}}{ext}"}
+    archive = os.path.join(fix_dir_downloaded, f"{software}-0.2.0{ext}")
+    dir_install = installutils.extract(archive, software, "0.2.0", config)
+
+    assert dir_install == os.path.join(fix_dir_installed, f"{software}-0.2.0")
+    assert os.listdir(dir_install) == [f"{software}.txt"]
+    assert not os.path.exists(installutils.build_temporary_install_path(software, "0.2.0"))
+
+
+@pytest.mark.parametrize(["software", "ext"], [("foo", ".zip"), ("bar", ".tar.gz")])
+def test_extract_exclude(
+    software: str,
+    ext: str,
+    fix_dir_downloaded: str,
+    fix_dir_installed: str,
+    mock_settings_dir_install: None,
+):
+    config = {software: {"url": f"https://example.com/{{version}}/{software}-{{version}}{ext}", "exclude": "*.txt"}}
+    archive = os.path.join(fix_dir_downloaded, f"{software}-0.2.0{ext}")
+    dir_install = installutils.extract(archive, software, "0.2.0", config)
+    assert os.listdir(dir_install) == []
+
+
+def test_extract_existing(
+    fix_dir_downloaded: str,
+    fix_dir_installed: str,
+    mock_settings_dir_install: None,
+):
+    config = {"foo": "https://example.com/{version}/foo-{version}.zip"}
+    archive = os.path.join(fix_dir_downloaded, "foo-0.2.0.zip")
+    dir_install = installutils.build_install_path("foo", "0.2.0")
+    os.makedirs(dir_install)
+    open(os.path.join(dir_install, "placed"), "w").close()
+
+    # a directory placed by hand is left alone
+    with pytest.raises(FileExistsError):
+        installutils.extract(archive, "foo", "0.2.0", config)
+    assert os.listdir(dir_install) == ["placed"]
+
+    # the leftover of a crashed install is moved to the trash
+    installutils.save_state("foo", "0.2.0", "verified", archive=archive)
+    assert installutils.extract(archive, "foo", "0.2.0", config) == dir_install
+    assert os.listdir(dir_install) == ["foo.txt"]
+    assert len(os.listdir(trashutils.build_trash_path())) == 1
+
+
+def test_extract_store(
+    fix_dir_downloaded: str,
+    fix_dir_installed: str,
     mock_settings_dir_install: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "STORE", "hardlink")
+    config = {"bar": "https://example.com/{version}/bar-{version}.tar.gz"}
+    # installed without a store in the test data
+    installutils.uninstall_software(installutils.build_install_path("bar", "0.1.0"))
+
+    dirs = []
+    for version in ("0.1.0", "0.2.0"):
+        archive = os.path.join(fix_dir_downloaded, f"bar-{version}.tar.gz")
+        dirs.append(installutils.extract(archive, "bar", version, config))
+
+    # both versions ship the same bar.txt
+    assert os.path.samefile(os.path.join(dirs[0], "bar.txt"), os.path.join(dirs[1], "bar.txt"))
+
+    installutils.uninstall_software(dirs[0])
+    trashutils.purge()
+    assert os.stat(os.path.join(dirs[1], "bar.txt")).st_nlink == 2
+
+
+def test_uninstall_packages_missing(
+    fix_dir_installed: str, mock_settings_dir_install: None, monkeypatch: pytest.MonkeyPatch
+):
+    foo = installutils.build_install_path("foo", "0.1.0")
+    bar = installutils.build_install_path("bar", "0.1.0")
+    assert indexutils.find_installed_software() == [bar, foo]
+
+    # removed by hand, it only leaves the index
+    shutil.rmtree(foo)
+    assert installutils.uninstall_software(foo) is None
+    assert indexutils.find_installed_software() == [bar]
+
+    # installs trashed before a failing rename leave the index as well
+    os.makedirs(foo)
+    indexutils.reindex()
+    move_to_trash = trashutils.move_to_trash
+
+    def mock_move_to_trash(dir_install: str) -> str:
+        if dir_install == foo:
+            raise PermissionError(dir_install)
+        return move_to_trash(dir_install)
+
+    monkeypatch.setattr(trashutils, "move_to_trash", mock_move_to_trash)
+    with pytest.raises(PermissionError):
+        installutils.uninstall_packages([bar, foo])
+    assert indexutils.find_installed_software() == [foo]
+
+
+def test_extract_store_leftover(
+    fix_dir_downloaded: str,
+    fix_dir_installed: str,
+    mock_settings_dir_install: None,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "STORE", "hardlink")
+    config = {"bar": "https://example.com/{version}/bar-{version}.tar.gz"}
+    archive = os.path.join(fix_dir_downloaded, "bar-0.2.0.tar.gz")
+    dir_install = installutils.extract(archive, "bar", "0.2.0", config)
+    assert os.path.exists(storeutils.build_manifest_path(dir_install))
+    assert not os.path.exists(storeutils.build_manifest_path(installutils.build_temporary_install_path("bar", "0.2.0")))
+
+    # the leftover goes to the trash with its own manifest, the new install keeps the one it was extracted with
+    installutils.save_state("bar", "0.2.0", "verified", archive=archive)
+    assert installutils.extract(archive, "bar", "0.2.0", config) == dir_install
+    assert os.path.exists(storeutils.build_manifest_path(dir_install))
+
+    installutils.uninstall_software(dir_install)
+    trashutils.purge()
+    objects = os.path.join(storeutils.build_store_path(), "objects")
+    assert not any(files for _, _, files in os.walk(objects))
+
+
+def test_install_packages_concurrent(
+    fix_dir_downloaded: str,
+    fix_http_server: http.server.ThreadingHTTPServer,
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "DIR_DOWNLOAD", os.path.join(tmp_path, "cache"))
+    monkeypatch.setattr(settings, "DIR_INSTALL", os.path.join(tmp_path, "install"))
+    monkeypatch.setattr(settings, "DIR_SCRIPTS", os.path.join(tmp_path, "scripts"))
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 1)
+    shutil.copyfile(
+        os.path.join(fix_dir_downloaded, "foo-0.1.0.zip"), os.path.join(fix_http_server.directory, "foo-0.1.0.zip")
+    )
+    config = {"foo": fix_http_server.url + "/foo-{version}.zip"}
+
+    # concurrent installs of the same package, as if started by separate processes
+    results: list[dict] = []
+    threads = [
+        threading.Thread(target=lambda: results.append(installutils.install_packages([("foo", "0.1.0")], config)))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    dir_install = installutils.build_install_path("foo", "0.1.0")
+    assert [result[("foo", "0.1.0")] for result in results] == [dir_install] * 3
+    assert len(fix_http_server.requests) == 1
+    assert os.listdir(dir_install) == ["foo.txt"]
+    assert indexutils.is_software_installed("foo", "0.1.0")
+
+
+@pytest.fixture
+def fix_install_tmp(
+    fix_dir_downloaded: str,
+    fix_http_server: http.server.ThreadingHTTPServer,
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> dict[str, str]:
+    monkeypatch.setattr(settings, "DIR_DOWNLOAD", os.path.join(tmp_path, "cache"))
+    monkeypatch.setattr(settings, "DIR_INSTALL", os.path.join(tmp_path, "install"))
+    monkeypatch.setattr(settings, "DIR_SCRIPTS", os.path.join(tmp_path, "scripts"))
+    monkeypatch.setattr(settings, "DOWNLOAD_SEGMENTS", 1)
+    os.makedirs(settings.DIR_SCRIPTS)
+    shutil.copyfile(
+        os.path.join(fix_dir_downloaded, "foo-0.1.0.zip"), os.path.join(fix_http_server.directory, "foo-0.1.0.zip")
+    )
+    return {"foo": fix_http_server.url + "/foo-{version}.zip"}
+
+
+def test_install_packages_stream(
+    fix_dir_downloaded: str,
+    fix_http_server: http.server.ThreadingHTTPServer,
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "DIR_DOWNLOAD", os.path.join(tmp_path, "cache"))
+    monkeypatch.setattr(settings, "DIR_INSTALL", os.path.join(tmp_path, "install"))
+    monkeypatch.setattr(settings, "DIR_SCRIPTS", os.path.join(tmp_path, "scripts"))
+    monkeypatch.setattr(settings, "STREAM_INSTALL", True)
+    shutil.copyfile(
+        os.path.join(fix_dir_downloaded, "bar-0.1.0.tar.gz"),
+        os.path.join(fix_http_server.directory, "bar-0.1.0.tar.gz"),
+    )
+    config = {"bar": fix_http_server.url + "/bar-{version}.tar.gz"}
+
+    # the main process profiles the streamed extraction, it does not profile itself again
+    monkeypatch.setattr(settings, "CPROFILE", os.path.join(tmp_path, "install.prof"))
+    unpacked: list[bool] = []
+    unpack = installutils.unpack
+    monkeypatch.setattr(installutils, "unpack", lambda *args: unpacked.append(len(args) == 5) or unpack(*args))
+
+    # extracted from the response, the archive is cached along the way
+    dir_install = installutils.install_packages([("bar", "0.1.0")], config)[("bar", "0.1.0")]
+    assert unpacked == [True]
+    assert os.listdir(dir_install) == ["bar.txt"]
+    assert indexutils.is_software_installed("bar", "0.1.0")
+    assert installutils.load_state("bar", "0.1.0") == {}
+    assert not os.path.exists(traceutils.build_profile_path("bar-0.1.0"))
+
+    archive = os.path.join(settings.DIR_DOWNLOAD, "bar-0.1.0.tar.gz")
+    with open(archive, "rb") as fp, open(os.path.join(fix_dir_downloaded, "bar-0.1.0.tar.gz"), "rb") as expected:
+        assert fp.read() == expected.read()
+
+
+def test_install_packages_resume(
+    fix_install_tmp: dict[str, str],
+    fix_http_server: http.server.ThreadingHTTPServer,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    def mock_place(config: dict, software: str, version: str, stripped: bool = False) -> str:
+        raise KeyboardInterrupt
+
+    # crash after extracting
+    with monkeypatch.context() as context:
+        context.setattr(installutils, "place", mock_place)
+        with pytest.raises(KeyboardInterrupt):
+            installutils.install_packages([("foo", "0.1.0")], fix_install_tmp)
+
+    state = installutils.load_state("foo", "0.1.0")
+    assert state["phase"] == "extracted"
+    assert not indexutils.is_software_installed("foo", "0.1.0")
+    assert installutils.reclaim() == []
+
+    # the rerun publishes the extracted directory as is
+    dir_temp = installutils.build_temporary_install_path("foo", "0.1.0")
+    open(os.path.join(dir_temp, "marker"), "w").close()
+    fix_http_server.requests.clear()
+
+    dir_install = installutils.install_packages([("foo", "0.1.0")], fix_install_tmp)[("foo", "0.1.0")]
+    assert sorted(os.listdir(dir_install)) == ["foo.txt", "marker"]
+    assert fix_http_server.requests == []
+    assert indexutils.is_software_installed("foo", "0.1.0")
+    assert installutils.load_state("foo", "0.1.0") == {}
+
+
+def test_install_packages_resume_scripts(fix_install_tmp: dict[str, str], monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "SCRIPT_TIMEOUT", 0.1)
+    script = os.path.join(settings.DIR_SCRIPTS, "foo")
+    with open(script, "w") as fp:
+        fp.write("#!/bin/sh\nsleep 10\n")
+    os.chmod(script, 0o755)
+
+    result = installutils.install_packages([("foo", "0.1.0")], fix_install_tmp)[("foo", "0.1.0")]
+    assert isinstance(result, subprocess.TimeoutExpired)
+    assert installutils.load_state("foo", "0.1.0")["phase"] == "placed"
+
+    # placed but not installed until its scripts succeed
+    dir_install = installutils.build_install_path("foo", "0.1.0")
+    assert os.path.isdir(dir_install)
+    assert not indexutils.is_software_installed("foo", "0.1.0")
+    assert indexutils.reindex() == {}
+
+    with open(script, "w") as fp:
+        fp.write("#!/bin/sh\ntouch scripted\n")
+    assert installutils.install_packages([("foo", "0.1.0")], fix_install_tmp)[("foo", "0.1.0")] == dir_install
+    assert sorted(os.listdir(dir_install)) == ["foo.txt", "scripted"]
+    assert indexutils.is_software_installed("foo", "0.1.0")
+
+
+def test_install_packages_resume_failed_script(
+    fix_install_tmp: dict[str, str], fix_http_server: http.server.ThreadingHTTPServer
 ):
-    result = installutils.find_installed_software(software, version)
-    assert len(result) == expected
+    script = os.path.join(settings.DIR_SCRIPTS, "foo")
+    with open(script, "w") as fp:
+        fp.write("#!/bin/sh\necho run >> ../runs\nexit 3\n")
+    os.chmod(script, 0o755)
+
+    result = installutils.install_packages([("foo", "0.1.0")], fix_install_tmp)[("foo", "0.1.0")]
+    assert isinstance(result, subprocess.CalledProcessError)
+    assert installutils.load_state("foo", "0.1.0")["phase"] == "placed"
+    assert not indexutils.is_software_installed("foo", "0.1.0")
+
+    # the rerun only runs the scripts again, the placed directory is kept as is
+    dir_install = installutils.build_install_path("foo", "0.1.0")
+    open(os.path.join(dir_install, "marker"), "w").close()
+    fix_http_server.requests.clear()
+    with open(script, "w") as fp:
+        fp.write("#!/bin/sh\necho run >> ../runs\n")
+
+    assert installutils.install_packages([("foo", "0.1.0")], fix_install_tmp)[("foo", "0.1.0")] == dir_install
+    assert sorted(os.listdir(dir_install)) == ["foo.txt", "marker"]
+    assert fix_http_server.requests == []
+    assert indexutils.is_software_installed("foo", "0.1.0")
+    with open(os.path.join(settings.DIR_INSTALL, "runs"), "r") as fp:
+        assert fp.read() == "run\nrun\n"
+
+
+def test_reclaim(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    for name in ("foo-0.1.0", "foo-0.2.0", "foo-0.3.0"):
+        os.makedirs(os.path.join(tmp_path, f"tmp-{name}"))
+    installutils.save_state("foo", "0.2.0", "extracted", stripped=False)
+
+    # an install in progress holds the lock
+    with fileutils.lock(installutils.build_lock_path("foo", "0.3.0")):
+        reclaimed = installutils.reclaim()
+
+    assert [os.path.basename(path).rpartition("-")[0] for path in reclaimed] == ["tmp-foo-0.1.0"]
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("tmp-")) == [
+        "tmp-foo-0.2.0",
+        "tmp-foo-0.3.0",
+    ]
@@ -14,6 +14,8 @@ from packagerbuddy import pathutils
         ("/root/dir/file.tgz", "/root/dir/file", ".tgz"),
         ("/root/dir/file.tar.gz", "/root/dir/file", ".tar.gz"),
         ("/root/dir/file.tar.bz2", "/root/dir/file", ".tar.bz2"),
+        ("/root/dir/file.tar.xz", "/root/dir/file", ".tar.xz"),
+        ("/root/dir/file.tar.zst", "/root/dir/file", ".tar.zst"),
         ("/root/dir/file.dot1.dot2.tar.gz", "/root/dir/file.dot1.dot2", ".tar.gz"),
     ],
 )
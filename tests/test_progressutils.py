@@ -0,0 +1,70 @@
+# stdlib
+import io
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import progressutils
+
+
+def test_create_reporter() -> None:
+    events: list[progressutils.Progress] = []
+    update = progressutils.create_reporter("foo.zip", 100, events.append, offset=20)
+    update(30)
+    update(50)
+
+    assert [event.received for event in events] == [50, 100]
+    assert events[-1].total == 100
+    assert events[-1].rate > 0
+    assert events[-1].eta == 0
+
+
+@pytest.mark.parametrize(
+    ["size", "expected"],
+    [(10, "10.0 B"), (2048, "2.0 KB"), (3 * 1024**3, "3.0 GB")],
+)
+def test_format_size(size: int, expected: str) -> None:
+    assert progressutils.format_size(size) == expected
+
+
+@pytest.mark.parametrize(
+    ["seconds", "expected"],
+    [(None, "--:--"), (75, "01:15"), (3725, "1:02:05")],
+)
+def test_format_duration(seconds: float | None, expected: str) -> None:
+    assert progressutils.format_duration(seconds) == expected
+
+
+def test_format_progress() -> None:
+    progress = progressutils.Progress("foo.zip", 512, 1024, 1024.0, 0.5)
+    assert progressutils.format_progress(progress) == "foo.zip  50% 512.0 B 1.0 KB/s eta 00:00"
+
+    progress = progressutils.Progress("foo.zip", 512, None, 1024.0, None)
+    assert progressutils.format_progress(progress) == "foo.zip 512.0 B 1.0 KB/s"
+
+
+def test_log_renderer() -> None:
+    stream = io.StringIO()
+    render = progressutils.create_log_renderer(stream, interval=3600)
+    render(progressutils.Progress("foo.zip", 10, 100, 1.0, 90.0))
+    render(progressutils.Progress("foo.zip", 20, 100, 1.0, 80.0))
+    render(progressutils.Progress("foo.zip", 100, 100, 1.0, 0.0))
+
+    # throttled until the download completes
+    assert len(stream.getvalue().splitlines()) == 2
+
+
+def test_bar_renderer() -> None:
+    stream = io.StringIO()
+    render = progressutils.create_bar_renderer(stream)
+    render(progressutils.Progress("foo.zip", 100, 100, 1.0, 0.0))
+    assert stream.getvalue().startswith("\r\033[K[" + "#" * progressutils.BAR_WIDTH + "] foo.zip")
+    assert stream.getvalue().endswith("\n")
+
+
+def test_create_renderer() -> None:
+    stream = io.StringIO()
+    render = progressutils.create_renderer(stream)
+    render(progressutils.Progress("foo.zip", 100, 100, 1.0, 0.0))
+    assert stream.getvalue() == "foo.zip 100% 100.0 B 1.0 B/s eta 00:00\n"
@@ -1,8 +1,13 @@
 # stdlib
 import os
+import subprocess
+import time
+
+# third party
+import pytest
 
 # package
-from packagerbuddy import scriptutils
+from packagerbuddy import scriptutils, settings
 
 
 def test_find_scripts(
@@ -14,3 +19,99 @@ def test_find_scripts(
         os.path.join(fix_dir_scripts, "foo"),
         os.path.join(fix_dir_scripts, "foo-0.1.0"),
     ]
+
+
+def write_script(directory: str, name: str, body: str) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "w") as fp:
+        fp.write("#!/bin/sh\n" + body)
+    os.chmod(path, 0o755)
+    return path
+
+
+def is_running(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as fp:
+            return fp.read().split()[2] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_read_dependencies(tmp_path) -> None:
+    script = write_script(str(tmp_path), "foo-0.1.0", "# after: foo\n# after: bar, baz\necho foo\n")
+    assert scriptutils.read_dependencies(script) == ["foo", "bar", "baz"]
+
+
+def test_run_script_log(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    script = write_script(str(tmp_path), "foo", 'echo "$1 $2"\necho error >&2\nexit 3\n')
+    log = scriptutils.build_log_path("foo", "0.1.0", script)
+
+    assert scriptutils.run_script(script, "foo", "0.1.0", log=log) == 3
+    with open(log, "r") as fp:
+        assert fp.read() == "foo 0.1.0\nerror\n"
+
+
+def test_run_script_timeout(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(scriptutils, "KILL_GRACE_PERIOD", 0.1)
+    pid_file = os.path.join(tmp_path, "pid")
+    script = write_script(str(tmp_path), "foo", f"sleep 30 &\necho $! > {pid_file}\nwait\n")
+
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        scriptutils.run_script(script, "foo", "0.1.0", timeout=0.5)
+    assert time.monotonic() - start < 5
+
+    # the background process started by the script is killed along with it
+    with open(pid_file, "r") as fp:
+        pid = int(fp.read())
+    deadline = time.monotonic() + 2
+    while is_running(pid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not is_running(pid)
+
+
+def test_run_scripts_failure(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    events = os.path.join(tmp_path, "events")
+
+    directory = str(tmp_path)
+    first = write_script(directory, "foo", "exit 3\n")
+    second = write_script(directory, "foo-0.1.0", f"# after: foo\necho $0 >> {events}\n")
+    third = write_script(directory, "foo-0.1.0-extra", f"# after: foo-0.1.0\necho $0 >> {events}\n")
+
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        scriptutils.run_scripts([first, second, third], "foo", "0.1.0", workers=2)
+    assert exc.value.returncode == 3
+
+    # dependents of a failed script do not run
+    assert not os.path.exists(events)
+
+
+def test_run_scripts(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    events = os.path.join(tmp_path, "events")
+    body = f'echo "start $0" >> {events}\nsleep 0.2\necho "end $0" >> {events}\n'
+
+    directory = str(tmp_path)
+    first = write_script(directory, "foo", body)
+    second = write_script(directory, "foo-0.1.0", "# after: foo\n" + body)
+    independent = write_script(directory, "foo-0.1.0-extra", body)
+
+    results = scriptutils.run_scripts([first, second, independent], "foo", "0.1.0", workers=2)
+    assert results == {first: 0, second: 0, independent: 0}
+
+    with open(events, "r") as fp:
+        lines = fp.read().splitlines()
+    # independent scripts run side by side, dependents wait
+    assert lines.index(f"start {independent}") < lines.index(f"end {first}")
+    assert lines.index(f"end {first}") < lines.index(f"start {second}")
+
+
+def test_run_scripts_circular(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "DIR_INSTALL", str(tmp_path))
+    first = write_script(str(tmp_path), "foo", "# after: foo-0.1.0\n")
+    second = write_script(str(tmp_path), "foo-0.1.0", "# after: foo\n")
+
+    with pytest.raises(ValueError):
+        scriptutils.run_scripts([first, second], "foo", "0.1.0")
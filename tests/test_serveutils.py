@@ -0,0 +1,76 @@
+# stdlib
+import http.server
+import os
+from urllib.error import HTTPError
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import httputils, serveutils
+
+
+@pytest.fixture
+def fix_archive(fix_mirror_server: http.server.ThreadingHTTPServer) -> str:
+    path = os.path.join(fix_mirror_server.directory, "foo-0.1.0.zip")
+    with open(path, "wb") as fp:
+        fp.write(b"0123456789")
+    return path
+
+
+def test_find_archive(fix_archive: str) -> None:
+    directory = os.path.dirname(fix_archive)
+    for name in ("foo-0.1.0.zip.part", ".index.json", "notes.txt"):
+        with open(os.path.join(directory, name), "w") as fp:
+            fp.write("")
+
+    assert serveutils.find_archive(directory, "/foo-0.1.0.zip") == fix_archive
+    assert serveutils.find_archive(directory, "/foo-0.1.0.zip?query") == fix_archive
+    assert serveutils.find_archive(directory, "/foo-0.1.0.zip.part") is None
+    assert serveutils.find_archive(directory, "/.index.json") is None
+    assert serveutils.find_archive(directory, "/notes.txt") is None
+    assert serveutils.find_archive(directory, "/../foo-0.1.0.zip") is None
+    assert serveutils.find_archive(directory, "/%2E%2E%2Ffoo-0.1.0.zip") is None
+    assert serveutils.find_archive(directory, "/bar-0.1.0.zip") is None
+
+
+@pytest.mark.parametrize(
+    ["header", "expected"],
+    [
+        (None, None),
+        ("bytes=2-5", (2, 5)),
+        ("bytes=2-", (2, 9)),
+        ("bytes=-3", (7, 9)),
+        ("bytes=5-100", (5, 9)),
+        ("bytes=-", None),
+        ("bytes=0-1,4-5", None),
+    ],
+)
+def test_parse_range(header: str | None, expected: tuple[int, int] | None) -> None:
+    assert serveutils.parse_range(header, 10) == expected
+
+
+def test_serve(fix_mirror_server: http.server.ThreadingHTTPServer, fix_archive: str) -> None:
+    url = f"{fix_mirror_server.url}/foo-0.1.0.zip"
+    with httputils.open_url(url) as response:
+        assert response.status == 200
+        assert response.read() == b"0123456789"
+
+    with httputils.open_url(url, {"Range": "bytes=4-"}) as response:
+        assert response.status == 206
+        assert response.getheader("Content-Range") == "bytes 4-9/10"
+        assert response.read() == b"456789"
+
+    with httputils.open_url(url, method="HEAD") as response:
+        assert response.getheader("Content-Length") == "10"
+        assert response.read() == b""
+
+    with pytest.raises(HTTPError) as exc:
+        with httputils.open_url(url, {"Range": "bytes=10-"}):
+            pass
+    assert exc.value.code == 416
+
+    with pytest.raises(HTTPError) as exc:
+        with httputils.open_url(f"{fix_mirror_server.url}/.index.json"):
+            pass
+    assert exc.value.code == 404
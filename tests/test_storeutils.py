@@ -0,0 +1,58 @@
+# stdlib
+import hashlib
+import os
+import shutil
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import settings, storeutils
+from tests.conftest import create_install
+
+
+def test_build_object_key(tmp_path) -> None:
+    path = os.path.join(tmp_path, "file")
+    with open(path, "wb") as fp:
+        fp.write(b"")
+    os.chmod(path, 0o755)
+    assert storeutils.build_object_key(path, "abc") == "abc-755"
+
+
+def test_deduplicate_release(mock_settings_dir_install_tmp: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "STORE", "hardlink")
+    foo1 = os.path.join(mock_settings_dir_install_tmp, "foo-0.1.0")
+    foo2 = os.path.join(mock_settings_dir_install_tmp, "foo-0.2.0")
+    storeutils.deduplicate(create_install(foo1, {"bin/foo": b"foo", "version": b"0.1.0"}), foo1)
+    storeutils.deduplicate(create_install(foo2, {"bin/foo": b"foo", "version": b"0.2.0"}), foo2)
+
+    shared = os.path.join(foo1, "bin", "foo")
+    assert os.path.samefile(shared, os.path.join(foo2, "bin", "foo"))
+    assert not os.path.samefile(os.path.join(foo1, "version"), os.path.join(foo2, "version"))
+    assert os.stat(shared).st_nlink == 3
+
+    key = storeutils.build_object_key(shared, hashlib.sha256(b"foo").hexdigest())
+    obj = storeutils.build_object_path(key)
+
+    shutil.rmtree(foo1)
+    storeutils.release(foo1)
+    assert os.path.exists(obj)
+    assert not os.path.exists(storeutils.build_manifest_path(foo1))
+
+    shutil.rmtree(foo2)
+    storeutils.release(foo2)
+    assert not os.path.exists(obj)
+
+
+def test_share_reflink_fallback(mock_settings_dir_install_tmp: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "STORE", "reflink")
+    monkeypatch.setattr(storeutils, "reflink", lambda source, target: False)
+
+    obj = os.path.join(mock_settings_dir_install_tmp, "obj")
+    path = os.path.join(mock_settings_dir_install_tmp, "path")
+    for p in (obj, path):
+        with open(p, "wb") as fp:
+            fp.write(b"foo")
+
+    storeutils.share(obj, path)
+    assert os.path.samefile(obj, path)
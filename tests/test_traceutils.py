@@ -0,0 +1,61 @@
+# stdlib
+import json
+import os
+import pstats
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import settings, traceutils
+
+
+def test_span_disabled(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "TRACE", "")
+    with traceutils.span("download", software="foo") as trace:
+        trace["bytes"] = 10
+    assert trace == {"software": "foo", "bytes": 10}
+
+
+def test_span(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = os.path.join(tmp_path, "trace.jsonl")
+    monkeypatch.setattr(settings, "TRACE", path)
+
+    with traceutils.span("download", software="foo") as trace:
+        trace["bytes"] = 10
+    with pytest.raises(ValueError):
+        with traceutils.span("unarchive", software="foo"):
+            raise ValueError("corrupt archive")
+
+    with open(path, "r") as fp:
+        events = [json.loads(line) for line in fp]
+    assert [event["name"] for event in events] == ["download", "unarchive"]
+    assert events[0]["args"] == {"software": "foo", "bytes": 10}
+    assert events[0]["ph"] == "X"
+    assert events[0]["pid"] == os.getpid()
+    assert events[1]["args"]["error"] == "corrupt archive"
+
+
+def test_export_chrome(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = os.path.join(tmp_path, "trace.json")
+    monkeypatch.setattr(settings, "TRACE", path)
+
+    with traceutils.span("download"):
+        pass
+    assert not os.path.exists(path)
+
+    traceutils.export()
+    with open(path, "r") as fp:
+        trace = json.load(fp)
+    assert [event["name"] for event in trace["traceEvents"]] == ["download"]
+    assert not os.path.exists(traceutils.build_events_path())
+
+
+def test_profile(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = os.path.join(tmp_path, "install.prof")
+    monkeypatch.setattr(settings, "CPROFILE", path)
+    assert traceutils.build_profile_path("foo-0.1.0") == f"{path}.foo-0.1.0"
+
+    with traceutils.profile(path):
+        sorted(range(1000))
+    assert pstats.Stats(path).total_calls > 0
@@ -0,0 +1,57 @@
+# stdlib
+import os
+
+# third party
+import pytest
+
+# package
+from packagerbuddy import installutils, settings, storeutils, trashutils
+from tests.conftest import create_install
+
+FILES = {f"dir{index % 3}/file{index}.txt": str(index).encode() for index in range(10)}
+
+
+def test_move_to_trash(mock_settings_dir_install_tmp: str) -> None:
+    dirs = []
+    for _ in range(2):
+        # the same version installed and uninstalled again before a purge
+        dir_install = installutils.build_install_path("foo", "0.1.0")
+        create_install(dir_install, FILES)
+        dirs.append(trashutils.move_to_trash(dir_install))
+        assert not os.path.exists(dir_install)
+
+    assert dirs[0] != dirs[1]
+    assert sorted(os.listdir(trashutils.build_trash_path())) == sorted(os.path.basename(path) for path in dirs)
+
+
+def test_purge(mock_settings_dir_install_tmp: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "STORE", "hardlink")
+    digests: dict[str, str] = {}
+    for version in ("0.1.0", "0.2.0"):
+        dir_install = installutils.build_install_path("foo", version)
+        create_install(dir_install, FILES)
+        path = os.path.join(dir_install, "dir0", "file0.txt")
+        storeutils.deduplicate({path: "abc"}, dir_install)
+        digests[version] = path
+
+    trashutils.move_to_trash(installutils.build_install_path("foo", "0.1.0"))
+    assert len(trashutils.purge(workers=4)) == 1
+    assert os.listdir(trashutils.build_trash_path()) == []
+
+    # the object stays referenced by the remaining install
+    assert os.stat(digests["0.2.0"]).st_nlink == 2
+
+    trashutils.move_to_trash(installutils.build_install_path("foo", "0.2.0"))
+    trashutils.purge()
+    assert os.listdir(os.path.join(storeutils.build_store_path(), "manifests")) == []
+    assert not any(files for _, _, files in os.walk(os.path.join(storeutils.build_store_path(), "objects")))
+
+
+def test_spawn_purge(mock_settings_dir_install_tmp: str) -> None:
+    dir_install = installutils.build_install_path("foo", "0.1.0")
+    create_install(dir_install, FILES)
+    trashutils.move_to_trash(dir_install)
+
+    process = trashutils.spawn_purge()
+    assert process.wait(timeout=30) == 0
+    assert os.listdir(trashutils.build_trash_path()) == []